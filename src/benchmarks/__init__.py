@@ -0,0 +1,14 @@
+import typing as t
+import time
+
+def timeit(fn: t.Callable[[], t.Any], repeat: int = 3) -> float:
+    """Best wall time (in seconds) of `repeat` calls to fn"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def report(name: str, rows: int, seconds: float):
+    print("{:<40} {:>12,.0f} rows/sec ({:.3f}s)".format(name, rows / seconds, seconds))
@@ -0,0 +1,94 @@
+"""Qualtrics fetch throughput against a local stand-in, by export concurrency
+
+Each survey's export takes `export_duration` seconds to complete, and every
+request `latency` seconds to answer. Reports full and incremental fetches,
+and unchanged fetches of surveys with and without a continuation token
+(the latter are skipped, as are the former with skip_unchanged).
+
+Run from src/ with: python -m benchmarks.fetch [nsurveys] [nrows] [ncolumns]
+"""
+import sys
+import time
+import tempfile
+import typing as t
+from pathlib import Path
+
+from doit.remote.model import OpenBlob
+from doit.remote.qualtrics.impl import fetch_qualtrics_blobs
+from doit.remote.blob import write_blob_ref
+
+from .qualtrics_server import MockQualtrics, mock_surveys
+from . import report
+
+def fetch(
+    server: MockQualtrics,
+    max_concurrency: int,
+    blob_dir: Path | None = None,
+    previous: bool = False,
+    drop_tokens: bool = False,
+    skip_unchanged: bool = False,
+) -> float:
+    # Fetches every survey, writing blobs to blob_dir if given (without their
+    # continuation tokens if drop_tokens)
+    settings = server.settings()
+
+    def blob_callback(name: str, blob: OpenBlob):
+        if blob_dir is not None:
+            if drop_tokens:
+                source_info = blob.info.source_info.copy(update={ "continuation_token": None })
+                blob = blob._replace(info=blob.info.copy(update={ "source_info": source_info }))
+            write_blob_ref(blob, blob_dir / "{}.blob".format(name), blob_dir / ".objects", overwrite=True)
+
+    previous_blobs = { id: blob_dir / "{}.blob".format(id) for id in server.surveys } if previous and blob_dir else {}
+
+    start = time.perf_counter()
+    errors = fetch_qualtrics_blobs(
+        { id: id for id in server.surveys },
+        lambda _: lambda _: None,
+        blob_callback,
+        max_concurrency,
+        settings,
+        previous_blobs=previous_blobs,
+        skip_unchanged=skip_unchanged,
+    )
+    seconds = time.perf_counter() - start
+
+    if errors:
+        raise next(iter(errors.values()))
+
+    return seconds
+
+def main(nsurveys: int = 8, nrows: int = 2000, ncolumns: int = 50, latency: float = 0.05, export_duration: float = 2.0):
+    surveys = mock_surveys(nsurveys, nrows, ncolumns)
+    server = MockQualtrics(surveys, latency, export_duration).start()
+
+    rows = nsurveys * nrows
+
+    try:
+        for max_concurrency in (1, 4, 8):
+            report("fetch (max concurrency {})".format(max_concurrency), rows, fetch(server, max_concurrency))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            blob_dir = Path(tmpdir)
+            report("fetch + write blobs", rows, fetch(server, 8, blob_dir))
+
+            # Changed surveys are exported from their continuation tokens
+            server.surveys = {
+                id: s._replace(survey_json=s.survey_json.replace('"2020-01-01T00:00:00Z"', '"2020-01-02T00:00:00Z"'))
+                    for id, s in surveys.items()
+            }
+            report("fetch (incremental)", rows, fetch(server, 8, blob_dir, previous=True))
+
+            # Unchanged surveys are still exported from their tokens, unless
+            # asked to skip them...
+            report("fetch (unchanged)", rows, fetch(server, 8, blob_dir, previous=True))
+            report("fetch (unchanged, skip_unchanged)", rows, fetch(server, 8, blob_dir, previous=True, skip_unchanged=True))
+
+            # ...and skip the export altogether without one
+            fetch(server, 8, blob_dir, previous=True, drop_tokens=True)
+            report("fetch (unchanged, no token)", rows, fetch(server, 8, blob_dir, previous=True, drop_tokens=True))
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main(*(int(i) for i in sys.argv[1:]))
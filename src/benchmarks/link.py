@@ -0,0 +1,125 @@
+"""Linker throughput with and without error stack capture
+
+Run from src/ with: python -m benchmarks.link [nrows]
+"""
+import sys
+import random
+
+from doit.common.table import (
+    Some,
+    Omitted,
+    capture_error_stacks,
+)
+
+from doit.sanitizedtable.model import (
+    SanitizedColumnId,
+    SanitizedCodedColumnInfo,
+    SanitizedSimpleColumnInfo,
+    SanitizedTableData,
+    SanitizedTableInfo,
+)
+
+from doit.study.view import (
+    CodedDstLink,
+    InstrumentLinkerSpec,
+    LinkerSpec,
+    QuestionSrcLink,
+    SimpleDstLink,
+)
+
+from doit.service.link import (
+    link_table,
+    link_tableinfo,
+)
+
+from . import timeit, report
+
+NCODED = 20
+NTEXT = 5
+
+def make_table(nrows: int):
+    codes = { 1: "one", 2: "two", 3: "three", 4: "four" }
+    coded = tuple(
+        SanitizedCodedColumnInfo(
+            id=SanitizedColumnId("coded_{}".format(i)),
+            prompt="Coded {}".format(i),
+            codes=codes,
+            sortkey=str(i),
+            value_type='ordinal',
+        ) for i in range(NCODED)
+    )
+    text = tuple(
+        SanitizedSimpleColumnInfo(
+            id=SanitizedColumnId("text_{}".format(i)),
+            prompt="Text {}".format(i),
+            sanitizer_checksum=None,
+            sortkey=str(NCODED + i),
+        ) for i in range(NTEXT)
+    )
+    columns = coded + text
+
+    rng = random.Random(0)
+
+    # 1 in 20 coded cells is an unknown code, so the error path is exercised too
+    def coded_value():
+        r = rng.random()
+        if r < 0.1:
+            return Omitted()
+        if r < 0.15:
+            return Some(5)
+        return Some(rng.randint(1, 4))
+
+    data = SanitizedTableData.from_cells(
+        tuple(c.id for c in columns),
+        (
+            tuple(coded_value() for _ in coded) + tuple(Some(str(rng.random())) for _ in text)
+                for _ in range(nrows)
+        ),
+    )
+
+    info = SanitizedTableInfo(
+        name="bench",
+        title="bench",
+        source="bench",
+        data_checksum="",
+        schema_checksum="",
+        columns=columns,
+    )
+
+    spec = InstrumentLinkerSpec(
+        instrument_name="bench",
+        exclude_filters=(),
+        linker_specs=(
+            *(
+                LinkerSpec(
+                    src=QuestionSrcLink(source_column_name=c.id.name, source_value_map={}),
+                    dst=CodedDstLink(
+                        linked_name=c.id.name,
+                        value_from_tag={ v: k for k, v in codes.items() },
+                        value_type='ordinal',
+                    ),
+                ) for c in coded
+            ),
+            *(
+                LinkerSpec(
+                    src=QuestionSrcLink(source_column_name=c.id.name, source_value_map={}),
+                    dst=SimpleDstLink(linked_name=c.id.name, value_type='text'),
+                ) for c in text
+            ),
+        ),
+        aggregate_specs=(),
+    )
+
+    return data, link_tableinfo(info, spec)
+
+def main(nrows: int = 20000):
+    data, linker = make_table(nrows)
+
+    capture_error_stacks(True)
+    report("link_table (stack capture)", nrows, timeit(lambda: link_table(data, linker)))
+
+    capture_error_stacks(False)
+    report("link_table", nrows, timeit(lambda: link_table(data, linker)))
+
+if __name__ == "__main__":
+    main(*(int(i) for i in sys.argv[1:]))
@@ -0,0 +1,70 @@
+"""Qualtrics loader throughput, validated vs trusted (checksum-matched) rows
+
+Run from src/ with: python -m benchmarks.qualtrics [nrows] [ncolumns]
+"""
+import sys
+import json
+import random
+import hashlib
+
+from doit.unsanitizedtable.io.qualtrics import (
+    load_unsanitizedtable_qualtrics,
+)
+
+from . import timeit, report
+
+def make_export(nrows: int, ncolumns: int):
+    codes = [{ "label": "Option {}".format(i), "const": i } for i in range(1, 6)]
+
+    def question(i: int):
+        match i % 3:
+            case 0:
+                return { "description": "Text {}".format(i), "exportTag": "Q{}".format(i), "type": "string", "dataType": "question" }
+            case 1:
+                return { "description": "Ordinal {}".format(i), "exportTag": "Q{}".format(i), "type": "number", "oneOf": codes, "dataType": "question" }
+            case _:
+                return { "description": "Number {}".format(i), "exportTag": "Q{}".format(i), "type": "number", "dataType": "question" }
+
+    schema = {
+        "title": "Benchmark Survey",
+        "properties": { "values": { "properties": { "QID{}".format(i): question(i) for i in range(ncolumns) } } },
+    }
+
+    survey = {
+        "blocks": { "BL_1": { "elements": [{ "type": "Question", "questionId": "QID{}".format(i) } for i in range(ncolumns)] } },
+    }
+
+    rng = random.Random(0)
+
+    def value(i: int):
+        match i % 3:
+            case 0:
+                return "response text {}".format(rng.random())
+            case 1:
+                return rng.randint(1, 5)
+            case _:
+                return rng.random() * 100
+
+    data = {
+        "responses": [
+            {
+                "responseId": "R_{}".format(n),
+                "values": { "QID{}".format(i): value(i) for i in range(ncolumns) if rng.random() > 0.1 },
+            } for n in range(nrows)
+        ],
+    }
+
+    return json.dumps(schema), json.dumps(data), json.dumps(survey)
+
+def main(nrows: int = 5000, ncolumns: int = 200):
+    schema_json, data_json, survey_json = make_export(nrows, ncolumns)
+    checksum = hashlib.sha256(data_json.encode()).hexdigest()
+
+    validated = timeit(lambda: load_unsanitizedtable_qualtrics(schema_json, data_json, survey_json))
+    trusted = timeit(lambda: load_unsanitizedtable_qualtrics(schema_json, data_json, survey_json, trusted_checksum=checksum))
+
+    report("qualtrics load (validated)", nrows, validated)
+    report("qualtrics load (trusted)", nrows, trusted)
+
+if __name__ == "__main__":
+    main(*(int(i) for i in sys.argv[1:]))
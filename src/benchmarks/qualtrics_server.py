@@ -0,0 +1,221 @@
+"""Local stand-in for the Qualtrics API, serving synthetic surveys
+
+Implements the endpoints QualtricsRemote uses: surveys, surveys/{id},
+surveys/{id}/response-schema and surveys/{id}/export-responses (start,
+progress and file). Exports complete once they have been checked `polls`
+times and `export_duration` seconds have passed since they were started;
+every request is delayed by `latency` seconds. Used by the benchmarks and by
+tests/test_qualtrics_remote.py, which also use its counters.
+
+Run from src/ with: python -m benchmarks.qualtrics_server [port] [nsurveys] [nrows] [ncolumns]
+and point doit at it with QUALTRICS_API_URL=http://127.0.0.1:<port>/API/v3/{endpoint}
+"""
+import io
+import re
+import sys
+import json
+import time
+import zipfile
+import threading
+import typing as t
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from doit.remote.qualtrics.model import QualtricsRemoteSettings
+
+from .qualtrics import make_export
+
+class MockSurvey(t.NamedTuple):
+    name: str
+    schema_json: str
+    survey_json: str
+    export_zip: bytes
+
+class MockExport(t.NamedTuple):
+    survey_id: str
+    started: float
+    continued: bool
+    checks: int
+
+def export_zip(name: str, data_json: str) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("{}.json".format(name), data_json)
+    return buffer.getvalue()
+
+def mock_survey_from_export(name: str, schema_json: str, data_json: str, survey_json: str) -> MockSurvey:
+    return MockSurvey(name, schema_json, survey_json, export_zip(name, data_json))
+
+def mock_survey(name: str, nrows: int, ncolumns: int) -> MockSurvey:
+    schema_json, data_json, survey_json = make_export(nrows, ncolumns)
+
+    survey = {
+        **json.loads(survey_json),
+        "name": name,
+        "lastModifiedDate": "2020-01-01T00:00:00Z",
+        "responseCounts": { "auditable": nrows, "generated": 0, "deleted": 0 },
+    }
+
+    return mock_survey_from_export(name, schema_json, data_json, json.dumps(survey))
+
+class MockQualtrics(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        surveys: t.Mapping[str, MockSurvey],
+        latency: float = 0.05,
+        export_duration: float = 2.0,
+        port: int = 0,
+        polls: int = 1,
+        default_survey: MockSurvey | None = None,
+    ):
+        super().__init__(("127.0.0.1", port), MockQualtricsHandler)
+        self.surveys = surveys
+        self.latency = latency
+        self.export_duration = export_duration
+        self.polls = polls
+        # Served for survey ids not in `surveys`, if set
+        self.default_survey = default_survey
+        # Surveys whose exports fail
+        self.failing: t.Set[str] = set()
+        # Status returned when starting an export from a token, if set
+        # (otherwise only unknown tokens are rejected)
+        self.continue_error: int | None = None
+        # Served by exports continuing from a token
+        self.delta_json = json.dumps({ "responses": [] })
+        # Merged into every survey's metadata
+        self.survey_activity: t.Dict[str, t.Any] = {}
+
+        self.lock = threading.Lock()
+        self.export_states: t.Dict[str, MockExport] = {}
+        self.exports = 0
+        self.continued_exports = 0
+        self.active_exports = 0
+        self.max_active_exports = 0
+        # Export status checks by survey id
+        self.status_checks: t.Dict[str, int] = {}
+        self.client_ports: t.Set[int] = set()
+        self.requests = 0
+
+    @property
+    def api_url(self):
+        return "http://127.0.0.1:{}/API/v3/{{endpoint}}".format(self.server_address[1])
+
+    def settings(self, **kwargs: t.Any):
+        return QualtricsRemoteSettings(
+            api_key="stand-in",
+            data_center="stand-in",
+            api_url=self.api_url,
+            **kwargs,
+        )
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class MockQualtricsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MockQualtrics
+
+    def log_message(self, format: str, *args: t.Any):
+        pass
+
+    def send(self, content: bytes, content_type: str = "application/json", status: int = 200):
+        self.send_response(status)
+        self.send_header("content-type", content_type)
+        self.send_header("content-length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_result(self, result: t.Any):
+        self.send(json.dumps({ "result": result }).encode('utf-8'))
+
+    def send_not_found(self):
+        self.send(json.dumps({ "meta": { "httpStatus": "404 - Not Found" } }).encode('utf-8'), status=404)
+
+    def survey(self, survey_id: str) -> MockSurvey | None:
+        return self.server.surveys.get(survey_id, self.server.default_survey)
+
+    def begin(self):
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.client_ports.add(self.client_address[1])
+            self.server.requests += 1
+
+    def do_POST(self):
+        self.begin()
+        payload = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+        if (m := re.fullmatch(r"/API/v3/surveys/(\w+)/export-responses", self.path)) and self.survey(m.group(1)):
+            token = payload.get("continuationToken")
+            if token is not None and (self.server.continue_error or token != "CT_" + m.group(1)):
+                self.send(b"{}", status=self.server.continue_error or 400)
+                return
+            with self.server.lock:
+                export_id = "ES_{}_{}".format(m.group(1), len(self.server.export_states))
+                self.server.export_states[export_id] = MockExport(m.group(1), time.monotonic(), token is not None, 0)
+                self.server.exports += 1
+                self.server.continued_exports += token is not None
+                self.server.active_exports += 1
+                self.server.max_active_exports = max(self.server.max_active_exports, self.server.active_exports)
+            self.send_result({ "progressId": export_id })
+        else:
+            self.send_not_found()
+
+    def do_GET(self):
+        self.begin()
+        if self.path == "/API/v3/surveys":
+            self.send_result({
+                "elements": [{ "id": id, "name": s.name } for id, s in self.server.surveys.items()],
+            })
+        elif (m := re.fullmatch(r"/API/v3/surveys/(\w+)/export-responses/FILE_(ES_\w+)/file", self.path)) and (survey := self.survey(m.group(1))):
+            with self.server.lock:
+                export = self.server.export_states[m.group(2)]
+                self.server.active_exports -= 1
+            if export.continued:
+                self.send(export_zip(survey.name, self.server.delta_json), "application/zip")
+            else:
+                self.send(survey.export_zip, "application/zip")
+        elif (m := re.fullmatch(r"/API/v3/surveys/(\w+)/export-responses/(ES_\w+)", self.path)) and m.group(2) in self.server.export_states:
+            with self.server.lock:
+                export = self.server.export_states[m.group(2)]
+                export = self.server.export_states[m.group(2)] = export._replace(checks=export.checks + 1)
+                self.server.status_checks[m.group(1)] = self.server.status_checks.get(m.group(1), 0) + 1
+            elapsed = time.monotonic() - export.started
+            progress = min(
+                export.checks / self.server.polls if self.server.polls else 1,
+                elapsed / self.server.export_duration if self.server.export_duration else 1,
+            )
+            if progress < 1:
+                self.send_result({ "status": "inProgress", "percentComplete": str(100*progress) })
+            elif m.group(1) in self.server.failing:
+                self.send_result({ "status": "failed" })
+            else:
+                self.send_result({ "status": "complete", "fileId": "FILE_" + m.group(2), "continuationToken": "CT_" + m.group(1) })
+        elif (m := re.fullmatch(r"/API/v3/surveys/(\w+)/response-schema", self.path)) and (survey := self.survey(m.group(1))):
+            self.send_result(json.loads(survey.schema_json))
+        elif (m := re.fullmatch(r"/API/v3/surveys/(\w+)", self.path)) and (survey := self.survey(m.group(1))):
+            self.send_result({ **json.loads(survey.survey_json), **self.server.survey_activity })
+        else:
+            self.send_not_found()
+
+def mock_surveys(nsurveys: int, nrows: int, ncolumns: int) -> t.Dict[str, MockSurvey]:
+    return {
+        "SV_{}".format(i): mock_survey("survey_{}".format(i), nrows, ncolumns)
+            for i in range(nsurveys)
+    }
+
+def main(port: int = 8080, nsurveys: int = 10, nrows: int = 1000, ncolumns: int = 50):
+    server = MockQualtrics(mock_surveys(nsurveys, nrows, ncolumns), port=port)
+    print("Serving {} surveys at {}".format(nsurveys, server.api_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main(*(int(i) for i in sys.argv[1:]))
@@ -0,0 +1,98 @@
+"""Sanitizer throughput, interpreted row by row vs a compiled plan
+
+Run from src/ with: python -m benchmarks.sanitize [nrows] [nkeys]
+"""
+import sys
+import random
+import tempfile
+from pathlib import Path
+
+from doit.unsanitizedtable.io.csv import (
+    load_unsanitizedtable_csv,
+)
+
+from doit.sanitizer.io import (
+    load_sanitizer_csv,
+)
+
+from doit.sanitizer.model import (
+    TableSanitizer,
+)
+
+from doit.sanitizer.store import (
+    load_sanitizer_store,
+)
+
+from doit.sanitizedtable.model import (
+    SanitizedTableData,
+)
+
+from doit.service.sanitize import (
+    all_row_sanitizers,
+    compile_sanitization_plan,
+    sanitize_data,
+    sanitize_tabledata,
+)
+
+from . import timeit, report
+
+NSAFE = 20
+NLOOKUPS = 4
+
+def sanitizer_csv(i: int, nkeys: int) -> str:
+    return "\n".join(
+        ["(unsafe_{i}),sanitized_{i}".format(i=i)] +
+        ["key {k},value {k}".format(k=k) for k in range(nkeys - 1)] # One key is a miss
+    )
+
+def make_table(nrows: int, nkeys: int):
+    rng = random.Random(0)
+
+    header = ["safe_{}".format(i) for i in range(NSAFE)] + ["(unsafe_{})".format(i) for i in range(NLOOKUPS)]
+    lines = [",".join(header)] + [
+        ",".join(
+            [str(rng.randint(1, 5)) for _ in range(NSAFE)] +
+            [("key {}".format(rng.randrange(nkeys)) if rng.random() > 0.1 else "") for _ in range(NLOOKUPS)]
+        ) for _ in range(nrows)
+    ]
+
+    table = load_unsanitizedtable_csv("\n".join(lines), "Benchmark Table")
+
+    sanitizers = tuple(
+        load_sanitizer_csv(sanitizer_csv(i, nkeys), "unsafe_{}".format(i))
+            for i in range(NLOOKUPS)
+    )
+
+    return table, TableSanitizer(table_name="benchmark", sanitizers=sanitizers)
+
+def sanitize_interpreted(table, table_sanitizer: TableSanitizer):
+    # Per-row sanitization, as sanitize_table did before plans were compiled
+    return SanitizedTableData.combine_tables(
+        *(sanitize_tabledata(table.data, s) for s in all_row_sanitizers(table.schema, table_sanitizer))
+    )
+
+def main(nrows: int = 50000, nkeys: int = 500):
+    table, table_sanitizer = make_table(nrows, nkeys)
+
+    interpreted = timeit(lambda: sanitize_interpreted(table, table_sanitizer))
+    compiled = timeit(lambda: sanitize_data(table.data, compile_sanitization_plan(table.schema, table_sanitizer)))
+
+    plan = compile_sanitization_plan(table.schema, table_sanitizer)
+    reused = timeit(lambda: sanitize_data(table.data, plan))
+
+    report("sanitize (interpreted)", nrows, interpreted)
+    report("sanitize (compiled)", nrows, compiled)
+    report("sanitize (reused plan)", nrows, reused)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filenames = tuple(Path(tmpdir) / "unsafe_{}.csv".format(i) for i in range(NLOOKUPS))
+        for i, filename in enumerate(filenames):
+            filename.write_text(sanitizer_csv(i, nkeys))
+
+        stored = table_sanitizer._replace(sanitizers=tuple(load_sanitizer_store(i) for i in filenames))
+        store_plan = compile_sanitization_plan(table.schema, stored)
+
+        report("sanitize (sqlite store)", nrows, timeit(lambda: sanitize_data(table.data, store_plan)))
+
+if __name__ == "__main__":
+    main(*(int(i) for i in sys.argv[1:]))
@@ -0,0 +1,56 @@
+"""Sanitizer load time, parsing every csv vs loading through the bundle
+
+Run from src/ with: python -m benchmarks.sanitizer_load [nsanitizers] [nrows]
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+from doit.sanitizer.bundle import (
+    load_table_sanitizer_bundled,
+    sanitizer_bundle_filename,
+)
+
+from doit.sanitizer.io import (
+    load_sanitizer_csv,
+)
+
+from . import timeit, report
+
+def write_sanitizers(sanitizer_dir: Path, nsanitizers: int, nrows: int):
+    for i in range(nsanitizers):
+        (sanitizer_dir / "unsafe_{}.csv".format(i)).write_text("\n".join(
+            ["(unsafe_{i}),sanitized_{i}".format(i=i)] +
+            ["response {k} to question {i},value {k}".format(i=i, k=k) for k in range(nrows)]
+        ))
+
+def main(nsanitizers: int = 20, nrows: int = 20000):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sanitizer_dir = Path(tmpdir)
+        write_sanitizers(sanitizer_dir, nsanitizers, nrows)
+
+        rows = nsanitizers * nrows
+
+        parsed = timeit(lambda: tuple(load_sanitizer_csv(i.read_text(), i.stem) for i in sanitizer_dir.glob("*.csv")))
+
+        def build():
+            sanitizer_bundle_filename(sanitizer_dir).unlink(missing_ok=True)
+            load_table_sanitizer_bundled("benchmark", sanitizer_dir)
+
+        built = timeit(build)
+
+        bundled = timeit(lambda: load_table_sanitizer_bundled("benchmark", sanitizer_dir))
+
+        def bundled_used():
+            for s in load_table_sanitizer_bundled("benchmark", sanitizer_dir).sanitizers:
+                len(s.map)
+
+        used = timeit(bundled_used)
+
+        report("load (parse csvs)", rows, parsed)
+        report("load (build bundle)", rows, built)
+        report("load (bundle)", rows, bundled)
+        report("load (bundle, maps used)", rows, used)
+
+if __name__ == "__main__":
+    main(*(int(i) for i in sys.argv[1:]))
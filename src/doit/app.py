@@ -2,26 +2,35 @@ import typing as t
 from pathlib import Path
 from datetime import datetime, timezone
 
-from .sanitizer.model import SanitizerUpdate, TableSanitizer
+from .sanitizer.model import SanitizerUpdate
 
 from .unsanitizedtable.model import UnsanitizedTable
 
+from .sanitizedtable.model import SanitizedTable, SanitizedTableStream
+from .sanitizedtable.repo import SanitizedTableRepoWriter
+
 from .common.table import TableErrorReport
 
 from .remote.fetch import ( # TODO: put these imports into the functions that call them
-    fetch_blob,
     get_listing,
 )
 
 from .remote.blob import (
     load_blob,
-    write_blob,
+    write_blob_ref,
+    is_blob_ref,
     read_blob_info,
-    read_blob,
+    read_blob_cached,
+    write_table_cache,
+    open_blob_stream,
+    migrate_blob,
 )
 
 from .remote.model import (
-    Blob,
+    BlobInfo,
+    FetchTimings,
+    FetchDecision,
+    OpenBlob,
     LocalTableListing,
     RemoteTableListing,
 )
@@ -34,45 +43,204 @@ def add_source(
     uri: str,
     progress_callback: t.Callable[[int], None],
     blob_from_instrument_name: t.Callable[[str], Path],
-) -> Blob:
-    blob = fetch_blob(uri, progress_callback)
-    write_blob(blob, blob_from_instrument_name(instrument_name))
-    return blob
-    
-def fetch_source(
+    blob_store_dir: Path,
+    source_catalog_path: Path,
+    download_callback: t.Callable[[int], None] = lambda _: None,
+) -> UnsanitizedTable:
+    from .remote.fetch import fetch_blobs
+    from .remote.catalog import update_catalog
+
+    filename = blob_from_instrument_name(instrument_name)
+
+    tables: t.Dict[str, UnsanitizedTable] = {}
+
+    def blob_callback(instrument_name: str, blob: OpenBlob):
+        table = load_blob(blob, validate=True)
+        write_blob_ref(blob, filename, blob_store_dir)
+        update_catalog(source_catalog_path, instrument_name, filename, blob.info)
+        write_table_cache(filename, blob.info, table)
+        tables[instrument_name] = table
+
+    errors = fetch_blobs(
+        { instrument_name: uri },
+        lambda _: progress_callback,
+        blob_callback,
+        max_concurrency=1,
+        download_callback_fn=lambda _: download_callback,
+    )
+
+    if errors:
+        raise errors[instrument_name]
+
+    return tables[instrument_name]
+
+def fetch_sources(
+    instrument_names: t.Sequence[str],
+    progress_callback_fn: t.Callable[[str], t.Callable[[int], None]],
+    table_callback: t.Callable[[str, UnsanitizedTable], None],
+    blob_from_instrument_name: t.Callable[[str], Path],
+    blob_bkup_filename: t.Callable[[str, datetime], Path],
+    blob_store_dir: Path,
+    source_catalog_path: Path,
+    max_concurrency: int,
+    timings_callback: t.Callable[[str, FetchTimings], None] = lambda *_: None,
+    download_callback_fn: t.Callable[[str], t.Callable[[int], None]] = lambda _: lambda _: None,
+    full: bool = False,
+    decision_callback: t.Callable[[str, FetchDecision], None] = lambda *_: None,
+    skip_unchanged: bool = False,
+) -> t.Dict[str, Exception]:
+    # Each source is replaced (and handed to table_callback) as soon as its
+    # fetch completes. Returns the errors of sources that couldn't be fetched;
+    # their blobs are left as they were. Unless `full`, sources are fetched
+    # incrementally where possible, merging new responses into the current
+    # blob. Sources that can't be, and with `skip_unchanged` all of them, are
+    # skipped (and left as they were) when the remote shows them unchanged
+    from .remote.fetch import fetch_blobs
+
+    uris = {
+        name: read_blob_info(blob_from_instrument_name(name)).source_info.uri
+            for name in instrument_names
+    }
+
+    def blob_callback(instrument_name: str, blob: OpenBlob):
+        table_callback(instrument_name, replace_source(
+            instrument_name,
+            blob,
+            blob_from_instrument_name,
+            blob_bkup_filename,
+            blob_store_dir,
+            source_catalog_path,
+        ))
+
+    previous_blobs = {} if full else {
+        name: blob_from_instrument_name(name) for name in instrument_names
+    }
+
+    if full:
+        # Every source is exported whole, so there is nothing left to decide
+        for name in instrument_names:
+            decision_callback(name, FetchDecision(True, "full fetch requested"))
+        decision_callback = lambda *_: None
+
+    return fetch_blobs(
+        uris,
+        progress_callback_fn,
+        blob_callback,
+        max_concurrency,
+        timings_callback,
+        download_callback_fn,
+        previous_blobs,
+        decision_callback,
+        skip_unchanged,
+    )
+
+def replace_source(
     instrument_name: str,
-    progress_callback: t.Callable[[int], None],
+    blob: OpenBlob,
     blob_from_instrument_name: t.Callable[[str], Path],
     blob_bkup_filename: t.Callable[[str, datetime], Path],
+    blob_store_dir: Path,
+    source_catalog_path: Path,
 ) -> UnsanitizedTable:
+    # The previous version is kept under its backup name; with blob refs this
+    # is a small pointer file, as members shared with the new fetch are stored once
+    from .remote.catalog import update_catalog
 
-    info = read_blob_info(blob_from_instrument_name(instrument_name))
+    # Fetched data is checked before it replaces anything
+    table = load_blob(blob, validate=True)
 
     filename = blob_from_instrument_name(instrument_name)
 
+    info = read_blob_info(filename)
+
     bkup_filename = filename.rename(blob_bkup_filename(instrument_name, info.fetch_date_utc))
 
+    filename = blob_from_instrument_name(instrument_name)
+
     try:
-        new_blob = add_source(
-            instrument_name,
-            info.source_info.uri,
-            progress_callback,
-            blob_from_instrument_name,
-        )
+        write_blob_ref(blob, filename, blob_store_dir)
     except Exception as e:
         bkup_filename.rename(filename)
         raise e
 
-    if info.source_info == new_blob.info.source_info:
+    update_catalog(source_catalog_path, instrument_name, filename, blob.info)
+
+    if (info.source_info.data_checksum, info.source_info.schema_checksum) == (blob.info.source_info.data_checksum, blob.info.source_info.schema_checksum):
         bkup_filename.unlink()
 
-    return load_blob(new_blob)
+    write_table_cache(filename, blob.info, table)
+
+    return table
+
+def migrate_source(
+    instrument_name: str,
+    blob_from_instrument_name: t.Callable[[str], Path],
+    blob_container_from_instrument_name: t.Callable[[str], Path],
+    blob_versions_from_instrument_name: t.Callable[[str], t.Tuple[Path, ...]],
+    blob_store_dir: Path,
+) -> bool:
+    # Moves the current blob and all older versions into the blob store
+    def ref_filename(filename: Path):
+        return filename.with_name(filename.name.removesuffix(".tar.gz").removesuffix(".blob") + ".blob")
+
+    migrations = tuple(
+        (filename, ref_filename(filename))
+            for filename in blob_versions_from_instrument_name(instrument_name)
+                if not is_blob_ref(filename)
+    )
+
+    current = blob_from_instrument_name(instrument_name)
+    if current.exists() and not is_blob_ref(current):
+        migrations += ((current, blob_container_from_instrument_name(instrument_name)),)
+
+    for old_filename, new_filename in migrations:
+        migrate_blob(old_filename, new_filename, blob_store_dir)
+
+    return bool(migrations)
+
+def rollback_source(
+    instrument_name: str,
+    version: int | None,
+    blob_from_instrument_name: t.Callable[[str], Path],
+    blob_versions_from_instrument_name: t.Callable[[str], t.Tuple[Path, ...]],
+    blob_bkup_filename: t.Callable[[str, datetime], Path],
+) -> BlobInfo:
+    # Swaps the current blob with an older version (the latest, by default).
+    # Both are renamed rather than rewritten, so this is a pointer flip
+    versions = {
+        int(read_blob_info(i).fetch_date_utc.timestamp()): i
+            for i in blob_versions_from_instrument_name(instrument_name)
+    }
+
+    if not versions:
+        raise Exception("Error: {} has no older versions".format(instrument_name))
+
+    if version is None:
+        version = max(versions)
+
+    target = versions.get(version)
+    if target is None:
+        raise Exception("Error: {} has no version {}".format(instrument_name, version))
+
+    filename = blob_from_instrument_name(instrument_name)
+    info = read_blob_info(filename)
+    filename.rename(blob_bkup_filename(instrument_name, info.fetch_date_utc))
+    target.rename(filename)
+
+    return read_blob_info(filename)
 
 def load_unsanitizedtable(
     instrument_name: str,
     blob_from_instrument_name: t.Callable[[str], Path],
 ):
-    return read_blob(blob_from_instrument_name(instrument_name))
+    return read_blob_cached(blob_from_instrument_name(instrument_name))
+
+def open_unsanitizedtable_stream(
+    instrument_name: str,
+    blob_from_instrument_name: t.Callable[[str], Path],
+    chunk_size: int,
+):
+    return open_blob_stream(blob_from_instrument_name(instrument_name), chunk_size)
 
 def load_source_info(
     instrument_name: str,
@@ -88,33 +256,97 @@ def get_remote_source_listing(
 def get_local_source_listing(
     source_workdir: Path,
     blob_from_instrument_name: t.Callable[[str], Path],
+    source_catalog_path: Path,
 ) -> t.Tuple[LocalTableListing, ...]:
+    from contextlib import closing
+    from .remote.catalog import open_catalog, sync_catalog
     sources = tuple(
         i.name
             for i in source_workdir.iterdir()
                 if i.is_dir() and i.name[0] != '.' and blob_from_instrument_name(i.name).exists()
     )
+    with closing(open_catalog(source_catalog_path)) as conn:
+        entries = sync_catalog(conn, sources, blob_from_instrument_name)
     return tuple(
         LocalTableListing(
-            name=source,
-            title=load_source_info(source, blob_from_instrument_name).title,
-            uri=load_source_info(source, blob_from_instrument_name).source_info.uri,
-        ) for source in sources
+            name=entry.name,
+            title=entry.title,
+            uri=entry.uri,
+        ) for entry in entries
     )
 
+def get_local_source_names(
+    source_catalog_path: Path,
+    prefix: str = "",
+) -> t.Tuple[str, ...]:
+    # Answers straight from the catalog, without checking the blobs
+    from contextlib import closing
+    from .remote.catalog import open_catalog, read_catalog_names
+    if not source_catalog_path.exists():
+        return ()
+    with closing(open_catalog(source_catalog_path)) as conn:
+        return read_catalog_names(conn, prefix)
+
 def load_table_sanitizer(
     instrument_name: str,
     sanitizer_dir_from_instrument_name: t.Callable[[str], Path],
+    sanitizer_store_min_bytes: int | None = None,
 ):
-    from .sanitizer.io import load_sanitizer_csv
-    return TableSanitizer(
-        table_name=instrument_name,
-        sanitizers=tuple(
-            load_sanitizer_csv(i.read_text(), i.stem)
-                for i in sanitizer_dir_from_instrument_name(instrument_name).glob("*.csv")
-        )
+    # Sanitizer csvs of at least sanitizer_store_min_bytes are probed through
+    # an on-disk store rather than loaded into memory. Unchanged csvs are
+    # loaded from the instrument's precompiled bundle
+    from .sanitizer.bundle import load_table_sanitizer_bundled
+    return load_table_sanitizer_bundled(
+        instrument_name,
+        sanitizer_dir_from_instrument_name(instrument_name),
+        sanitizer_store_min_bytes,
     )
 
+# Rows per worker task when sanitizing in parallel
+SANITIZE_JOB_CHUNK_SIZE = 50000
+
+def sanitize_sources(
+    instrument_names: t.Sequence[str],
+    blob_from_instrument_name: t.Callable[[str], Path],
+    sanitizer_dir_from_instrument_name: t.Callable[[str], Path],
+    jobs: int,
+    chunk_size: int = SANITIZE_JOB_CHUNK_SIZE,
+    debug: bool = False,
+    sanitizer_store_min_bytes: int | None = None,
+) -> t.Iterator[SanitizedTableStream]:
+    # Sanitizes sources on `jobs` worker processes, splitting tables of more
+    # than chunk_size rows across workers. Yields a stream per source as its
+    # first chunk arrives, so a single writer can consume them; each stream
+    # must be consumed before the next is yielded
+    from concurrent.futures import ProcessPoolExecutor, Future, as_completed
+    from itertools import chain
+    from .sanitizeworker import WorkerSettings, init_worker, sanitize_chunk
+
+    settings = WorkerSettings(
+        blob_from_instrument_name=blob_from_instrument_name,
+        sanitizer_dir_from_instrument_name=sanitizer_dir_from_instrument_name,
+        sanitizer_store_min_bytes=sanitizer_store_min_bytes,
+    )
+
+    with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(settings, debug)) as pool:
+        def submit(name: str, start: int) -> Future[t.Tuple[SanitizedTable, int]]:
+            return pool.submit(sanitize_chunk, name, start, start + chunk_size)
+
+        first_chunks = { submit(name, 0): name for name in instrument_names }
+
+        try:
+            for future in as_completed(first_chunks):
+                first, nrows = future.result()
+                rest = tuple(submit(first_chunks[future], start) for start in range(chunk_size, nrows, chunk_size))
+                yield SanitizedTableStream(
+                    info=first.info,
+                    chunks=chain((first.data,), (f.result()[0].data for f in rest)),
+                )
+        except BaseException:
+            # Don't wait on sources nobody will write
+            pool.shutdown(cancel_futures=True)
+            raise
+
 def update_sanitizer(
     instrument_name: str,
     sanitizer_updates: t.Sequence[SanitizerUpdate],
@@ -149,6 +381,58 @@ def new_sanitizedtable_repo(
     from .sanitizedtable.sqlalchemy.impl import SqlAlchemyRepo
     return SqlAlchemyRepo.new(str(sanitized_repo_name))
 
+# Rows copied at a time into snapshots of replaced tables
+SNAPSHOT_CHUNK_SIZE = 10000
+
+def update_sanitizedtable_repo(
+    instrument_names: t.Sequence[str],
+    sanitized_repo_name: Path,
+    sanitized_repo_bkup_path: t.Callable[[datetime], Path],
+    blob_from_instrument_name: t.Callable[[str], Path],
+    sanitizer_dir_from_instrument_name: t.Callable[[str], Path],
+    sanitizer_store_min_bytes: int | None = None,
+) -> t.Tuple[SanitizedTableRepoWriter, t.Tuple[str, ...]]:
+    # Opens the existing repo to re-sanitize only the sources whose data,
+    # schema or sanitizers changed since their tables were written. Stale
+    # tables (and tables whose source is gone) are first copied into a
+    # snapshot at sanitized_repo_bkup_path. Tables whose source is gone are
+    # dropped; stale ones stay until writing their replacement succeeds.
+    # Returns the repo and the names of the sources still to be sanitized
+    from .service.sanitize import is_sanitizedtable_current
+    from .sanitizedtable.sqlalchemy.impl import SqlAlchemyRepo
+
+    if not sanitized_repo_name.exists():
+        return new_sanitizedtable_repo(sanitized_repo_name, sanitized_repo_bkup_path), tuple(instrument_names)
+
+    repo = SqlAlchemyRepo.open_update(str(sanitized_repo_name))
+
+    existing = frozenset(repo.read_tablenames())
+
+    def is_current(name: str):
+        if name not in existing:
+            return False
+        source_info = load_source_info(name, blob_from_instrument_name).source_info
+        return is_sanitizedtable_current(
+            repo.read_tableinfo(name),
+            source_info.data_checksum,
+            source_info.schema_checksum,
+            load_table_sanitizer(name, sanitizer_dir_from_instrument_name, sanitizer_store_min_bytes),
+        )
+
+    stale = tuple(name for name in instrument_names if not is_current(name))
+
+    removed = existing - frozenset(instrument_names)
+    replaced = sorted((existing & frozenset(stale)) | removed)
+
+    if replaced:
+        snapshot = SqlAlchemyRepo.new(str(sanitized_repo_bkup_path(datetime.now(timezone.utc))))
+        for name in replaced:
+            snapshot.write_tablestream(repo.read_tablestream(name, SNAPSHOT_CHUNK_SIZE))
+            if name in removed:
+                repo.delete_table(name)
+
+    return repo, stale
+
 def open_sanitizedtable_repo(
     sanitized_repo_name: Path,
 ):
@@ -214,8 +498,9 @@ def write_instrument_spec_stub(
 
 def write_errors(
     report: TableErrorReport,
-    error_file_path: Path
+    error_file_path: Path,
+    debug: bool = False,
 ):
     from .common.table import write_error_report
     with open(error_file_path, "w") as f:
-        write_error_report(f, report)
\ No newline at end of file
+        write_error_report(f, report, debug)
\ No newline at end of file
@@ -14,14 +14,20 @@ from .settings import AppSettings
 
 defaults = AppSettings()
 
-def progress_callback(**args: t.Any):
+def progress_callbacks(**args: t.Any):
+    # Percent complete, plus a second callback to show bytes downloaded alongside
     pbar: tqdm[int] = tqdm(total=100, unit="pct", **args)
     def update_fcn(n: int):
         pbar.n = n
         pbar.update(0)
         if n >= 100:
             pbar.close()
-    return update_fcn
+    def download_fcn(received: int):
+        pbar.set_postfix_str("{}B downloaded".format(tqdm.format_sizeof(received)))
+    return update_fcn, download_fcn
+
+def progress_callback(**args: t.Any):
+    return progress_callbacks(**args)[0]
 
 #@click.group(context_settings={ "default_map": load_defaults(), "obj": load_study_context() })
 @click.group()
@@ -40,21 +46,22 @@ def source_cli():
 def source_add(instrument_name: str, uri: str):
     """Add an instrument source"""
     from .service.sanitize import update_tablesanitizer
-    from .remote.blob import load_blob
     click.secho()
-    progress = progress_callback()
-    blob = app.add_source(
+    progress, download_progress = progress_callbacks()
+    table = app.add_source(
         instrument_name,
         uri,
         progress,
         defaults.blob_from_instrument_name,
+        defaults.blob_store_dir,
+        defaults.source_catalog_path,
+        download_progress,
     )
 
-    table = load_blob(blob)
-
     existing_sanitizers = app.load_table_sanitizer(
         instrument_name,
         defaults.sanitizer_dir_from_instrument_name,
+        defaults.sanitizer_store_min_bytes,
     )
 
     updates = update_tablesanitizer(table, existing_sanitizers)
@@ -75,7 +82,7 @@ def source_rm(instrument_id: str):
 
 
 def complete_instrument_name(ctx: click.Context, param: click.Parameter, incomplete: str):
-    pass
+    return list(app.get_local_source_names(defaults.source_catalog_path, incomplete))
 
 @source_cli.command(name="list")
 @click.argument('remote_service', required=False)
@@ -84,15 +91,64 @@ def source_list(remote_service: str | None, list_all: bool):
     """List available instruments"""
     click.secho()
     if remote_service:
-        local_items = { uri for _, _, uri in app.get_local_source_listing(defaults.source_dir, defaults.blob_from_instrument_name) }
+        local_items = { uri for _, _, uri in app.get_local_source_listing(defaults.source_dir, defaults.blob_from_instrument_name, defaults.source_catalog_path) }
         for uri, title in app.get_remote_source_listing(remote_service):
             if uri not in local_items or list_all:
                 click.secho(" {} : {}".format(click.style(uri, fg='bright_cyan'), title))
     else:
-        for name, title, _ in sorted(app.get_local_source_listing(defaults.source_dir, defaults.blob_from_instrument_name), key=lambda x: x.name):
+        for name, title, _ in sorted(app.get_local_source_listing(defaults.source_dir, defaults.blob_from_instrument_name, defaults.source_catalog_path), key=lambda x: x.name):
             click.secho(" {} : {}".format(click.style(name, fg='bright_cyan'), title))
     click.secho()
 
+@source_cli.command(name="migrate")
+@click.argument('instrument_name', required=False, shell_complete=complete_instrument_name)
+def source_migrate(instrument_name: str | None):
+    """Move sources and their older versions into the blob store"""
+    if instrument_name:
+        items = (instrument_name,)
+    else:
+        listing = app.get_local_source_listing(
+            defaults.source_dir,
+            defaults.blob_from_instrument_name,
+            defaults.source_catalog_path,
+        )
+        items = tuple(l.name for l in listing)
+
+    click.secho()
+
+    for name in items:
+        migrated = app.migrate_source(
+            name,
+            defaults.blob_from_instrument_name,
+            defaults.blob_container_from_instrument_name,
+            defaults.blob_versions_from_instrument_name,
+            defaults.blob_store_dir,
+        )
+        if migrated:
+            click.secho(" Migrated {}".format(click.style(name, fg='bright_cyan')))
+
+    click.secho()
+
+@source_cli.command(name="rollback")
+@click.argument('instrument_name', shell_complete=complete_instrument_name)
+@click.argument('version', type=int, required=False)
+def source_rollback(instrument_name: str, version: int | None):
+    """Swap a source with an older version (default: the most recent)"""
+    click.secho()
+    info = app.rollback_source(
+        instrument_name,
+        version,
+        defaults.blob_from_instrument_name,
+        defaults.blob_versions_from_instrument_name,
+        defaults.blob_bkup_filename,
+    )
+    click.secho(" {} is now at version {} (fetched {})".format(
+        click.style(instrument_name, fg='bright_cyan'),
+        int(info.fetch_date_utc.timestamp()),
+        info.fetch_date_utc,
+    ))
+    click.secho()
+
 @cli.group(name="sanitizer")
 def sanitizer_cli():
     """Manage sanitizers"""
@@ -119,7 +175,8 @@ def sanitizer_update(instrument_name: str | None):
     else:
         listing = app.get_local_source_listing(
             defaults.source_dir,
-            defaults.blob_from_instrument_name
+            defaults.blob_from_instrument_name,
+            defaults.source_catalog_path,
         )
         items = tuple(l.name for l in listing)
 
@@ -133,6 +190,7 @@ def sanitizer_update(instrument_name: str | None):
         table_sanitizer = app.load_table_sanitizer(
             name,
             defaults.sanitizer_dir_from_instrument_name,
+            defaults.sanitizer_store_min_bytes,
         )
 
         updates = update_tablesanitizer(table, table_sanitizer)
@@ -170,7 +228,8 @@ def stub(instrument_name: str | None):
     else:
         listing = app.get_local_source_listing(
             defaults.source_dir,
-            defaults.blob_from_instrument_name
+            defaults.blob_from_instrument_name,
+            defaults.source_catalog_path,
         )
         items = tuple(l.name for l in listing)
 
@@ -202,9 +261,15 @@ def stub(instrument_name: str | None):
 
 @cli.command()
 @click.argument('instrument_name', required=False, shell_complete=complete_instrument_name)
-def fetch(instrument_name: str | None):
+@click.option('--max-concurrency', type=int, default=8, show_default=True, help="Number of surveys exported at a time")
+@click.option('--timings', is_flag=True, help="Report time spent waiting on exports vs downloading them")
+@click.option('--full', is_flag=True, help="Re-export all responses instead of only those since the last fetch. Sources fetched without a continuation token are otherwise skipped when their response counts are unchanged, which misses edits to existing responses")
+@click.option('--skip-unchanged', is_flag=True, help="Also skip sources with a continuation token when their response counts are unchanged, rather than exporting from the token (misses edits to existing responses until the next fetch without this flag)")
+def fetch(instrument_name: str | None, max_concurrency: int, timings: bool, full: bool, skip_unchanged: bool):
     """Fetch data from sources"""
     from .service.sanitize import update_tablesanitizer
+    from .unsanitizedtable.model import UnsanitizedTable
+    from .remote.model import FetchTimings, FetchDecision
     click.secho()
 
     if instrument_name:
@@ -212,23 +277,18 @@ def fetch(instrument_name: str | None):
     else:
         listing = app.get_local_source_listing(
             defaults.source_dir,
-            defaults.blob_from_instrument_name
+            defaults.blob_from_instrument_name,
+            defaults.source_catalog_path,
         )
         items = tuple(l.name for l in listing)
 
-    for name in tqdm(items):
-        progress = progress_callback(leave=False, desc=name)
-
-        table = app.fetch_source(
-            name,
-            progress,
-            defaults.blob_from_instrument_name,
-            defaults.blob_bkup_filename,
-        )
+    overall = tqdm(total=len(items))
 
+    def update_sanitizers(name: str, table: UnsanitizedTable):
         sanitizer = app.load_table_sanitizer(
             name,
             defaults.sanitizer_dir_from_instrument_name,
+            defaults.sanitizer_store_min_bytes,
         )
 
         updates = update_tablesanitizer(table, sanitizer)
@@ -239,60 +299,173 @@ def fetch(instrument_name: str | None):
             defaults.sanitizer_dir_from_instrument_name,
         )
 
+        overall.update(1)
+
+    fetch_timings: t.Dict[str, FetchTimings] = {}
+
+    callbacks: t.Dict[str, t.Tuple[t.Callable[[int], None], t.Callable[[int], None]]] = {}
+
+    def progress_fn(name: str):
+        callbacks[name] = progress_callbacks(leave=False, desc=name)
+        return callbacks[name][0]
+
+    def download_fn(name: str):
+        return lambda received: callbacks[name][1](received)
+
+    decisions: t.Dict[str, FetchDecision] = {}
+
+    def decision_fn(name: str, decision: FetchDecision):
+        decisions[name] = decision
+        if not decision.fetch:
+            overall.update(1)
+
+    errors = app.fetch_sources(
+        items,
+        progress_fn,
+        update_sanitizers,
+        defaults.blob_from_instrument_name,
+        defaults.blob_bkup_filename,
+        defaults.blob_store_dir,
+        defaults.source_catalog_path,
+        max_concurrency,
+        fetch_timings.__setitem__,
+        download_fn,
+        full,
+        decision_fn,
+        skip_unchanged,
+    )
+
+    overall.close()
+
+    if decisions:
+        click.secho()
+        for name, decision in sorted(decisions.items()):
+            click.secho(" {} : {} ({})".format(
+                click.style(name, fg='bright_cyan'),
+                "fetched" if decision.fetch else click.style("skipped", fg='bright_green'),
+                decision.reason,
+            ))
+        skipped = sum(not d.fetch for d in decisions.values())
+        click.secho("Skipped {} of {} sources as unchanged".format(skipped, len(decisions)))
+
+    if timings and fetch_timings:
+        click.secho()
+        for name, ft in sorted(fetch_timings.items()):
+            click.secho(" {} : waited {:.1f}s ({} polls), downloaded {}B in {:.1f}s".format(
+                click.style(name, fg='bright_cyan'),
+                ft.wait_seconds,
+                ft.polls,
+                tqdm.format_sizeof(ft.download_bytes),
+                ft.download_seconds,
+            ))
+
+    if errors:
+        click.secho()
+        click.secho("Failed to fetch {} sources:".format(len(errors)), fg='bright_red')
+        for name, e in sorted(errors.items()):
+            click.secho(" {} : {}".format(click.style(name, fg='bright_cyan'), e))
+
     click.secho()
 
 @cli.command()
-def sanitize():
+@click.option('--debug', is_flag=True, help="Record a stack trace for each error in the error report")
+@click.option('--chunk-size', type=int, default=None, help="Stream each source in chunks of this many rows instead of loading it whole (bypasses the parsed table cache). With --jobs, splits larger sources across workers instead")
+@click.option('--jobs', type=int, default=1, show_default=True, help="Number of worker processes sanitizing sources")
+@click.option('--incremental', is_flag=True, help="Only re-sanitize sources whose data or sanitizers changed, snapshotting their previous tables (errors are reported for those sources only)")
+def sanitize(debug: bool, chunk_size: int | None, jobs: int, incremental: bool):
     """Sanitize sources"""
-    from .service.sanitize import sanitize_table
-    from .common.table import TableErrorReport
+    from .service.sanitize import sanitize_table, sanitize_tablestream
+    from .common.table import TableErrorReport, capture_error_stacks
+
+    capture_error_stacks(debug)
     
     listing = app.get_local_source_listing(
         defaults.source_dir,
-        defaults.blob_from_instrument_name
+        defaults.blob_from_instrument_name,
+        defaults.source_catalog_path,
     )
 
-    repo = app.new_sanitizedtable_repo(
-        defaults.sanitized_repo_path,
-        defaults.sanitized_repo_bkup_path,
-    )
+    if incremental:
+        repo, stale = app.update_sanitizedtable_repo(
+            tuple(entry.name for entry in listing),
+            defaults.sanitized_repo_path,
+            defaults.sanitized_repo_bkup_path,
+            defaults.blob_from_instrument_name,
+            defaults.sanitizer_dir_from_instrument_name,
+            defaults.sanitizer_store_min_bytes,
+        )
+        click.secho()
+        click.secho("Sanitizing {} of {} sources ({} unchanged)".format(len(stale), len(listing), len(listing) - len(stale)))
+        listing = tuple(entry for entry in listing if entry.name in stale)
+    else:
+        repo = app.new_sanitizedtable_repo(
+            defaults.sanitized_repo_path,
+            defaults.sanitized_repo_bkup_path,
+        )
     
     errors: TableErrorReport = set()
 
     click.secho()
-    for entry in tqdm(listing):
-        unsanitized = app.load_unsanitizedtable(
-            entry.name,
-            defaults.blob_from_instrument_name
-        )
 
-        sanitizer = app.load_table_sanitizer(
-            entry.name,
+    if jobs > 1:
+        # Workers sanitize; this process is the only one writing to the repo
+        streams = app.sanitize_sources(
+            tuple(entry.name for entry in listing),
+            defaults.blob_from_instrument_name,
             defaults.sanitizer_dir_from_instrument_name,
+            jobs,
+            chunk_size or app.SANITIZE_JOB_CHUNK_SIZE,
+            debug,
+            defaults.sanitizer_store_min_bytes,
         )
+        for stream in tqdm(streams, total=len(listing)):
+            errors |= repo.write_tablestream(stream)
+    else:
+        for entry in tqdm(listing):
+            sanitizer = app.load_table_sanitizer(
+                entry.name,
+                defaults.sanitizer_dir_from_instrument_name,
+                defaults.sanitizer_store_min_bytes,
+            )
 
-        sanitized = sanitize_table(unsanitized, sanitizer)
-        new_errors = repo.write_table(sanitized)
-        errors |= new_errors
+            if chunk_size is None:
+                unsanitized = app.load_unsanitizedtable(
+                    entry.name,
+                    defaults.blob_from_instrument_name,
+                )
+                new_errors = repo.write_table(sanitize_table(unsanitized, sanitizer))
+            else:
+                with app.open_unsanitizedtable_stream(
+                    entry.name,
+                    defaults.blob_from_instrument_name,
+                    chunk_size,
+                ) as unsanitized_stream:
+                    new_errors = repo.write_tablestream(sanitize_tablestream(unsanitized_stream, sanitizer))
+
+            errors |= new_errors
 
     if errors:
         click.secho()
         click.secho("Encountered {} errors.".format(len(errors)), fg='bright_red')
         click.secho()
         click.secho("See {} for more info".format(click.style(defaults.error_file_path, fg='bright_cyan')))
-        app.write_errors(errors, defaults.error_file_path)
+        app.write_errors(errors, defaults.error_file_path, debug)
 
     click.secho()
 
 @cli.command()
-def link():
+@click.option('--debug', is_flag=True, help="Record a stack trace for each error in the error report")
+@click.option('--chunk-size', type=int, default=5000, show_default=True, help="Number of rows held in memory per table at a time")
+def link(debug: bool, chunk_size: int):
     """Link study"""
     from .service.link import (
         link_tableinfo,
         link_table,
     )
 
-    from .common.table import TableErrorReport
+    from .common.table import TableErrorReport, capture_error_stacks
+
+    capture_error_stacks(debug)
     
     sanitized_repo = app.open_sanitizedtable_repo(
         defaults.sanitized_repo_path,
@@ -326,17 +499,18 @@ def link():
     click.secho()
 
     for linker in tqdm(linkers):
-        sanitized_table = sanitized_repo.read_table(linker.instrument_name)
-        linked_table = link_table(sanitized_table.data, linker)
-        new_errors = linked_repo.write_table(linked_table)
-        errors |= new_errors
+        sanitized_stream = sanitized_repo.read_tablestream(linker.instrument_name, chunk_size)
+        for chunk in sanitized_stream.chunks:
+            linked_table = link_table(chunk, linker)
+            new_errors = linked_repo.write_table(linked_table)
+            errors |= new_errors
 
     if errors:
         click.secho()
         click.secho("Encountered {} errors.".format(len(errors)), fg='bright_red')
         click.secho()
         click.secho("See {} for more info".format(click.style(defaults.error_file_path, fg='bright_cyan')))
-        app.write_errors(errors, defaults.error_file_path)
+        app.write_errors(errors, defaults.error_file_path, debug)
     
     click.secho()
     click.secho("View by running: {}".format(click.style("datasette {}".format(defaults.study_repo_path), fg="bright_cyan")))
@@ -19,7 +19,7 @@ from sqlalchemy.orm import (
     backref,
 )
 
-from sqlalchemy.engine import Engine, ResultProxy
+from sqlalchemy.engine import Engine, Connection, ResultProxy
 
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -54,7 +54,8 @@ def OptionalEnumColumn(type: t.Type[EnumT], constraint: t.Any | None = None, pri
 
 class SessionWrapper:
     impl: Session
-    def __init__(self, engine: Engine):
+    def __init__(self, engine: Engine | Connection):
+        # Bound to a Connection, the session joins the connection's transaction
         self.impl = Session(engine)
 
     def get_by_name(self, type: t.Type[T], name: str) -> T:
@@ -77,6 +78,11 @@ class SessionWrapper:
 
         return entry
 
+    def get_all_by_name(self, type: t.Type[T], name: str) -> t.Sequence[T]:
+        return self.impl.execute( # type: ignore
+            select(type).filter_by(name=name) # type: ignore
+        ).scalars().all()
+
     def get_all(self, type: t.Type[T]) -> t.Sequence[T]:
         return self.impl.execute( # type: ignore
             select(type) # type: ignore
@@ -87,16 +93,30 @@ class SessionWrapper:
             select(table.columns)
         ).all()
 
+    def iter_rows(self, table: Table, chunk_size: int) -> t.Iterator[t.Sequence[t.Any]]:
+        result = self.impl.execute( # type: ignore
+            select(table.columns).execution_options(stream_results=True)
+        )
+        return result.partitions(chunk_size)
+
     def add(self, obj: t.Any):
         self.impl.add(obj) # type: ignore
 
+    def delete(self, obj: t.Any):
+        self.impl.delete(obj) # type: ignore
+
+    def flush(self):
+        self.impl.flush()
+
     def commit(self):
         self.impl.commit()
 
     def insert_rows(self, table: Table, values: t.Sequence[t.Mapping[str, t.Any]]):
-        self.impl.execute( # type: ignore
-            insert(table).values(values)
-        )
+        # executemany: one compiled statement for the whole batch
+        if values:
+            self.impl.execute( # type: ignore
+                insert(table), values
+            )
 
     def upsert_rows(self, table: Table, rows: t.Sequence[t.Mapping[str, t.Any]]):
         upsert_errors: set[TableErrorReportItem] = set()
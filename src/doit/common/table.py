@@ -2,6 +2,8 @@ from __future__ import annotations
 import typing as t
 from collections import abc
 import traceback
+from array import array
+from itertools import islice
 from dataclasses import dataclass
 
 ### Error types
@@ -30,6 +32,7 @@ ColumnIdP = t.TypeVar('ColumnIdP')
 
 ### TableValue
 class Some(t.Generic[T]):
+    __slots__ = ('value',)
     value: T
     def __init__(self, value: T):
         self.value=value
@@ -54,6 +57,13 @@ class Some(t.Generic[T]):
         return ErrorValue(IncorrectType(self.value))
 
 class Omitted:
+    # Stateless, so every Omitted() is the same interned instance
+    __slots__ = ()
+    _instance: t.ClassVar[t.Optional[Omitted]] = None
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
     def __hash__(self):
         return hash(())
     def __eq__(self, o: t.Any):
@@ -68,6 +78,13 @@ class Omitted:
         return self
 
 class Redacted:
+    # Stateless, so every Redacted() is the same interned instance
+    __slots__ = ()
+    _instance: t.ClassVar[t.Optional[Redacted]] = None
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
     def __hash__(self):
         return hash(())
     def __eq__(self, o: t.Any):
@@ -102,12 +119,21 @@ class ValuesAlreadyExistInRow(t.NamedTuple):
 
 ErrorReason = ColumnNotFoundInRow | LookupSanitizerMiss | IncorrectType | MissingCode | ValuesAlreadyExistInRow
 
+# Walking the stack for every error is expensive, so it is only done when
+# debugging (see write_error_report(debug=True))
+_capture_error_stacks = False
+
+def capture_error_stacks(enabled: bool = True):
+    global _capture_error_stacks
+    _capture_error_stacks = enabled
+
 class ErrorValue:
+    __slots__ = ('stack', 'reason')
     stack: traceback.StackSummary
     reason: ErrorReason
 
     def __init__(self, reason: ErrorReason):
-        self.stack = traceback.extract_stack()
+        self.stack = traceback.extract_stack() if _capture_error_stacks else traceback.StackSummary()
         self.reason = reason
 
     def __repr__(self):
@@ -134,6 +160,13 @@ class ErrorValue:
 
 TableValue = Some[T] | Omitted | Redacted | ErrorValue
 
+def to_raw(value: TableValue[t.Any]) -> t.Any:
+    """Plain value for Some cells; the (interned) TableValue itself otherwise.
+
+    Used to build cheap hashable keys out of rows (see LookupSanitizer.map)
+    """
+    return value.value if type(value) is Some else value
+
 def value_if_none_fn(none_value: TableValue[T]) -> t.Callable[[T | None], TableValue[T]]:
     return lambda x: none_value if x is None else Some(x)
 
@@ -141,10 +174,18 @@ def value_if_none_fn_seq(none_value: TableValue[t.Sequence[T]]) -> t.Callable[[t
     return lambda x: none_value if any(i is None for i in x) else t.cast(TableValue[t.Sequence[T]], Some(x))
 
 def lookup_fn(map: t.Mapping[SingleT, SingleP]) -> t.Callable[[SingleT], TableValue[SingleP]]:
-    return lambda x: value_if_none_fn(ErrorValue(MissingCode(x, map)))(map.get(x)) 
+    def inner(x: SingleT) -> TableValue[SingleP]:
+        result = map.get(x)
+        return ErrorValue(MissingCode(x, map)) if result is None else Some(result)
+    return inner
 
 def lookup_fn_seq(map: t.Mapping[SingleT, SingleP]) -> t.Callable[[t.Sequence[SingleT]], TableValue[t.Sequence[SingleP]]]:
-    return lambda x: value_if_none_fn_seq(ErrorValue(MissingCode(x, map)))(tuple(map.get(i) for i in x))
+    def inner(x: t.Sequence[SingleT]) -> TableValue[t.Sequence[SingleP]]:
+        result = tuple(map.get(i) for i in x)
+        if any(i is None for i in result):
+            return ErrorValue(MissingCode(x, map))
+        return Some(t.cast(t.Sequence[SingleP], result))
+    return inner
 
 def cast_fn(to_type: t.Type[SingleP]) -> t.Callable[[SingleT], TableValue[SingleP]]:
     def inner(x: SingleT):
@@ -166,16 +207,30 @@ def cast_fn_seq(to_type: t.Type[SingleP]) -> t.Callable[[t.Sequence[SingleT]], T
 ### TableRowView
 
 class TableRowView(t.Generic[ColumnIdT]):
+    __slots__ = ('_map', '_hash')
     _map: t.Mapping[ColumnIdT, TableValue[t.Any]]
+    _hash: t.Optional[int]
 
     def __init__(self, items: t.Iterable[t.Tuple[ColumnIdT, TableValue[t.Any]]]):
         self._map = dict(items)
+        self._hash = None
+
+    @classmethod
+    def _from_map(cls, map: t.Mapping[ColumnIdT, TableValue[t.Any]]) -> TableRowView[ColumnIdT]:
+        # Wraps an existing mapping without copying it (used for columnar row adapters)
+        view = cls.__new__(cls)
+        view._map = map
+        view._hash = None
+        return view
 
     def __hash__(self) -> int:
-        error = next((v for v in self._map.values() if isinstance(v, ErrorValue)), None)
-        if error:
-            raise Exception("Unexpected error value: {}".format(error)) # TODO: Make into proper exception (& test)
-        return hash(frozenset((k, v) for k, v in self._map.items()))
+        # Row views are immutable, so the hash is computed once
+        if self._hash is None:
+            error = next((v for v in self._map.values() if isinstance(v, ErrorValue)), None)
+            if error:
+                raise Exception("Unexpected error value: {}".format(error)) # TODO: Make into proper exception (& test)
+            self._hash = hash(frozenset((k, v) for k, v in self._map.items()))
+        return self._hash
 
     def __eq__(self, o: t.Any) -> bool:
         return isinstance(o, TableRowView) and self._map == t.cast(TableRowView[ColumnIdT], o)._map
@@ -193,10 +248,14 @@ class TableRowView(t.Generic[ColumnIdT]):
         return self._map.items()
 
     def get(self, column_name: ColumnIdT) -> TableValue[t.Any]:
-        return self._map.get(column_name, ErrorValue(ColumnNotFoundInRow(column_name, self)))
+        result = self._map.get(column_name)
+        if result is None:
+            return ErrorValue(ColumnNotFoundInRow(column_name, self))
+        return result
 
     def subset(self, keys: t.Collection[ColumnIdT]) -> TableRowView[ColumnIdT]:
-        return TableRowView((k, self.get(k)) for k in keys)
+        # A projection over this row; values are not copied
+        return TableRowView._from_map(ProjectedRowMap(self, tuple(dict.fromkeys(keys))))
 
     def has_some(self):
         return any(isinstance(i, Some) for i in self._map.values())
@@ -209,17 +268,253 @@ class TableRowView(t.Generic[ColumnIdT]):
                     for v in view._map.items() 
         )
 
+class ProjectedRowMap(abc.Mapping[ColumnIdT, TableValue[t.Any]]):
+    # Read-only mapping exposing `keys` of a parent row view. Keys missing from
+    # the parent map to ColumnNotFoundInRow errors, as with TableRowView.get
+    __slots__ = ('_parent', '_keys')
+    _parent: TableRowView[ColumnIdT]
+    _keys: t.Tuple[ColumnIdT, ...]
+
+    def __init__(self, parent: TableRowView[ColumnIdT], keys: t.Tuple[ColumnIdT, ...]):
+        self._parent = parent
+        self._keys = keys
+
+    def __getitem__(self, key: ColumnIdT) -> TableValue[t.Any]:
+        if key not in self._keys:
+            raise KeyError(key)
+        return self._parent.get(key)
+
+    def __iter__(self) -> t.Iterator[ColumnIdT]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items()))
+
+### TableColumn
+
+# Per-cell states stored in TableColumn.states
+CELL_SOME, CELL_OMITTED, CELL_REDACTED, CELL_ERROR = range(4)
+
+def pack_column_values(values: t.List[t.Any], states: array) -> t.Sequence[t.Any]:
+    # Store homogeneous int / float columns in a typed array; everything else
+    # stays a tuple of python objects. Non-Some cells hold a placeholder.
+    some_values = tuple(v for v, s in zip(values, states) if s == CELL_SOME)
+    if some_values and all(type(v) is int for v in some_values):
+        try:
+            return array('q', (v if s == CELL_SOME else 0 for v, s in zip(values, states)))
+        except OverflowError:
+            pass
+    if some_values and all(type(v) is float for v in some_values):
+        return array('d', (v if s == CELL_SOME else 0.0 for v, s in zip(values, states)))
+    return tuple(values)
+
+class TableColumn(t.Generic[T]):
+    __slots__ = ('values', 'states', 'errors')
+    values: t.Sequence[t.Any]
+    states: array
+    errors: t.Mapping[int, ErrorValue]
+
+    def __init__(self, values: t.Sequence[t.Any], states: array, errors: t.Mapping[int, ErrorValue]):
+        self.values = values
+        self.states = states
+        self.errors = errors
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def __getitem__(self, idx: int) -> TableValue[T]:
+        state = self.states[idx]
+        if state == CELL_SOME:
+            return Some(self.values[idx])
+        if state == CELL_OMITTED:
+            return Omitted()
+        if state == CELL_REDACTED:
+            return Redacted()
+        return self.errors[idx]
+
+    def __iter__(self) -> t.Iterator[TableValue[T]]:
+        return (self[i] for i in range(len(self)))
+
+    def raw(self, idx: int) -> t.Any:
+        # Same as to_raw(self[idx]), without wrapping Some values
+        return self.values[idx] if self.states[idx] == CELL_SOME else self[idx]
+
+    def raw_values(self) -> t.List[t.Any]:
+        # Same as [self.raw(i) for i in range(len(self))]
+        if self.states.count(CELL_SOME) == len(self.states):
+            return list(self.values)
+        return [v if s == CELL_SOME else self[i] for i, (v, s) in enumerate(zip(self.values, self.states))]
+
+    def slice(self, start: int, stop: int) -> TableColumn[T]:
+        return TableColumn(
+            self.values[start:stop],
+            self.states[start:stop],
+            { i - start: e for i, e in self.errors.items() if start <= i < stop },
+        )
+
+    def __eq__(self, o: t.Any) -> bool:
+        if not isinstance(o, TableColumn):
+            return False
+        other = t.cast(TableColumn[t.Any], o)
+        return (
+            self.states == other.states and
+            self.errors == other.errors and
+            all(a == b for a, b, s in zip(self.values, other.values, self.states) if s == CELL_SOME)
+        )
+
+    def __repr__(self) -> str:
+        return "TableColumn({})".format(list(self))
+
+    @classmethod
+    def from_values(cls, values: t.Iterable[TableValue[t.Any]]) -> TableColumn[t.Any]:
+        builder = TableColumnBuilder()
+        for v in values:
+            builder.append(v)
+        return builder.build()
+
+class TableColumnBuilder:
+    __slots__ = ('_values', '_states', '_errors')
+    _values: t.List[t.Any]
+    _states: array
+    _errors: t.Dict[int, ErrorValue]
+
+    def __init__(self):
+        self._values = []
+        self._states = array('B')
+        self._errors = {}
+
+    def append(self, value: TableValue[t.Any] | t.Any):
+        # Anything that isn't a TableValue is a raw value standing in for Some(value);
+        # loaders use this to avoid wrapping every cell.
+        value_type = type(value)
+        if value_type is Some:
+            self._values.append(value.value)
+            self._states.append(CELL_SOME)
+        elif value_type is Omitted:
+            self._values.append(None)
+            self._states.append(CELL_OMITTED)
+        elif value_type is Redacted:
+            self._values.append(None)
+            self._states.append(CELL_REDACTED)
+        elif value_type is ErrorValue:
+            self._errors[len(self._values)] = value
+            self._values.append(None)
+            self._states.append(CELL_ERROR)
+        else:
+            self._values.append(value)
+            self._states.append(CELL_SOME)
+
+    def build(self) -> TableColumn[t.Any]:
+        return TableColumn(pack_column_values(self._values, self._states), self._states, self._errors)
+
+class ColumnarRowMap(abc.Mapping[ColumnIdT, TableValue[t.Any]]):
+    # Read-only mapping over a single row of a columnar TableData
+    __slots__ = ('_columns', '_idx')
+    _columns: t.Mapping[ColumnIdT, TableColumn[t.Any]]
+    _idx: int
+
+    def __init__(self, columns: t.Mapping[ColumnIdT, TableColumn[t.Any]], idx: int):
+        self._columns = columns
+        self._idx = idx
+
+    def __getitem__(self, key: ColumnIdT) -> TableValue[t.Any]:
+        return self._columns[key][self._idx]
+
+    def __iter__(self) -> t.Iterator[ColumnIdT]:
+        return iter(self._columns)
+
+    def __len__(self) -> int:
+        return len(self._columns)
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items()))
+
 ### TableData
 
 @dataclass(frozen=True)
 class TableData(t.Generic[ColumnIdT]):
     column_ids: t.Tuple[ColumnIdT, ...]
-    rows: t.Tuple[TableRowView[ColumnIdT], ...]
+    columns: t.Mapping[ColumnIdT, TableColumn[t.Any]]
+    nrows: int
+
+    @property
+    def rows(self) -> TableRows[ColumnIdT]:
+        return TableRows(self)
+
+    def column(self, column_id: ColumnIdT) -> TableColumn[t.Any]:
+        result = self.columns.get(column_id)
+        if result is None:
+            raise Exception("Error: column {} not found in table".format(column_id))
+        return result
 
     def subset(self, keys: t.Collection[ColumnIdT]):
+        # Shares column storage with this table; only the column selection is new
+        column_ids = tuple(dict.fromkeys(keys))
+        return TableData(
+            column_ids=column_ids,
+            columns={ k: self.column(k) for k in column_ids },
+            nrows=self.nrows,
+        )
+
+    def slice_rows(self, start: int, stop: int):
+        # Rows [start, stop), as with list slicing
+        start, stop, _ = slice(start, stop).indices(self.nrows)
         return TableData(
-            column_ids=self.column_ids, # TODO: Mistake? not subsetting column_ids?
-            rows=tuple(row.subset(keys) for row in self.rows)
+            column_ids=self.column_ids,
+            columns={ k: v.slice(start, stop) for k, v in self.columns.items() },
+            nrows=max(stop - start, 0),
+        )
+
+    @classmethod
+    def from_cells(
+        cls,
+        column_ids: t.Tuple[ColumnIdT, ...],
+        rows: t.Iterable[t.Iterable[TableValue[t.Any] | t.Any]],
+    ) -> TableData[ColumnIdT]:
+        # Cells may be TableValues or raw values (which stand for Some(value)).
+        # Short rows are padded with Omitted; extra cells are dropped
+        builders = tuple(TableColumnBuilder() for _ in column_ids)
+        omitted = Omitted()
+        nrows = 0
+        for row in rows:
+            ncells = 0
+            for builder, value in zip(builders, row):
+                builder.append(value)
+                ncells += 1
+            for builder in builders[ncells:]:
+                builder.append(omitted)
+            nrows += 1
+
+        columns = { cid: b.build() for cid, b in zip(column_ids, builders) }
+
+        return TableData(
+            column_ids=column_ids,
+            columns=columns,
+            nrows=nrows,
+        )
+
+    @classmethod
+    def from_rows(
+        cls,
+        column_ids: t.Tuple[ColumnIdT, ...],
+        rows: t.Iterable[TableRowView[ColumnIdT]],
+    ) -> TableData[ColumnIdT]:
+        return cls.from_cells(
+            column_ids,
+            (tuple(row.get(c) for c in column_ids) for row in rows),
+        )
+
+    @classmethod
+    def combine_tables(cls, *tables: TableData[ColumnIdT]) -> TableData[ColumnIdT]:
+        if len(set(table.nrows for table in tables)) > 1:
+            raise ValueError("Error: cannot combine tables with different row counts")
+        return TableData(
+            column_ids=tuple(c for table in tables for c in table.column_ids),
+            columns={ k: v for table in tables for k, v in table.columns.items() },
+            nrows=tables[0].nrows if tables else 0,
         )
 
     def __repr__(self):
@@ -228,6 +523,38 @@ class TableData(t.Generic[ColumnIdT]):
             result += " | ".join(repr(row.get(c)) for c in self.column_ids) + "\n"
         return result
 
+def iter_chunks(items: t.Iterable[T], chunk_size: int) -> t.Iterator[t.Tuple[T, ...]]:
+    it = iter(items)
+    while chunk := tuple(islice(it, chunk_size)):
+        yield chunk
+
+class TableRows(abc.Sequence[TableRowView[ColumnIdT]]):
+    # Row-oriented adapter over a columnar TableData
+    _data: TableData[ColumnIdT]
+
+    def __init__(self, data: TableData[ColumnIdT]):
+        self._data = data
+
+    def __len__(self) -> int:
+        return self._data.nrows
+
+    @t.overload
+    def __getitem__(self, idx: int) -> TableRowView[ColumnIdT]: ...
+    @t.overload
+    def __getitem__(self, idx: slice) -> t.Tuple[TableRowView[ColumnIdT], ...]: ...
+    def __getitem__(self, idx: int | slice):
+        if isinstance(idx, slice):
+            return tuple(self[i] for i in range(*idx.indices(len(self))))
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return TableRowView._from_map(ColumnarRowMap(self._data.columns, idx))
+
+    def __iter__(self) -> t.Iterator[TableRowView[ColumnIdT]]:
+        columns = self._data.columns
+        return (TableRowView._from_map(ColumnarRowMap(columns, i)) for i in range(self._data.nrows))
+
 # Table error handling. TODO: Move somewhere else?
 
 class TableErrorReportItem(t.NamedTuple):
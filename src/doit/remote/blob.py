@@ -1,76 +1,414 @@
+from __future__ import annotations
+import typing as t
 from pathlib import Path
+from contextlib import contextmanager
 import tarfile
+import hashlib
+import struct
+import pickle
+import gzip
 import io
+import os
+import tempfile
+
+from ..unsanitizedtable.model import UnsanitizedTable
 
 from .model import (
     BlobInfo,
+    BlobManifest,
+    BlobRef,
+    BlobRefMember,
     Blob,
+    OpenBlob,
     QualtricsSourceInfo,
     WearitSourceInfo,
 )
 
-def load_blob(blob: Blob):
-    match blob.info.source_info:
+def load_blob(blob: OpenBlob, validate: bool = False):
+    # Data members are parsed in one pass as they are decoded out of the blob,
+    # and checked against their recorded checksum once read to the end. Data
+    # we stored ourselves is trusted; freshly fetched data should be validated
+    info = blob.info
+    match info.source_info:
+        case QualtricsSourceInfo():
+            from ..unsanitizedtable.io.qualtrics import load_unsanitizedtable_qualtrics_file
+            return load_unsanitizedtable_qualtrics_file(
+                blob.open_member('schema.json').read().decode('utf-8'),
+                member_text(blob, 'data.json', info.source_info.data_checksum),
+                blob.open_member('survey.json').read().decode('utf-8'),
+                info.source_info.data_checksum,
+                trusted=not validate,
+            )
+        case WearitSourceInfo():
+            from ..unsanitizedtable.io.wearit import load_unsanitizedtable_wearit_file
+            return load_unsanitizedtable_wearit_file(
+                blob.open_member('schema.json').read().decode('utf-8'),
+                member_text(blob, 'data.csv', info.source_info.data_checksum),
+                info.source_info.data_checksum,
+            )
+
+def load_blob_stream(blob: OpenBlob, chunk_size: int):
+    # Data members are decoded straight out of the file; chunks must be
+    # consumed while the blob is still open
+    info = blob.info
+    match info.source_info:
         case QualtricsSourceInfo():
-            from ..unsanitizedtable.io.qualtrics import load_unsanitizedtable_qualtrics
-            schema = blob.lazydata['schema.json']()
-            data = blob.lazydata['data.json']()
-            survey = blob.lazydata['survey.json']()
-            return load_unsanitizedtable_qualtrics(
-                schema.decode('utf-8'),
-                data.decode('utf-8'),
-                survey.decode('utf-8')
+            from ..unsanitizedtable.io.qualtrics import load_unsanitizedtable_qualtrics_stream
+            return load_unsanitizedtable_qualtrics_stream(
+                blob.open_member('schema.json').read().decode('utf-8'),
+                member_text(blob, 'data.json', info.source_info.data_checksum),
+                blob.open_member('survey.json').read().decode('utf-8'),
+                info.source_info.data_checksum,
+                chunk_size,
+                trusted=True,
             )
         case WearitSourceInfo():
-            from ..unsanitizedtable.io.wearit import load_unsanitizedtable_wearit
-            schema = blob.lazydata['schema.json']()
-            data = blob.lazydata['data.csv']()
-            return load_unsanitizedtable_wearit(schema.decode('utf-8'), data.decode('utf-8'))
-
-def extract_member_data_fn(tf: tarfile.TarFile, member: tarfile.TarInfo):
-    def inner():
-        data = tf.extractfile(member)
+            from ..unsanitizedtable.io.wearit import load_unsanitizedtable_wearit_stream
+            return load_unsanitizedtable_wearit_stream(
+                blob.open_member('schema.json').read().decode('utf-8'),
+                member_text(blob, 'data.csv'),
+                info.source_info.data_checksum,
+                chunk_size,
+            )
+
+class ChecksumReader(io.RawIOBase):
+    # Raises once the member has been read to the end if its sha256 doesn't
+    # match the checksum recorded in info.json
+    def __init__(self, f: t.BinaryIO, name: str, checksum: str):
+        self.f = f
+        self.name = name
+        self.checksum = checksum
+        self.hash = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b: t.Any):
+        data = self.f.read(len(b))
+        if data:
+            b[:len(data)] = data
+            self.hash.update(data)
+        elif self.hash.hexdigest() != self.checksum:
+            raise Exception("Error: {} does not match its recorded checksum".format(self.name))
+        return len(data)
+
+def member_text(blob: OpenBlob, name: str, checksum: str | None = None) -> t.TextIO:
+    data: t.BinaryIO = blob.open_member(name)
+    if checksum is not None:
+        data = t.cast(t.BinaryIO, io.BufferedReader(ChecksumReader(data, name, checksum)))
+    return io.TextIOWrapper(data, encoding='utf-8', newline='')
+
+def open_from_blob(blob: Blob) -> OpenBlob:
+    return OpenBlob(
+        info=blob.info,
+        member_names=tuple(blob.lazydata),
+        open_member=lambda name: io.BytesIO(blob.lazydata[name]()),
+    )
+
+### Legacy .tar.gz blobs (info.json last, whole archive gzipped)
+
+def open_tar_member_fn(tf: tarfile.TarFile):
+    def inner(name: str) -> t.BinaryIO:
+        data = tf.extractfile(name)
         if not data:
-            raise Exception("Error: {} is empty in blob".format(member.name))
-        return data.read()
+            raise Exception("Error: {} is empty in blob".format(name))
+        return t.cast(t.BinaryIO, data)
     return inner
 
-def blob_from_tar(tf: tarfile.TarFile) -> Blob:
-    info_member = tf.getmember('info.json')
-    info_data = tf.extractfile(info_member)
+def blob_from_tar(tf: tarfile.TarFile) -> OpenBlob:
+    info_data = tf.extractfile('info.json')
     if not info_data:
         raise Exception("Error: info.json missing in blob")
 
     info = BlobInfo.parse_raw(info_data.read(), encoding="utf8")
-    return Blob(
+    return OpenBlob(
         info=info,
-        lazydata={
-            m.name: extract_member_data_fn(tf, m) for m in tf.getmembers() if m.name != "info.json"
-        }
+        member_names=tuple(m.name for m in tf.getmembers() if m.name != "info.json"),
+        open_member=open_tar_member_fn(tf),
+    )
+
+### Legacy blob containers: header, uncompressed manifest, then independently
+### gzipped members. No longer written (fetches write blob refs); read so
+### they can still be loaded and migrated
+###
+###   BLOB_MAGIC | version (uint16) | manifest length (uint32) | manifest json | members...
+###
+### Member offsets in the manifest are relative to the end of the manifest
+
+BLOB_MAGIC = b"DOITBLOB"
+BLOB_VERSION = 1
+BLOB_HEADER = struct.Struct(">8sHI")
+
+class MemberReader(io.RawIOBase):
+    # Reads `size` bytes starting at `offset` of an open file
+    def __init__(self, f: t.BinaryIO, offset: int, size: int):
+        self.f = f
+        self.pos = offset
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b: t.Any):
+        self.f.seek(self.pos)
+        data = self.f.read(min(len(b), self.remaining))
+        b[:len(data)] = data
+        self.pos += len(data)
+        self.remaining -= len(data)
+        return len(data)
+
+def blob_magic(filename: Path | str) -> bytes:
+    with open(filename, 'rb') as f:
+        return f.read(len(BLOB_MAGIC))
+
+def is_blob_container(filename: Path | str) -> bool:
+    return blob_magic(filename) == BLOB_MAGIC
+
+def read_blob_manifest(f: t.BinaryIO) -> t.Tuple[BlobManifest, int]:
+    magic, version, manifest_size = BLOB_HEADER.unpack(f.read(BLOB_HEADER.size))
+    if magic != BLOB_MAGIC:
+        raise Exception("Error: not a blob container")
+    if version != BLOB_VERSION:
+        raise Exception("Error: unsupported blob container version {}".format(version))
+    manifest = BlobManifest.parse_raw(f.read(manifest_size), encoding="utf8")
+    return manifest, BLOB_HEADER.size + manifest_size
+
+def blob_from_container(f: t.BinaryIO) -> OpenBlob:
+    manifest, data_start = read_blob_manifest(f)
+
+    def open_member(name: str) -> t.BinaryIO:
+        member = manifest.members.get(name)
+        if member is None:
+            raise Exception("Error: {} missing in blob".format(name))
+        raw = io.BufferedReader(MemberReader(f, data_start + member.offset, member.compressed_size))
+        return t.cast(t.BinaryIO, gzip.GzipFile(fileobj=raw, mode='rb'))
+
+    return OpenBlob(
+        info=manifest.info,
+        member_names=tuple(manifest.members),
+        open_member=open_member,
+    )
+
+### Blob refs: a header like the container's, followed by a manifest that
+### points each member at a gzipped object in a content-addressed store
+###
+###   BLOB_REF_MAGIC | version (uint16) | manifest length (uint32) | manifest json
+###
+### Objects are named by the sha256 of their uncompressed content (for
+### data and schema members, the same value as data_checksum and
+### schema_checksum), so content shared between fetches is stored once and
+### old versions of an instrument cost only their ref file. The manifest
+### records the store relative to the ref, so a source dir can be moved whole.
+
+BLOB_REF_MAGIC = b"DOITBREF"
+BLOB_REF_VERSION = 1
+
+def is_blob_ref(filename: Path | str) -> bool:
+    return blob_magic(filename) == BLOB_REF_MAGIC
+
+def blob_object_filename(store_dir: Path, sha256: str) -> Path:
+    return store_dir / sha256[:2] / (sha256[2:] + ".gz")
+
+def read_blob_ref(f: t.BinaryIO) -> BlobRef:
+    magic, version, manifest_size = BLOB_HEADER.unpack(f.read(BLOB_HEADER.size))
+    if magic != BLOB_REF_MAGIC:
+        raise Exception("Error: not a blob ref")
+    if version != BLOB_REF_VERSION:
+        raise Exception("Error: unsupported blob ref version {}".format(version))
+    return BlobRef.parse_raw(f.read(manifest_size), encoding="utf8")
+
+def blob_from_ref(ref: BlobRef, ref_filename: Path | str) -> OpenBlob:
+    store_dir = Path(ref_filename).parent / ref.store
+
+    def open_member(name: str) -> t.BinaryIO:
+        member = ref.members.get(name)
+        if member is None:
+            raise Exception("Error: {} missing in blob".format(name))
+        object_filename = blob_object_filename(store_dir, member.sha256)
+        if not object_filename.exists():
+            raise Exception("Error: {} missing from blob store ({})".format(name, object_filename))
+        return t.cast(t.BinaryIO, gzip.open(object_filename, 'rb'))
+
+    return OpenBlob(
+        info=ref.info,
+        member_names=tuple(ref.members),
+        open_member=open_member,
     )
 
 ### (Impure) IO functions
 
-def read_blob_info(tarfilename: Path | str):
-    with tarfile.open(tarfilename, 'r:gz') as tf:
-        return blob_from_tar(tf).info
-
-def read_blob(tarfilename: Path | str):
-     with tarfile.open(tarfilename, 'r:gz') as tf:
-        return load_blob(blob_from_tar(tf))
-
-def write_blob(blob: Blob, tarfilename: str | Path):
-    tarfilename = Path(tarfilename)
-
-    if tarfilename.exists():
-        raise Exception("Error: {} already exists!".format(tarfilename))
-
-    tarfilename.parent.mkdir(exist_ok=True, parents=True)
-    
-    with tarfile.open(tarfilename, 'w:gz') as tf:
-        blob_entries = (*blob.lazydata.items(), ("info.json", lambda: blob.info.json().encode('utf-8')))
-        for filename, lazycontent in blob_entries:
-            content = lazycontent()
-            ifo = tarfile.TarInfo(filename)
-            ifo.size = len(content)
-            tf.addfile(ifo, io.BytesIO(content))   
\ No newline at end of file
+@contextmanager
+def open_blob(filename: Path | str) -> t.Iterator[OpenBlob]:
+    magic = blob_magic(filename)
+    if magic == BLOB_MAGIC:
+        with open(filename, 'rb') as f:
+            yield blob_from_container(f)
+    elif magic == BLOB_REF_MAGIC:
+        with open(filename, 'rb') as f:
+            ref = read_blob_ref(f)
+        yield blob_from_ref(ref, filename)
+    else:
+        with tarfile.open(filename, 'r:gz') as tf:
+            yield blob_from_tar(tf)
+
+def read_blob_info(filename: Path | str) -> BlobInfo:
+    magic = blob_magic(filename)
+    if magic == BLOB_MAGIC:
+        with open(filename, 'rb') as f:
+            return read_blob_manifest(f)[0].info
+    if magic == BLOB_REF_MAGIC:
+        with open(filename, 'rb') as f:
+            return read_blob_ref(f).info
+    with open_blob(filename) as blob:
+        return blob.info
+
+def read_blob(filename: Path | str):
+    with open_blob(filename) as blob:
+        return load_blob(blob)
+
+# Bump whenever a loader's output changes, so cached tables are rebuilt
+LOADER_VERSION = 1
+
+class TableCacheKey(t.NamedTuple):
+    loader_version: int
+    data_checksum: str
+    schema_checksum: str
+    blob_mtime_ns: int
+    blob_size: int
+
+def table_cache_filename(filename: Path | str) -> Path:
+    filename = Path(filename)
+    return filename.with_name(filename.name.removesuffix(".tar.gz").removesuffix(".blob") + ".table.cache")
+
+def table_cache_key(filename: Path | str, info: BlobInfo) -> TableCacheKey:
+    stat = os.stat(filename)
+    return TableCacheKey(
+        loader_version=LOADER_VERSION,
+        data_checksum=info.source_info.data_checksum,
+        schema_checksum=info.source_info.schema_checksum,
+        blob_mtime_ns=stat.st_mtime_ns,
+        blob_size=stat.st_size,
+    )
+
+def read_table_cache(filename: Path | str) -> t.Tuple[TableCacheKey, UnsanitizedTable] | None:
+    try:
+        with open(table_cache_filename(filename), 'rb') as f:
+            key = pickle.load(f)
+            if not isinstance(key, TableCacheKey) or key.loader_version != LOADER_VERSION:
+                return None
+            return key, pickle.load(f)
+    except Exception:
+        # The cache can always be rebuilt, whatever is wrong with it (e.g. it
+        # refers to a module or class that has since moved)
+        return None
+
+@contextmanager
+def replace_on_close(filename: Path) -> t.Iterator[t.BinaryIO]:
+    # Writes to a temp file of its own next to filename, then moves it into
+    # place, so writers racing on the same file (e.g. parallel workers) never
+    # share a temp file, and readers never see a partial one
+    fd, tmp_name = tempfile.mkstemp(dir=filename.parent, prefix=filename.name, suffix=".tmp")
+    try:
+        with open(fd, 'wb') as f:
+            yield f
+        os.replace(tmp_name, filename)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+def write_table_cache(filename: Path | str, info: BlobInfo, table: UnsanitizedTable):
+    # The key goes first so a stale cache can be rejected without unpickling the table
+    with replace_on_close(table_cache_filename(filename)) as f:
+        pickle.dump(table_cache_key(filename, info), f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(table, f, pickle.HIGHEST_PROTOCOL)
+
+def read_blob_cached(filename: Path | str) -> UnsanitizedTable:
+    cached = read_table_cache(filename)
+
+    if cached is not None:
+        key, table = cached
+        stat = os.stat(filename)
+        if (key.blob_mtime_ns, key.blob_size) == (stat.st_mtime_ns, stat.st_size):
+            return table
+
+    with open_blob(filename) as blob:
+        source_info = blob.info.source_info
+        if cached is not None and (cached[0].data_checksum, cached[0].schema_checksum) == (source_info.data_checksum, source_info.schema_checksum):
+            # Blob file was touched, migrated, or rewritten with the same content
+            table = cached[1]
+        else:
+            table = load_blob(blob)
+
+    write_table_cache(filename, blob.info, table)
+
+    return table
+
+@contextmanager
+def open_blob_stream(filename: Path | str, chunk_size: int):
+    with open_blob(filename) as blob:
+        yield load_blob_stream(blob, chunk_size)
+
+# Members are copied into the store in pieces of this size
+BLOB_COPY_SIZE = 1 << 20
+
+def write_blob_object(store_dir: Path, f: t.BinaryIO) -> BlobRefMember:
+    # Compresses into a temp file while hashing, since the object's name
+    # isn't known until the content has been read
+    store_dir.mkdir(exist_ok=True, parents=True)
+    hash = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=store_dir, suffix=".tmp", delete=False) as tmp:
+        try:
+            with gzip.GzipFile(fileobj=tmp, mode='wb', mtime=0) as gz:
+                while chunk := f.read(BLOB_COPY_SIZE):
+                    hash.update(chunk)
+                    size += len(chunk)
+                    gz.write(chunk)
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
+
+    sha256 = hash.hexdigest()
+    object_filename = blob_object_filename(store_dir, sha256)
+    if object_filename.exists():
+        os.unlink(tmp.name)
+    else:
+        object_filename.parent.mkdir(exist_ok=True)
+        os.replace(tmp.name, object_filename)
+
+    return BlobRefMember(sha256=sha256, size=size)
+
+def write_blob_ref(blob: Blob | OpenBlob, filename: str | Path, store_dir: Path, overwrite: bool = False):
+    filename = Path(filename)
+
+    if filename.exists() and not overwrite:
+        raise Exception("Error: {} already exists!".format(filename))
+
+    filename.parent.mkdir(exist_ok=True, parents=True)
+
+    if isinstance(blob, Blob):
+        blob = open_from_blob(blob)
+
+    # Objects are written before the ref, so a ref never points at missing content
+    members: t.Dict[str, BlobRefMember] = {}
+    for name in blob.member_names:
+        with blob.open_member(name) as f:
+            members[name] = write_blob_object(store_dir, f)
+
+    manifest = BlobRef(
+        info=blob.info,
+        store=os.path.relpath(store_dir, filename.parent),
+        members=members,
+    ).json().encode('utf-8')
+
+    with replace_on_close(filename) as f:
+        f.write(BLOB_HEADER.pack(BLOB_REF_MAGIC, BLOB_REF_VERSION, len(manifest)))
+        f.write(manifest)
+
+def migrate_blob(old_filename: Path | str, filename: Path | str, store_dir: Path):
+    # Rewrites a legacy .tar.gz blob or a blob container as a blob ref, then
+    # removes the original (unless it was replaced in place)
+    with open_blob(old_filename) as blob:
+        write_blob_ref(blob, filename, store_dir, overwrite=Path(old_filename) == Path(filename))
+    if Path(old_filename) != Path(filename):
+        Path(old_filename).unlink()
@@ -0,0 +1,105 @@
+from __future__ import annotations
+import typing as t
+from pathlib import Path
+import sqlite3
+import os
+from contextlib import closing
+
+# Plain sqlite3 rather than sqlalchemy: the catalog is read on every tab
+# completion, so it should be cheap to import and open
+
+from .model import (
+    BlobInfo,
+    SourceCatalogEntry,
+)
+
+CATALOG_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sources (
+        name TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        uri TEXT NOT NULL,
+        data_checksum TEXT NOT NULL,
+        schema_checksum TEXT NOT NULL,
+        blob_path TEXT NOT NULL,
+        blob_mtime_ns INTEGER NOT NULL,
+        blob_size INTEGER NOT NULL
+    )
+"""
+
+def catalog_entry(name: str, filename: Path, info: BlobInfo) -> SourceCatalogEntry:
+    stat = os.stat(filename)
+    return SourceCatalogEntry(
+        name=name,
+        title=info.title,
+        uri=info.source_info.uri,
+        data_checksum=info.source_info.data_checksum,
+        schema_checksum=info.source_info.schema_checksum,
+        blob_path=str(filename),
+        blob_mtime_ns=stat.st_mtime_ns,
+        blob_size=stat.st_size,
+    )
+
+def is_current(entry: SourceCatalogEntry, filename: Path) -> bool:
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return False
+    return (entry.blob_path, entry.blob_mtime_ns, entry.blob_size) == (str(filename), stat.st_mtime_ns, stat.st_size)
+
+### (Impure) IO functions
+
+def open_catalog(filename: Path) -> sqlite3.Connection:
+    filename.parent.mkdir(exist_ok=True, parents=True)
+    conn = sqlite3.connect(filename)
+    conn.execute(CATALOG_SCHEMA)
+    return conn
+
+def read_catalog(conn: sqlite3.Connection) -> t.Tuple[SourceCatalogEntry, ...]:
+    return tuple(
+        SourceCatalogEntry(*row)
+            for row in conn.execute("SELECT * FROM sources ORDER BY name")
+    )
+
+def read_catalog_names(conn: sqlite3.Connection, prefix: str = "") -> t.Tuple[str, ...]:
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return tuple(
+        name for name, in conn.execute(
+            "SELECT name FROM sources WHERE name LIKE ? ESCAPE '\\' ORDER BY name", (escaped + "%",)
+        )
+    )
+
+def write_catalog_entry(conn: sqlite3.Connection, entry: SourceCatalogEntry):
+    conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?, ?)", entry)
+
+def update_catalog(filename: Path, name: str, blob_filename: Path, info: BlobInfo):
+    with closing(open_catalog(filename)) as conn:
+        write_catalog_entry(conn, catalog_entry(name, blob_filename, info))
+        conn.commit()
+
+def sync_catalog(
+    conn: sqlite3.Connection,
+    names: t.Iterable[str],
+    blob_from_instrument_name: t.Callable[[str], Path],
+) -> t.Tuple[SourceCatalogEntry, ...]:
+    # Re-reads blob info only for blobs that are new or whose file changed since
+    # they were cataloged; entries without a blob are dropped
+    from .blob import read_blob_info
+
+    existing = { e.name: e for e in read_catalog(conn) }
+
+    names = tuple(names)
+
+    for name in names:
+        blob_filename = blob_from_instrument_name(name)
+        entry = existing.get(name)
+        if entry is None or not is_current(entry, blob_filename):
+            write_catalog_entry(conn, catalog_entry(name, blob_filename, read_blob_info(blob_filename)))
+
+    conn.executemany(
+        "DELETE FROM sources WHERE name = ?",
+        ((name,) for name in existing.keys() - set(names)),
+    )
+
+    conn.commit()
+
+    return read_catalog(conn)
@@ -2,7 +2,7 @@ import typing as t
 from pathlib import Path
 from urllib.parse import urlparse, ParseResult
 
-from .model import Blob
+from .model import Blob, OpenBlob, FetchTimings, FetchDecision
 
 ### (Impure) Fetching functions
 
@@ -16,12 +16,61 @@ def get_listing(remote_service: str):
 
 def fetch_blob(uri: str | Path, progress_callback: t.Callable[[int], None] = lambda _: None) -> Blob:
     match urlparse(str(uri)):
-        case ParseResult(scheme="qualtrics", netloc=remote_id):
-            from .qualtrics.impl import fetch_qualtrics_blob
-            return fetch_qualtrics_blob(remote_id, progress_callback)
+        case ParseResult(scheme="qualtrics"):
+            raise Exception("Error: qualtrics sources are fetched with fetch_blobs")
         case ParseResult(scheme="wearit", path=data_path):
             from .wearit.impl import fetch_wearit_blob
             return fetch_wearit_blob(data_path, progress_callback)
         case _:
             raise Exception("Unrecognized uri: {}".format(uri))
 
+
+def fetch_blobs(
+    uris: t.Mapping[str, str],
+    progress_callback_fn: t.Callable[[str], t.Callable[[int], None]],
+    blob_callback: t.Callable[[str, OpenBlob], None],
+    max_concurrency: int = 8,
+    timings_callback: t.Callable[[str, FetchTimings], None] = lambda *_: None,
+    download_callback_fn: t.Callable[[str], t.Callable[[int], None]] = lambda _: lambda _: None,
+    previous_blobs: t.Mapping[str, Path] = {},
+    decision_callback: t.Callable[[str, FetchDecision], None] = lambda *_: None,
+    skip_unchanged: bool = False,
+) -> t.Dict[str, Exception]:
+    # Fetches many sources, keyed by instrument name. Qualtrics surveys are
+    # exported concurrently; blob_callback receives each blob as it arrives
+    # (one at a time, but not necessarily on the calling thread), and must
+    # finish with it before returning. Sources with a blob in
+    # previous_blobs only fetch what changed since, where the remote allows it.
+    # Those that can't, and with skip_unchanged all of them, are skipped
+    # altogether when the remote shows no change (see decision_callback).
+    # Returns the errors of any fetches that failed
+    from .blob import open_from_blob
+
+    qualtrics_ids: t.Dict[str, str] = {}
+    errors: t.Dict[str, Exception] = {}
+
+    for name, uri in uris.items():
+        match urlparse(str(uri)):
+            case ParseResult(scheme="qualtrics", netloc=remote_id):
+                qualtrics_ids[name] = remote_id
+            case _:
+                try:
+                    blob_callback(name, open_from_blob(fetch_blob(uri, progress_callback_fn(name))))
+                except Exception as e:
+                    errors[name] = e
+
+    if qualtrics_ids:
+        from .qualtrics.impl import fetch_qualtrics_blobs
+        errors |= fetch_qualtrics_blobs(
+            qualtrics_ids,
+            progress_callback_fn,
+            blob_callback,
+            max_concurrency,
+            timings_callback=timings_callback,
+            download_callback_fn=download_callback_fn,
+            previous_blobs=previous_blobs,
+            decision_callback=decision_callback,
+            skip_unchanged=skip_unchanged,
+        )
+
+    return errors
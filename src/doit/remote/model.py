@@ -13,6 +13,28 @@ class LocalTableListing(t.NamedTuple):
     title: str
     uri: str
 
+class SourceCatalogEntry(t.NamedTuple):
+    name: str
+    title: str
+    uri: str
+    data_checksum: str
+    schema_checksum: str
+    blob_path: str
+    blob_mtime_ns: int
+    blob_size: int
+
+### Fetching
+
+class FetchTimings(t.NamedTuple):
+    polls: int
+    wait_seconds: float
+    download_seconds: float
+    download_bytes: int
+
+class FetchDecision(t.NamedTuple):
+    fetch: bool
+    reason: str
+
 ### Blob
 
 class SourceColumnInfo(BaseModel):
@@ -24,6 +46,8 @@ class QualtricsSourceInfo(BaseModel):
     remote_id: str
     data_checksum: str
     schema_checksum: str
+    # Picks up the next export where this one left off
+    continuation_token: t.Optional[str] = None
 
     @property
     def uri(self):
@@ -49,6 +73,29 @@ class BlobInfo(BaseModel):
     source_info: TableSourceInfo
     columns: t.Tuple[SourceColumnInfo, ...]
 
+class BlobManifestMember(BaseModel):
+    offset: int
+    size: int
+    compressed_size: int
+
+class BlobManifest(BaseModel):
+    info: BlobInfo
+    members: t.Dict[str, BlobManifestMember]
+
+class BlobRefMember(BaseModel):
+    sha256: str
+    size: int
+
+class BlobRef(BaseModel):
+    info: BlobInfo
+    store: str
+    members: t.Dict[str, BlobRefMember]
+
 class Blob(t.NamedTuple):
     info: BlobInfo
-    lazydata: t.Mapping[str, t.Callable[[], bytes]]
\ No newline at end of file
+    lazydata: t.Mapping[str, t.Callable[[], bytes]]
+
+class OpenBlob(t.NamedTuple):
+    info: BlobInfo
+    member_names: t.Tuple[str, ...]
+    open_member: t.Callable[[str], t.BinaryIO]
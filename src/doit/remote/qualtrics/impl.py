@@ -1,9 +1,17 @@
 from __future__ import annotations
 import typing as t
 import requests
+import asyncio
+import threading
+import time
 import json
 import zipfile
+import hashlib
+import tempfile
 import io
+from pathlib import Path
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
 from pydantic import parse_obj_as
@@ -13,65 +21,458 @@ from ..model import (
     BlobInfo,
     SourceColumnInfo,
     QualtricsSourceInfo,
-    Blob,
+    FetchTimings,
+    FetchDecision,
+    OpenBlob,
 )
 
 from .model import (
     QualtricsRemoteSettings,
     QualtricsSurveyList,
+    QualtricsSurveyActivity,
     QualtricsExportResponse,
     QualtricsExportStatusInProgress,
+    QualtricsExportStatusComplete,
     QualtricsExportStatus,
+    QualtricsExport,
 )
 
+T = t.TypeVar('T')
+
 from ...unsanitizedtable.io.qualtrics import (
-    load_unsanitizedtable_qualtrics
+    parse_qualtrics_layout,
+    merge_qualtrics_responses,
 )
 
 def fetch_qualtrics_listing(settings: QualtricsRemoteSettings = QualtricsRemoteSettings()):
     return QualtricsRemote(settings).fetch_table_listing()
 
-def fetch_qualtrics_blob(remote_id: str, progress_callback: t.Callable[[int], None] = lambda _: None):
-    remote = QualtricsRemote(QualtricsRemoteSettings())
-    table_schema = remote.fetch_remote_table_schema(remote_id)
-    table_data = remote.fetch_remote_table_data(remote_id, progress_callback)
+def next_poll_interval(
+    interval: float,
+    last_percent: float,
+    percent: float,
+    elapsed: float,
+    min_interval: float,
+    max_interval: float,
+) -> float:
+    # Aims to poll about halfway through the time the export looks to have
+    # left, judging by its progress since the last poll (`elapsed` seconds
+    # ago). Without visible progress, backs off exponentially
+    if percent > last_percent:
+        remaining = (100 - percent) * elapsed / (percent - last_percent)
+        return min(max(remaining / 2, min_interval), max_interval)
+    return min(max(interval * 2, min_interval), max_interval)
+
+class ContinuationTokenRejected(Exception):
+    def __init__(self, qualtrics_id: str, status_code: int):
+        super().__init__("Error: continuation token for {} rejected ({})".format(qualtrics_id, status_code))
+
+def is_token_rejection(status_code: int) -> bool:
+    # Client errors other than auth and rate limiting, which would fail a
+    # full export just the same
+    return 400 <= status_code < 500 and status_code not in (401, 403, 429)
+
+class RateLimiter:
+    # Token bucket shared by threads. Callers that find it empty reserve a
+    # future token and sleep until it is due
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
 
-    survey_layout = remote.fetch_survey(remote_id)
+def qualtrics_fetch_decision(previous_layout: str, survey_layout: str, fetch_date_utc: datetime) -> FetchDecision:
+    # Compares the survey's metadata now with what it was at the last fetch,
+    # for sources without a continuation token (or with one, when asked to
+    # skip unchanged sources). Responses (and deletions) move the counts;
+    # edits to the survey move its modification date. Edits to existing
+    # responses move neither, so the reason for a skip says they wait for
+    # the next --full fetch
+    previous = QualtricsSurveyActivity.parse_raw(previous_layout)
+    current = QualtricsSurveyActivity.parse_raw(survey_layout)
 
-    table = load_unsanitizedtable_qualtrics(table_schema, table_data, survey_layout)
+    if previous.lastModifiedDate is None or previous.responseCounts is None or current.responseCounts is None:
+        return FetchDecision(True, "no response counts to compare")
 
-    progress_callback(100)
+    if current.lastModifiedDate != previous.lastModifiedDate:
+        return FetchDecision(True, "survey modified {}".format(current.lastModifiedDate))
+
+    if current.responseCounts != previous.responseCounts:
+        return FetchDecision(True, "responses {} -> {}, deleted {} -> {}".format(
+            previous.responseCounts.auditable,
+            current.responseCounts.auditable,
+            previous.responseCounts.deleted,
+            current.responseCounts.deleted,
+        ))
+
+    return FetchDecision(False, "unchanged since {:%Y-%m-%d %H:%M} UTC ({} responses; edits to existing responses need --full)".format(
+        fetch_date_utc,
+        current.responseCounts.auditable,
+    ))
+
+def qualtrics_blob(
+    remote_id: str,
+    table_schema: str,
+    survey_layout: str,
+    open_data: t.Callable[[], t.BinaryIO],
+    data_checksum: str,
+    continuation_token: str | None = None,
+) -> OpenBlob:
+    # Info comes from the schema and layout alone; the data stays on disk
+    qs, schema_map = parse_qualtrics_layout(table_schema, survey_layout)
 
     info = BlobInfo(
         fetch_date_utc=datetime.now(timezone.utc),
-        title=table.source_title,
+        title=qs.title,
         source_info=QualtricsSourceInfo(
             type='qualtrics',
             remote_id=remote_id,
-            data_checksum=table.data_checksum,
-            schema_checksum=table.schema_checksum,
+            data_checksum=data_checksum,
+            schema_checksum=hashlib.sha256(table_schema.encode()).hexdigest(),
+            continuation_token=continuation_token,
         ),
         columns=tuple(
             SourceColumnInfo(
                 name=c.id.unsafe_name,
                 prompt=c.prompt,
-                ) for c in table.schema
+                ) for c in schema_map.columns
         )
     )
 
-    return Blob(
+    def open_member(name: str) -> t.BinaryIO:
+        match name:
+            case "schema.json":
+                return io.BytesIO(table_schema.encode('utf-8'))
+            case "data.json":
+                return open_data()
+            case "survey.json":
+                return io.BytesIO(survey_layout.encode('utf-8'))
+            case _:
+                raise Exception("Error: {} missing in blob".format(name))
+
+    return OpenBlob(
         info=info,
-        lazydata={
-            "schema.json": lambda: table_schema.encode('utf-8'),
-            "data.json": lambda: table_data.encode('utf-8'),
-            "survey.json": lambda: survey_layout.encode('utf-8'),
-        }
+        member_names=("schema.json", "data.json", "survey.json"),
+        open_member=open_member,
     )
 
+# Downloads and unzipping are done in pieces of this size
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+def file_checksum(filename: Path) -> str:
+    hash = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while chunk := f.read(DOWNLOAD_CHUNK_SIZE):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+def merge_export(previous: OpenBlob, delta_filename: Path, data_filename: Path) -> t.Tuple[int, int]:
+    # Merges an incremental export into the data of the previous fetch
+    from ..blob import member_text
+    with ExitStack() as stack:
+        base = stack.enter_context(member_text(previous, 'data.json', previous.info.source_info.data_checksum))
+        delta = stack.enter_context(open(delta_filename, encoding='utf-8'))
+        out = stack.enter_context(open(data_filename, 'w', encoding='utf-8'))
+        return merge_qualtrics_responses(base, delta, out)
+
+def unzip_export(zip_filename: Path, data_filename: Path) -> str:
+    # Extracts the export's single file, returning its sha256
+    hash = hashlib.sha256()
+    with zipfile.ZipFile(zip_filename) as zf:
+        if len(zf.filelist) != 1:
+            raise Exception("Error: expected one file in export, found {}".format(len(zf.filelist)))
+        with zf.open(zf.filelist[0]) as src, open(data_filename, 'wb') as dst:
+            while chunk := src.read(DOWNLOAD_CHUNK_SIZE):
+                hash.update(chunk)
+                dst.write(chunk)
+    return hash.hexdigest()
+
+def fetch_qualtrics_blobs(
+    remote_ids: t.Mapping[str, str],
+    progress_callback_fn: t.Callable[[str], t.Callable[[int], None]],
+    blob_callback: t.Callable[[str, OpenBlob], None],
+    max_concurrency: int,
+    settings: QualtricsRemoteSettings | None = None,
+    timings_callback: t.Callable[[str, FetchTimings], None] = lambda *_: None,
+    download_callback_fn: t.Callable[[str], t.Callable[[int], None]] = lambda _: lambda _: None,
+    previous_blobs: t.Mapping[str, Path] = {},
+    decision_callback: t.Callable[[str, FetchDecision], None] = lambda *_: None,
+    skip_unchanged: bool = False,
+) -> t.Dict[str, Exception]:
+    return asyncio.run(fetch_qualtrics_blobs_async(
+        remote_ids,
+        progress_callback_fn,
+        blob_callback,
+        AsyncQualtricsRemote(QualtricsRemote(settings or QualtricsRemoteSettings(), max_concurrency), max_concurrency),
+        timings_callback,
+        download_callback_fn,
+        previous_blobs,
+        decision_callback,
+        skip_unchanged,
+    ))
+
+async def fetch_qualtrics_blobs_async(
+    remote_ids: t.Mapping[str, str],
+    progress_callback_fn: t.Callable[[str], t.Callable[[int], None]],
+    blob_callback: t.Callable[[str, OpenBlob], None],
+    remote: AsyncQualtricsRemote,
+    timings_callback: t.Callable[[str, FetchTimings], None] = lambda *_: None,
+    download_callback_fn: t.Callable[[str], t.Callable[[int], None]] = lambda _: lambda _: None,
+    previous_blobs: t.Mapping[str, Path] = {},
+    decision_callback: t.Callable[[str, FetchDecision], None] = lambda *_: None,
+    skip_unchanged: bool = False,
+) -> t.Dict[str, Exception]:
+    # Fetches are keyed by instrument name. Each blob is handed to blob_callback
+    # as soon as it arrives, and its data is only on disk until the callback
+    # returns. Callbacks run one at a time on a thread of their own, so other
+    # surveys keep exporting while a blob is being parsed and stored. Failures
+    # are collected rather than raised, so one bad survey doesn't stop the others.
+    #
+    # Surveys with a blob in previous_blobs are fetched incrementally when
+    # that blob has a continuation token. Without one, or with one if
+    # skip_unchanged, they are skipped when their metadata shows nothing
+    # changed since (which misses edits to existing responses). Whether (and
+    # why) each survey is fetched goes to decision_callback
+    from ..blob import open_blob
+
+    errors: t.Dict[str, Exception] = {}
+
+    async def fetch_one(name: str, remote_id: str):
+        try:
+            with ExitStack() as stack:
+                workdir = Path(stack.enter_context(tempfile.TemporaryDirectory(prefix="doit-fetch-")))
+                previous_filename = previous_blobs.get(name)
+                previous = stack.enter_context(open_blob(previous_filename)) if previous_filename else None
+                fetched = await remote.fetch_blob(
+                    remote_id,
+                    lambda: progress_callback_fn(name),
+                    lambda: download_callback_fn(name),
+                    workdir,
+                    previous,
+                    lambda decision: decision_callback(name, decision),
+                    skip_unchanged,
+                )
+                if fetched is None:
+                    return
+                blob, timings = fetched
+                timings_callback(name, timings)
+                await asyncio.get_running_loop().run_in_executor(callback_executor, blob_callback, name, blob)
+        except Exception as e:
+            errors[name] = e
+
+    # A single worker, so callbacks never run concurrently with each other
+    callback_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="blob-callback")
+
+    with remote.executor, callback_executor:
+        await asyncio.gather(*(fetch_one(name, remote_id) for name, remote_id in remote_ids.items()))
+
+    return errors
+
+async def gather_or_cancel(*aws: t.Awaitable[t.Any] | None) -> t.Tuple[t.Any, ...]:
+    # Like asyncio.gather, but the rest are cancelled as soon as one fails
+    # (or if the caller is cancelled). Every failure is reported, not just
+    # the first. None stands in for a result that isn't needed
+    tasks = tuple(asyncio.ensure_future(aw) for aw in aws if aw is not None)
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks)
+
+    errors = tuple(e for task in tasks if not task.cancelled() and (e := task.exception()) is not None)
+    if len(errors) == 1:
+        raise errors[0]
+    if errors:
+        raise Exception("Error: {}".format("; ".join(str(e) for e in errors))) from errors[0]
+
+    results = iter(task.result() for task in tasks)
+    return tuple(None if aw is None else next(results) for aw in aws)
+
+class AsyncQualtricsRemote:
+    # Runs QualtricsRemote's blocking calls on a thread pool, at most
+    # max_concurrency surveys at a time, over the remote's pooled session.
+    # Three workers per survey, so schema and survey requests never wait
+    # behind export polling
+    def __init__(self, remote: QualtricsRemote, max_concurrency: int):
+        self.remote = remote
+        self.limit = asyncio.Semaphore(max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=3*max_concurrency, thread_name_prefix="qualtrics")
+
+    async def run(self, fn: t.Callable[..., T], *args: t.Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def fetch_remote_table_data(
+        self,
+        qualtrics_id: str,
+        progress_callback: t.Callable[[int], None],
+        download_callback: t.Callable[[int], None],
+        workdir: Path,
+        continuation_token: str | None = None,
+    ) -> QualtricsExport:
+        settings = self.remote.settings
+
+        start = time.monotonic()
+
+        try:
+            progress_id = await self.run(self.remote.start_export, qualtrics_id, continuation_token)
+        except ContinuationTokenRejected:
+            # The token has expired (or is otherwise invalid); start over
+            # with a full export
+            continuation_token = None
+            progress_id = await self.run(self.remote.start_export, qualtrics_id, None)
+
+        progress_status: QualtricsExportStatus = QualtricsExportStatusInProgress(
+            percentComplete = "0",
+            status="inProgress"
+        )
+
+        polls = 0
+        interval = 0.0
+        last_percent, last_poll = 0.0, start
+
+        while isinstance(progress_status, QualtricsExportStatusInProgress):
+            percent = float(progress_status.percentComplete)
+            progress_callback(int(percent))
+
+            now = time.monotonic()
+            if now - start > settings.export_timeout:
+                raise Exception("Error: export of {} did not complete within {}s".format(qualtrics_id, settings.export_timeout))
+
+            if polls:
+                interval = next_poll_interval(interval, last_percent, percent, now - last_poll, settings.poll_min_interval, settings.poll_max_interval)
+                await asyncio.sleep(min(interval, max(settings.export_timeout - (now - start), 0)))
+                last_percent, last_poll = percent, now
+
+            progress_status = await self.run(self.remote.fetch_export_status, qualtrics_id, progress_id)
+            polls += 1
+
+        if not isinstance(progress_status, QualtricsExportStatusComplete) or progress_status.fileId is None:
+            raise Exception("export failed")
+
+        download_start = time.monotonic()
+
+        zip_filename = workdir / "export.zip"
+        data_filename = workdir / "data.json"
+
+        download_bytes = await self.run(self.remote.download_export, qualtrics_id, progress_status.fileId, zip_filename, download_callback)
+        data_checksum = await self.run(unzip_export, zip_filename, data_filename)
+        zip_filename.unlink()
+
+        return QualtricsExport(
+            data_filename=data_filename,
+            data_checksum=data_checksum,
+            continuation_token=progress_status.continuationToken,
+            incremental=continuation_token is not None,
+            timings=FetchTimings(
+                polls=polls,
+                wait_seconds=download_start - start,
+                download_seconds=time.monotonic() - download_start,
+                download_bytes=download_bytes,
+            ),
+        )
+
+    async def fetch_blob(
+        self,
+        qualtrics_id: str,
+        progress_callback_fn: t.Callable[[], t.Callable[[int], None]],
+        download_callback_fn: t.Callable[[], t.Callable[[int], None]],
+        workdir: Path,
+        previous: OpenBlob | None = None,
+        decision_callback: t.Callable[[FetchDecision], None] = lambda _: None,
+        skip_unchanged: bool = False,
+    ) -> t.Tuple[OpenBlob, FetchTimings] | None:
+        # Returns None when the survey is unchanged since `previous`
+        previous_info = previous.info.source_info if previous is not None else None
+        continuation_token = previous_info.continuation_token if isinstance(previous_info, QualtricsSourceInfo) else None
+
+        survey_layout: str | None = None
+
+        if previous is None:
+            decision_callback(FetchDecision(True, "no previous fetch"))
+        elif continuation_token is not None and not skip_unchanged:
+            # Continued exports are cheap, and unlike the survey's metadata
+            # they also pick up edits to existing responses
+            decision_callback(FetchDecision(True, "responses since last fetch"))
+        else:
+            # A single request, made before waiting for an export slot
+            survey_layout = await self.run(self.remote.fetch_survey, qualtrics_id)
+            with previous.open_member('survey.json') as f:
+                previous_layout = f.read().decode('utf-8')
+            decision = qualtrics_fetch_decision(previous_layout, survey_layout, previous.info.fetch_date_utc)
+            decision_callback(decision)
+            if not decision.fetch:
+                return None
+
+        async with self.limit:
+            progress_callback = progress_callback_fn()
+            # Schema and survey are fetched while the export is being prepared
+            table_schema, export, fetched_layout = await gather_or_cancel(
+                self.run(self.remote.fetch_remote_table_schema, qualtrics_id),
+                self.fetch_remote_table_data(
+                    qualtrics_id,
+                    progress_callback,
+                    download_callback_fn(),
+                    workdir,
+                    continuation_token,
+                ),
+                self.run(self.remote.fetch_survey, qualtrics_id) if survey_layout is None else None,
+            )
+
+        if survey_layout is None:
+            survey_layout = fetched_layout
+
+        open_data: t.Callable[[], t.BinaryIO] = lambda: open(export.data_filename, 'rb')
+        data_checksum = export.data_checksum
+
+        if export.incremental and previous is not None:
+            merged_filename = workdir / "merged.json"
+            replaced, added = await self.run(merge_export, previous, export.data_filename, merged_filename)
+            if replaced or added:
+                open_data = lambda: open(merged_filename, 'rb')
+                data_checksum = await self.run(file_checksum, merged_filename)
+            else:
+                # Nothing new: keep the previous data as it was, checksum and all
+                open_data = lambda: previous.open_member('data.json')
+                data_checksum = previous.info.source_info.data_checksum
+
+        blob = qualtrics_blob(
+            qualtrics_id,
+            table_schema,
+            survey_layout,
+            open_data,
+            data_checksum,
+            export.continuation_token,
+        )
+
+        progress_callback(100)
+
+        return blob, export.timings
+
 class QualtricsRemote:
     settings = QualtricsRemoteSettings
-    def __init__(self, settings: QualtricsRemoteSettings):
+    def __init__(self, settings: QualtricsRemoteSettings, pool_size: int = 1):
         self.settings = settings
+        # One session so connections are kept alive between requests; sized
+        # so concurrent callers don't have to open throwaway connections
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=3*pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.rate_limiter = RateLimiter(settings.max_requests_per_second, settings.max_request_burst)
 
     def get_endpoint_url(self, endpoint: str) -> str:
         return self.settings.api_url.format(data_center=self.settings.data_center, endpoint=endpoint)
@@ -85,10 +486,12 @@ class QualtricsRemote:
         }
 
     def get(self, endpoint: str, stream: bool = False) -> requests.Response:
-        return requests.request("GET", self.get_endpoint_url(endpoint), headers=self.get_headers(), stream=stream)
+        self.rate_limiter.acquire()
+        return self.session.request("GET", self.get_endpoint_url(endpoint), headers=self.get_headers(), stream=stream)
 
     def post(self, endpoint: str, payload: t.Mapping[str, t.Any]) -> requests.Response:
-        return requests.request("POST", self.get_endpoint_url(endpoint), data=json.dumps(payload), headers=self.get_headers())
+        self.rate_limiter.acquire()
+        return self.session.request("POST", self.get_endpoint_url(endpoint), data=json.dumps(payload), headers=self.get_headers())
 
     def fetch_table_listing(self) -> t.Tuple[RemoteTableListing, ...]:
         response = self.get("surveys").json()
@@ -101,38 +504,46 @@ class QualtricsRemote:
             ) for i in survey_list.elements
         )
 
-    def fetch_remote_table_data(
-        self,
-        qualtrics_id: str,
-        progress_callback: t.Callable[[int], None] = lambda _: None,
-    ) -> str:
+    def start_export(self, qualtrics_id: str, continuation_token: str | None = None) -> str:
+        # Exports responses since the export that issued continuation_token,
+        # or all of them. Either way, asks for a token for next time
         endpoint_prefix = "surveys/{}/export-responses".format(qualtrics_id)
-        response = self.post(endpoint_prefix, dict(format='json')).json()
-        
+        if continuation_token is None:
+            payload = dict(format='json', allowContinuation=True)
+        else:
+            payload = dict(format='json', continuationToken=continuation_token)
+        http_response = self.post(endpoint_prefix, payload)
+        if continuation_token is not None and is_token_rejection(http_response.status_code):
+            raise ContinuationTokenRejected(qualtrics_id, http_response.status_code)
+        http_response.raise_for_status()
+        response = http_response.json()
         assert 'result' in response
-        progressId = QualtricsExportResponse(**response['result']).progressId
-
-        progressStatus = QualtricsExportStatusInProgress(
-            percentComplete = "0",
-            status="inProgress"
-        )
-
-        while progressStatus.status != "complete" and progressStatus.status != "failed":
-            progress_callback(int(float(progressStatus.percentComplete)))
+        return QualtricsExportResponse(**response['result']).progressId
 
-            response = self.get("{}/{}".format(endpoint_prefix, progressId)).json()
-            assert 'result' in response
-
-            progressStatus = parse_obj_as(QualtricsExportStatus, response['result'])
-
-        if progressStatus.status == "failed":
-            raise Exception("export failed")
-
-        requestDownload = self.get("{}/{}/file".format(endpoint_prefix, progressStatus.fileId), stream=True)
+    def fetch_export_status(self, qualtrics_id: str, progress_id: str) -> QualtricsExportStatus:
+        endpoint_prefix = "surveys/{}/export-responses".format(qualtrics_id)
+        response = self.get("{}/{}".format(endpoint_prefix, progress_id)).json()
+        assert 'result' in response
+        return parse_obj_as(QualtricsExportStatus, response['result'])
 
-        with zipfile.ZipFile(io.BytesIO(requestDownload.content)) as zip:
-            assert len(zip.filelist) == 1
-            return zip.read(zip.filelist[0]).decode(encoding="utf-8", errors='strict')
+    def download_export(
+        self,
+        qualtrics_id: str,
+        file_id: str,
+        filename: Path,
+        download_callback: t.Callable[[int], None] = lambda _: None,
+    ) -> int:
+        # Streams the export's zip file to disk, reporting bytes received so far
+        endpoint_prefix = "surveys/{}/export-responses".format(qualtrics_id)
+        received = 0
+        with self.get("{}/{}/file".format(endpoint_prefix, file_id), stream=True) as response:
+            response.raise_for_status()
+            with open(filename, 'wb') as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    received += len(chunk)
+                    download_callback(received)
+        return received
 
     def fetch_remote_table_schema(self, qualtrics_id: str) -> str:
         endpoint_prefix = "surveys/{}/response-schema".format(qualtrics_id)
@@ -1,5 +1,7 @@
 import typing as t
+from pathlib import Path
 from ...common import ImmutableBaseModel
+from ..model import FetchTimings
 from pydantic import BaseSettings, Field
 
 class QualtricsRemoteSettings(BaseSettings):
@@ -7,6 +9,17 @@ class QualtricsRemoteSettings(BaseSettings):
     data_center: t.Optional[str]
     api_url = "https://{data_center}.qualtrics.com/API/v3/{endpoint}"
 
+    # Budget for all API requests, shared by concurrent exports
+    max_requests_per_second = 10.0
+    max_request_burst = 10
+
+    # Export polling backs off between these intervals (seconds)
+    poll_min_interval = 0.5
+    poll_max_interval = 15.0
+
+    # Overall limit for an export to complete (seconds)
+    export_timeout = 1800.0
+
     class Config(BaseSettings.Config):
         env_prefix = "qualtrics_"
 
@@ -18,6 +31,17 @@ class QualtricsSurveyListElement(ImmutableBaseModel):
 class QualtricsSurveyList(ImmutableBaseModel):
     elements: t.List[QualtricsSurveyListElement]
 
+### Get Survey API
+class QualtricsResponseCounts(ImmutableBaseModel):
+    auditable: int
+    generated: int
+    deleted: int
+
+class QualtricsSurveyActivity(ImmutableBaseModel):
+    # The parts of a survey's metadata that change with its responses
+    lastModifiedDate: t.Optional[str]
+    responseCounts: t.Optional[QualtricsResponseCounts]
+
 ### Download Survey API
 
 class QualtricsExportResponse(ImmutableBaseModel):
@@ -30,6 +54,7 @@ class QualtricsExportStatusInProgress(ImmutableBaseModel):
 class QualtricsExportStatusComplete(ImmutableBaseModel):
     status: t.Literal["complete"]
     fileId: t.Optional[str]
+    continuationToken: t.Optional[str]
 
 class QualtricsExportStatusFailed(ImmutableBaseModel):
     status: t.Literal["failed"]
@@ -42,3 +67,11 @@ QualtricsExportStatus = t.Annotated[
     ], Field(discriminator='status')
 ]
 
+### Downloaded exports
+
+class QualtricsExport(t.NamedTuple):
+    data_filename: Path
+    data_checksum: str
+    continuation_token: t.Optional[str]
+    incremental: bool
+    timings: FetchTimings
@@ -1,4 +1,7 @@
 import typing as t
+import io
+import csv
+import hashlib
 
 from pathlib import Path
 
@@ -12,35 +15,37 @@ from ..model import (
 )
 
 from ...unsanitizedtable.io.wearit import (
-    load_unsanitizedtable_wearit,
+    parse_wearit_layout,
 )
 
 
 
 def fetch_wearit_blob(data_path: str | Path, progress_callback: t.Callable[[int], None] = lambda _: None):
+    # Info comes from the schema and the csv header alone; the rows are
+    # parsed once, by whoever loads the blob
     data_path = Path(data_path)
     schema_path = data_path.with_suffix(".json")
 
     table_schema = schema_path.read_text()
     table_data = data_path.read_text()
 
-    table = load_unsanitizedtable_wearit(table_schema, table_data)
-    
+    layout = parse_wearit_layout(table_schema, csv.reader(io.StringIO(table_data, newline='')))
+
     progress_callback(100)
 
     info = BlobInfo(
         fetch_date_utc=datetime.now(timezone.utc),
-        title=table.source_title,
+        title=layout.title,
         source_info=WearitSourceInfo(
             type='wearit',
-            data_checksum=table.data_checksum,
-            schema_checksum=table.schema_checksum,
+            data_checksum=hashlib.sha256(table_data.encode()).hexdigest(),
+            schema_checksum=hashlib.sha256(table_schema.encode()).hexdigest(),
         ),
         columns=tuple(
             SourceColumnInfo(
                 name=c.id.unsafe_name,
                 prompt=c.prompt,
-                ) for c in table.schema
+                ) for c in layout.schema
         )
     )
 
@@ -51,4 +56,3 @@ def fetch_wearit_blob(data_path: str | Path, progress_callback: t.Callable[[int]
             "data.csv": lambda: table_data.encode('utf-8'),
         }
     )    
-    
\ No newline at end of file
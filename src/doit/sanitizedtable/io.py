@@ -2,7 +2,6 @@ import csv
 import hashlib
 
 from ..common.table import (
-    Some,
     Omitted,
 )
 
@@ -10,7 +9,6 @@ from .model import (
     SanitizedColumnId,
     SanitizedTableData,
     SanitizedTableInfo,
-    SanitizedTableRowView,
     SanitizedTable,
     SanitizedSimpleColumnInfo,
 )
@@ -22,16 +20,22 @@ def load_sanitizedtable_csv(csv_text: str, name: str) -> SanitizedTable:
 
     column_ids = tuple(SanitizedColumnId(v) for v in next(reader))
 
-    rows = tuple(
-        SanitizedTableRowView(
-            (h, Some(v) if v else Omitted()) for h, v in zip(column_ids, row)
-        ) for row in reader
+    omitted = Omitted()
+
+    # Non-empty strings go in raw (as Some values)
+    data = SanitizedTableData.from_cells(
+        column_ids,
+        (
+            tuple(v if v else omitted for v in row)
+                for row in reader
+        ),
     )
 
     return SanitizedTable(
         info=SanitizedTableInfo(
             name=name,
             title=name,
+            source="csv",
             data_checksum=hashlib.sha256(csv_text.encode()).hexdigest(),
             schema_checksum=hashlib.sha256(csv_lines[0].encode()).hexdigest(),
             columns=tuple(
@@ -44,9 +48,6 @@ def load_sanitizedtable_csv(csv_text: str, name: str) -> SanitizedTable:
             ),
 
         ),
-        data=SanitizedTableData(
-            column_ids=column_ids,
-            rows=rows,
-        )
+        data=data,
     )
     
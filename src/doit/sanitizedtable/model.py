@@ -37,4 +37,8 @@ SanitizedTableData = TableData[SanitizedColumnId]
 
 class SanitizedTable(t.NamedTuple):
     info: SanitizedTableInfo
-    data: SanitizedTableData
\ No newline at end of file
+    data: SanitizedTableData
+
+class SanitizedTableStream(t.NamedTuple):
+    info: SanitizedTableInfo
+    chunks: t.Iterable[SanitizedTableData]
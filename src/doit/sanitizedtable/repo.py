@@ -1,4 +1,5 @@
 from __future__ import annotations
+import typing as t
 from abc import ABC, abstractmethod
 
 from ..common.table import TableErrorReport
@@ -6,6 +7,7 @@ from ..common.table import TableErrorReport
 from .model import (
     SanitizedTableInfo,
     SanitizedTable,
+    SanitizedTableStream,
 )
 
 class SanitizedTableRepoReader(ABC):
@@ -15,14 +17,33 @@ class SanitizedTableRepoReader(ABC):
     @abstractmethod
     def read_table(self, name: str) -> SanitizedTable: ...
 
+    @abstractmethod
+    def read_tablestream(self, name: str, chunk_size: int) -> SanitizedTableStream: ...
+
+    @abstractmethod
+    def read_tablenames(self) -> t.Tuple[str, ...]: ...
+
     @classmethod
     @abstractmethod
     def open(cls, filename: str = "") -> SanitizedTableRepoReader: ...
 
 class SanitizedTableRepoWriter(ABC):
+    # Writes replace any table of the same name, and only once complete
     @abstractmethod
     def write_table(self, table: SanitizedTable) -> TableErrorReport: ...
 
+    @abstractmethod
+    def write_tablestream(self, stream: SanitizedTableStream) -> TableErrorReport: ...
+
+    @abstractmethod
+    def delete_table(self, name: str): ...
+
+    @classmethod
+    @abstractmethod
+    def new(cls, filename: str = "") -> SanitizedTableRepoWriter: ...
+
+class SanitizedTableRepoUpdater(SanitizedTableRepoReader, SanitizedTableRepoWriter):
+    # An existing repo, opened to replace some of its tables
     @classmethod
     @abstractmethod
-    def new(cls, filename: str = "") -> SanitizedTableRepoWriter: ...
\ No newline at end of file
+    def open_update(cls, filename: str = "") -> SanitizedTableRepoUpdater: ...
\ No newline at end of file
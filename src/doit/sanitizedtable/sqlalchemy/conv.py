@@ -9,7 +9,6 @@ from ...common.table import (
     ErrorValue,
     Redacted,
     TableValue,
-    TableRowView,
     TableErrorReport,
     TableErrorReportItem,
 )
@@ -46,14 +45,13 @@ def tablevalue_from_sql(column: SanitizedColumnInfo, value: t.Any | None):
             return Some(value).assert_type_seq(int)
 
 def tabledata_from_sql(columns: t.Sequence[SanitizedColumnInfo], rows: ResultProxy):
-    return SanitizedTableData(
-            column_ids=tuple(c.id for c in columns),
-            rows=tuple(
-                TableRowView(
-                    (c.id, tablevalue_from_sql(c, row[c.id.name])) for c in columns
-                ) for row in rows
-            )
-        )
+    return SanitizedTableData.from_cells(
+        tuple(c.id for c in columns),
+        (
+            tuple(tablevalue_from_sql(c, row[c.id.name]) for c in columns)
+                for row in rows
+        ),
+    )
 
 def render_tabledata(table: SanitizedTable):
     errors: TableErrorReport = set()
@@ -67,11 +65,15 @@ def render_tabledata(table: SanitizedTable):
         else:
             return filtered_value
 
+    # Render column by column, then zip into the row mappings sqlalchemy expects
+    names = tuple(c.id.name for c in table.info.columns)
+    rendered_columns = tuple(
+        tuple(filter_error(c, v) for v in table.data.column(c.id))
+            for c in table.info.columns
+    )
+
     return (
-        tuple(
-            { c.id.name: filter_error(c, row.get(c.id)) for c in table.info.columns }
-                for row in table.data.rows
-        ),
+        tuple(dict(zip(names, values)) for values in zip(*rendered_columns)),
         errors,
     )
 
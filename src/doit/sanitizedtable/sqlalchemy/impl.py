@@ -1,11 +1,14 @@
 from __future__ import annotations
+import typing as t
+from contextlib import contextmanager
 
 from sqlalchemy import (
     create_engine,
     MetaData,
+    Table,
 )
 
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Engine, Connection
 from ...common.sqlalchemy import SessionWrapper
 
 from .sqlmodel import (
@@ -21,17 +24,21 @@ from .conv import (
     tableinfo_from_sql,
 )
 
+from ...common.table import TableErrorReport
+
 from ..model import (
     SanitizedTable,
     SanitizedTableInfo,
+    SanitizedTableStream,
 )
 
 from ..repo import (
     SanitizedTableRepoReader,
     SanitizedTableRepoWriter,
+    SanitizedTableRepoUpdater,
 )
 
-class SqlAlchemyRepo(SanitizedTableRepoReader, SanitizedTableRepoWriter):
+class SqlAlchemyRepo(SanitizedTableRepoUpdater):
     engine: Engine
     datatable_metadata: MetaData
 
@@ -61,23 +68,76 @@ class SqlAlchemyRepo(SanitizedTableRepoReader, SanitizedTableRepoWriter):
 
         return cls(engine, datatable_metadata)
 
+    @classmethod
+    def open_update(cls, filename: str = "") -> SanitizedTableRepoUpdater:
+        return t.cast(SqlAlchemyRepo, cls.open(filename))
+
+    @contextmanager
+    def transaction(self) -> t.Iterator[t.Tuple[SessionWrapper, Connection]]:
+        # pysqlite only starts a transaction before DML, so CREATE and DROP
+        # would be committed as they ran. BEGIN explicitly, so they commit (or
+        # roll back) along with everything else
+        with self.engine.connect() as conn, conn.begin():
+            conn.exec_driver_sql("BEGIN")
+            yield SessionWrapper(conn), conn
+
+    def drop_table(self, session: SessionWrapper, conn: Connection, name: str):
+        # Also drops a data table without an entry, as left by an aborted
+        # write before writes were transactional
+        for entry in session.get_all_by_name(TableEntrySql, name):
+            for column in entry.columns:
+                session.delete(column)
+            session.delete(entry)
+        # Deletes go out first, so a new entry can take the name
+        session.flush()
+        Table(name, MetaData()).drop(conn, checkfirst=True)
+
     def write_table(self, table: SanitizedTable):
-        session = SessionWrapper(self.engine)
+        return self.write_tablestream(SanitizedTableStream(info=table.info, chunks=(table.data,)))
+
+    def write_tablestream(self, stream: SanitizedTableStream):
+        # Replaces any table of the same name. The old table stays as it was
+        # until the new one is written in full, so a failure partway leaves
+        # the repo as it was
+        name = stream.info.name
+
+        errors: TableErrorReport = set()
 
-        entry = sql_from_tableinfo(table.info)
-        session.add(entry) 
+        with self.transaction() as (session, conn):
+            self.drop_table(session, conn, name)
 
-        new_table = setup_datatable(self.datatable_metadata, entry)
-        new_table.create(self.engine)
+            entry = sql_from_tableinfo(stream.info)
+            session.add(entry)
 
-        rows, errors = render_tabledata(table)
+            new_table = setup_datatable(MetaData(), entry)
+            new_table.create(conn)
 
-        session.insert_rows(new_table, rows)
+            for chunk in stream.chunks:
+                rows, chunk_errors = render_tabledata(SanitizedTable(info=stream.info, data=chunk))
+                session.insert_rows(new_table, rows)
+                errors |= chunk_errors
 
-        session.commit()
+            session.commit()
+
+        if name in self.datatable_metadata.tables:
+            self.datatable_metadata.remove(self.datatable_metadata.tables[name])
+        new_table.to_metadata(self.datatable_metadata)
 
         return errors
 
+    def delete_table(self, name: str):
+        if name not in self.datatable_metadata.tables:
+            raise Exception("Error: No schema for {}".format(name))
+
+        with self.transaction() as (session, conn):
+            self.drop_table(session, conn, name)
+            session.commit()
+
+        self.datatable_metadata.remove(self.datatable_metadata.tables[name])
+
+    def read_tablenames(self) -> t.Tuple[str, ...]:
+        return tuple(self.datatable_metadata.tables)
+
     def read_tableinfo(self, name: str) -> SanitizedTableInfo:
         session = SessionWrapper(self.engine)
         return tableinfo_from_sql(session.get_by_name(TableEntrySql, name))
@@ -98,5 +158,19 @@ class SqlAlchemyRepo(SanitizedTableRepoReader, SanitizedTableRepoWriter):
             info=info,
             data=data,
         )
-        
 
+    def read_tablestream(self, name: str, chunk_size: int) -> SanitizedTableStream:
+        if name not in self.datatable_metadata.tables:
+            raise Exception("Error: No schema for {}".format(name))
+
+        session = SessionWrapper(self.engine)
+
+        info = tableinfo_from_sql(session.get_by_name(TableEntrySql, name))
+
+        return SanitizedTableStream(
+            info=info,
+            chunks=(
+                tabledata_from_sql(info.columns, raw_rows)
+                    for raw_rows in session.iter_rows(self.datatable_metadata.tables[name], chunk_size)
+            ),
+        )
@@ -0,0 +1,221 @@
+from __future__ import annotations
+import typing as t
+import os
+import mmap
+import pickle
+import tempfile
+from pathlib import Path
+from collections import abc
+
+# A precompiled copy of an instrument's sanitizers, kept next to their csvs.
+# Each csv is checked against the bundle by mtime and size (then checksum),
+# so unchanged sanitizers load without being parsed; their maps are only
+# unpickled once something looks them up
+
+from .model import (
+    BatchLookupMap,
+    LookupKey,
+    LookupOutput,
+    LookupSanitizer,
+    SanitizedColumnId,
+    TableSanitizer,
+    UnsanitizedColumnId,
+)
+
+from .io import (
+    load_sanitizer_csv,
+)
+
+from .store import (
+    load_sanitizer_store,
+    read_store_meta,
+    sanitizer_csv_checksum,
+    sanitizer_store_filename,
+)
+
+# Bump whenever the bundle layout or a sanitizer loader's output changes
+BUNDLE_VERSION = 1
+
+BUNDLE_FILENAME = ".sanitizers.bundle"
+
+class BundleEntry(t.NamedTuple):
+    name: str
+    header: t.Tuple[UnsanitizedColumnId | SanitizedColumnId, ...]
+    checksum: str
+    csv_mtime_ns: int
+    csv_size: int
+    # Whether the map is a store handle (see sanitizer.store), rather than
+    # the map itself
+    stored: bool
+    # Size of the map's pickle; maps follow the index in entry order
+    map_size: int
+
+class BundleIndex(t.NamedTuple):
+    version: int
+    entries: t.Tuple[BundleEntry, ...]
+
+class BundledLookupMap(abc.Mapping[LookupKey, LookupOutput]):
+    # A map left pickled in its bundle until first used. The bundle is
+    # mapped into memory, so the map is still readable if it is replaced
+    def __init__(self, filename: Path, buffer: mmap.mmap, offset: int, size: int):
+        self.filename = filename
+        self.buffer = buffer
+        self.offset = offset
+        self.size = size
+        self._map: t.Dict[LookupKey, LookupOutput] | None = None
+
+    @property
+    def map(self) -> t.Dict[LookupKey, LookupOutput]:
+        if self._map is None:
+            self._map = pickle.loads(self.pickled())
+        return self._map
+
+    def pickled(self) -> bytes:
+        return self.buffer[self.offset:self.offset + self.size]
+
+    def __reduce__(self):
+        return (dict, (self.map,))
+
+    def __repr__(self):
+        return "BundledLookupMap({}, {})".format(self.filename, self.offset)
+
+    def __getitem__(self, key: LookupKey) -> LookupOutput:
+        return self.map[key]
+
+    def __iter__(self) -> t.Iterator[LookupKey]:
+        return iter(self.map)
+
+    def __len__(self) -> int:
+        return len(self.map)
+
+def sanitizer_bundle_filename(sanitizer_dir: Path) -> Path:
+    return sanitizer_dir / BUNDLE_FILENAME
+
+def is_stored(csv_filename: Path, csv_size: int, store_min_bytes: int | None) -> bool:
+    return store_min_bytes is not None and csv_size >= store_min_bytes
+
+def load_sanitizer_file(csv_filename: Path, store_min_bytes: int | None) -> LookupSanitizer:
+    if is_stored(csv_filename, csv_filename.stat().st_size, store_min_bytes):
+        return load_sanitizer_store(csv_filename)
+    return load_sanitizer_csv(csv_filename.read_text(), csv_filename.stem)
+
+### (Impure) IO functions
+
+def read_sanitizer_bundle(bundle_filename: Path) -> t.Dict[str, t.Tuple[BundleEntry, LookupSanitizer]]:
+    # Bundled sanitizers by name, with maps left unread. Empty if the bundle
+    # is missing, unreadable or from another version
+    try:
+        with open(bundle_filename, 'rb') as f:
+            index = pickle.load(f)
+            if not isinstance(index, BundleIndex) or index.version != BUNDLE_VERSION:
+                return {}
+            offset = f.tell()
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if offset + sum(entry.map_size for entry in index.entries) != len(buffer):
+            return {}
+
+        result: t.Dict[str, t.Tuple[BundleEntry, LookupSanitizer]] = {}
+        for entry in index.entries:
+            map = BundledLookupMap(bundle_filename, buffer, offset, entry.map_size)
+            offset += entry.map_size
+            result[entry.name] = (entry, LookupSanitizer(
+                name=entry.name,
+                # Store handles are small, and must stay BatchLookupMaps
+                map=pickle.loads(map.pickled()) if entry.stored else map,
+                header=entry.header,
+                checksum=entry.checksum,
+            ))
+        return result
+    except Exception:
+        # Unpickling can fail in many ways (e.g. a class that has since
+        # moved); any bundle that can't be read is rebuilt
+        return {}
+
+def write_sanitizer_bundle(bundle_filename: Path, sanitizers: t.Sequence[t.Tuple[os.stat_result, LookupSanitizer]]):
+    # Each sanitizer goes with the stat of its csv from before it was loaded,
+    # so a csv changed since is caught on the next load
+    def pickled_map(sanitizer: LookupSanitizer) -> bytes:
+        # Maps still pickled in the old bundle are copied without unpickling
+        if isinstance(sanitizer.map, BundledLookupMap) and sanitizer.map._map is None:
+            return sanitizer.map.pickled()
+        return pickle.dumps(sanitizer.map, pickle.HIGHEST_PROTOCOL)
+
+    maps = tuple(pickled_map(s) for _, s in sanitizers)
+
+    index = BundleIndex(
+        version=BUNDLE_VERSION,
+        entries=tuple(
+            BundleEntry(
+                name=s.name,
+                header=s.header,
+                checksum=s.checksum,
+                csv_mtime_ns=stat.st_mtime_ns,
+                csv_size=stat.st_size,
+                stored=isinstance(s.map, BatchLookupMap),
+                map_size=len(m),
+            ) for (stat, s), m in zip(sanitizers, maps)
+        ),
+    )
+
+    # Workers sanitizing in parallel may all rewrite the bundle at once
+    fd, tmp_name = tempfile.mkstemp(dir=bundle_filename.parent, prefix=bundle_filename.name, suffix=".tmp")
+    try:
+        with open(fd, 'wb') as f:
+            pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+            for m in maps:
+                f.write(m)
+        os.replace(tmp_name, bundle_filename)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+def load_table_sanitizer_bundled(
+    table_name: str,
+    sanitizer_dir: Path,
+    store_min_bytes: int | None = None,
+) -> TableSanitizer:
+    # Loads the sanitizers in sanitizer_dir through its bundle, parsing only
+    # the csvs that changed since it was written (and rewriting it if any did)
+    bundle_filename = sanitizer_bundle_filename(sanitizer_dir)
+    bundled = read_sanitizer_bundle(bundle_filename)
+
+    def is_current(entry: BundleEntry, csv_filename: Path, stat: os.stat_result) -> bool:
+        if entry.stored != is_stored(csv_filename, stat.st_size, store_min_bytes):
+            return False
+        if entry.stored:
+            # The store must still be there, and built from the same csv
+            meta = read_store_meta(sanitizer_store_filename(csv_filename))
+            if meta is None or meta[0] != entry.checksum:
+                return False
+        if (entry.csv_mtime_ns, entry.csv_size) == (stat.st_mtime_ns, stat.st_size):
+            return True
+        # The csv was touched, or rewritten with the same content
+        return sanitizer_csv_checksum(csv_filename) == entry.checksum
+
+    csv_filenames = tuple(sanitizer_dir.glob("*.csv"))
+
+    sanitizers: t.List[t.Tuple[os.stat_result, LookupSanitizer]] = []
+    changed = frozenset(bundled) != frozenset(i.stem for i in csv_filenames)
+
+    for csv_filename in csv_filenames:
+        stat = csv_filename.stat()
+        cached = bundled.get(csv_filename.stem)
+        if cached is not None and is_current(cached[0], csv_filename, stat):
+            entry, sanitizer = cached
+            changed |= (entry.csv_mtime_ns, entry.csv_size) != (stat.st_mtime_ns, stat.st_size)
+        else:
+            sanitizer = load_sanitizer_file(csv_filename, store_min_bytes)
+            changed = True
+        sanitizers.append((stat, sanitizer))
+
+    if changed:
+        if csv_filenames:
+            write_sanitizer_bundle(bundle_filename, sanitizers)
+        else:
+            bundle_filename.unlink(missing_ok=True)
+
+    return TableSanitizer(
+        table_name=table_name,
+        sanitizers=tuple(s for _, s in sanitizers),
+    )
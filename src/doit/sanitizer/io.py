@@ -16,7 +16,6 @@ from ..common.table import (
 
 from ..unsanitizedtable.model import (
     UnsanitizedColumnId,
-    UnsanitizedTableRowView,
 )
 
 from ..sanitizedtable.model import (
@@ -25,6 +24,7 @@ from ..sanitizedtable.model import (
 
 from .model import (
     SanitizedColumnId,
+    LookupKey,
     LookupSanitizer,
     SanitizerUpdate,
 )
@@ -64,47 +64,49 @@ def write_sanitizer_update(f: io.TextIOBase, update: SanitizerUpdate, new: bool)
         ) for row in update.rows
     ))
 
-def load_sanitizer_csv(csv_text: str, name: str) -> LookupSanitizer:
-    reader = csv.reader(io.StringIO(csv_text, newline=''))
-
-    header_str = tuple(next(reader))
-
-    lines = tuple(reader)
-
+def parse_sanitizer_header(header_str: t.Tuple[str, ...]) -> t.Tuple[UnsanitizedColumnId | SanitizedColumnId, ...]:
     if not all(header_str):
         raise EmptyHeaderError(header_str)
 
     if len(set(header_str)) != len(header_str):
         raise DuplicateHeaderError(header_str)
 
-    header = tuple(
+    return tuple(
         SanitizedColumnId(c) if is_header_safe(c) else UnsanitizedColumnId(rename_unsafe_header(c))
             for c in header_str
     )
 
-    keys = tuple(
-        UnsanitizedTableRowView(
-            (c, Some(v) if v else Omitted())
-                for c, v in zip(header, row) if isinstance(c, UnsanitizedColumnId)
-        ) for row in lines
+def parse_sanitizer_row(
+    header: t.Tuple[UnsanitizedColumnId | SanitizedColumnId, ...],
+    row: t.Sequence[str],
+) -> t.Tuple[LookupKey, t.Tuple[t.Tuple[SanitizedColumnId, TableValue[t.Any]], ...]]:
+    omitted = Omitted()
+
+    # Keys are tuples of raw key column values, in header order (== key_col_ids order)
+    key = tuple(
+        v if v else omitted
+            for c, v in zip(header, row) if isinstance(c, UnsanitizedColumnId)
     )
 
-    values = tuple(
-        tuple(
-            (c, Some(v) if v else Redacted())
-                for c, v in zip(header, row)if isinstance(c, SanitizedColumnId)
-        ) for row in lines
+    value = tuple(
+        (c, Some(v) if v else Redacted())
+            for c, v in zip(header, row) if isinstance(c, SanitizedColumnId)
     )
 
+    # Insure key columns have at least one real value
+    if all(k is omitted for k in key):
+        raise EmptySanitizerKeyError(value)
 
-    for key, value in zip(keys, values):
-        # Insure key columns have at least one real value
-        if not any(isinstance(k, Some) for k in key.values()):
-            raise EmptySanitizerKeyError(value)
+    return key, value
+
+def load_sanitizer_csv(csv_text: str, name: str) -> LookupSanitizer:
+    reader = csv.reader(io.StringIO(csv_text, newline=''))
+
+    header = parse_sanitizer_header(tuple(next(reader)))
 
     return LookupSanitizer(
         name=name,
-        map=dict(zip(keys, values)),
+        map=dict(parse_sanitizer_row(header, row) for row in reader),
         header=header,
         checksum=hashlib.sha256(csv_text.encode()).hexdigest(),
-    )
\ No newline at end of file
+    )
@@ -1,4 +1,6 @@
 import typing as t
+from abc import abstractmethod
+from collections import abc
 
 from doit.common.table import TableValue
 
@@ -11,9 +13,19 @@ from ..sanitizedtable.model import (
     SanitizedColumnId,
 )
 
+# Lookup keys are the raw values of the key columns, in key_col_ids order (see common.table.to_raw)
+LookupKey = t.Tuple[t.Any, ...]
+LookupOutput = t.Tuple[t.Tuple[SanitizedColumnId, TableValue[t.Any]], ...]
+
+class BatchLookupMap(abc.Mapping[LookupKey, LookupOutput]):
+    # A lookup map that is cheaper to probe for many keys at once than one
+    # key at a time (see sanitizer.store)
+    @abstractmethod
+    def get_many(self, keys: t.Iterable[LookupKey]) -> t.Dict[LookupKey, LookupOutput]: ...
+
 class LookupSanitizer(t.NamedTuple):
     name: str
-    map: t.Mapping[UnsanitizedTableRowView, t.Tuple[t.Tuple[SanitizedColumnId, TableValue[t.Any]], ...]]
+    map: t.Mapping[LookupKey, LookupOutput]
     header: t.Tuple[UnsanitizedColumnId | SanitizedColumnId, ...]
     checksum: str
 
@@ -0,0 +1,204 @@
+from __future__ import annotations
+import typing as t
+import csv
+import json
+import os
+import sqlite3
+import hashlib
+import tempfile
+from pathlib import Path
+from itertools import islice
+from contextlib import closing
+
+# An indexed, on-disk copy of a sanitizer csv, for sanitizers too large to
+# hold in memory. The csv stays the source of truth: the store records the
+# csv's checksum and is rebuilt whenever it no longer matches
+
+from ..common.table import (
+    Omitted,
+    Redacted,
+    Some,
+)
+
+from .model import (
+    BatchLookupMap,
+    LookupKey,
+    LookupOutput,
+    LookupSanitizer,
+    SanitizedColumnId,
+    UnsanitizedColumnId,
+)
+
+from .io import (
+    parse_sanitizer_header,
+    parse_sanitizer_row,
+)
+
+# Rows inserted per statement
+STORE_BATCH_SIZE = 500
+
+# SQLITE_MAX_VARIABLE_NUMBER before sqlite 3.32; each key probed takes one
+# variable per key column
+STORE_MAX_VARIABLES = 999
+
+def sanitizer_store_filename(csv_filename: Path) -> Path:
+    return csv_filename.with_name(".{}.db".format(csv_filename.stem))
+
+def sanitizer_csv_checksum(csv_filename: Path) -> str:
+    # Same as hashing the file's read_text(), without holding it in memory
+    hash = hashlib.sha256()
+    with open(csv_filename) as f:
+        while chunk := f.read(1 << 20):
+            hash.update(chunk.encode())
+    return hash.hexdigest()
+
+def connect_readonly(filename: Path) -> sqlite3.Connection:
+    return sqlite3.connect(filename.resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+
+def encode_key(key: LookupKey) -> t.Tuple[str, ...] | None:
+    # Key values are stored as text, with "" for Omitted (csv cells are never
+    # empty strings). Keys holding anything else can't be in the store
+    result: t.List[str] = []
+    for v in key:
+        if v is Omitted():
+            result.append("")
+        elif type(v) is str and v:
+            result.append(v)
+        else:
+            return None
+    return tuple(result)
+
+def decode_key(values: t.Sequence[str]) -> LookupKey:
+    return tuple(v if v else Omitted() for v in values)
+
+class SanitizerStoreMap(BatchLookupMap):
+    def __init__(self, filename: Path, header: t.Tuple[UnsanitizedColumnId | SanitizedColumnId, ...]):
+        self.filename = filename
+        self.header = header
+        self.new_col_ids = tuple(c for c in header if isinstance(c, SanitizedColumnId))
+        self.nkeys = len(header) - len(self.new_col_ids)
+        self._conn: sqlite3.Connection | None = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Opened on first use, so the map can be handed to other processes
+        if self._conn is None:
+            self._conn = connect_readonly(self.filename)
+        return self._conn
+
+    def __reduce__(self):
+        return (SanitizerStoreMap, (self.filename, self.header))
+
+    def __repr__(self):
+        return "SanitizerStoreMap({})".format(self.filename)
+
+    def decode_row(self, row: t.Sequence[t.Any]) -> t.Tuple[LookupKey, LookupOutput]:
+        key = decode_key(row[:self.nkeys])
+        values = row[self.nkeys:]
+        return key, tuple((c, Redacted() if v is None else Some(v)) for c, v in zip(self.new_col_ids, values))
+
+    def get_many(self, keys: t.Iterable[LookupKey]) -> t.Dict[LookupKey, LookupOutput]:
+        encoded = (k for k in map(encode_key, keys) if k is not None)
+        key_cols = ", ".join("k{}".format(i) for i in range(self.nkeys))
+        placeholder = "({})".format(", ".join("?" * self.nkeys))
+
+        batch_size = max(1, STORE_MAX_VARIABLES // max(1, self.nkeys))
+
+        result: t.Dict[LookupKey, LookupOutput] = {}
+        while batch := tuple(islice(encoded, batch_size)):
+            rows = self.conn.execute(
+                "SELECT * FROM entries WHERE ({}) IN (VALUES {})".format(key_cols, ", ".join(placeholder for _ in batch)),
+                tuple(v for k in batch for v in k),
+            )
+            result.update(self.decode_row(row) for row in rows)
+        return result
+
+    def __getitem__(self, key: LookupKey) -> LookupOutput:
+        result = self.get_many((key,))
+        if not result:
+            raise KeyError(key)
+        return result[key]
+
+    def __iter__(self) -> t.Iterator[LookupKey]:
+        return (decode_key(row) for row in self.conn.execute(
+            "SELECT {} FROM entries".format(", ".join("k{}".format(i) for i in range(self.nkeys)))
+        ))
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT count(*) FROM entries").fetchone()[0]
+
+### (Impure) IO functions
+
+def read_store_meta(store_filename: Path) -> t.Tuple[str, t.Tuple[str, ...]] | None:
+    # The checksum of the csv the store was built from, and its header
+    try:
+        with closing(connect_readonly(store_filename)) as conn:
+            checksum, header = conn.execute("SELECT checksum, header FROM meta").fetchone()
+    except sqlite3.Error:
+        return None
+    return checksum, tuple(json.loads(header))
+
+def build_sanitizer_store(csv_filename: Path, store_filename: Path, checksum: str):
+    # Streams the csv into a new store, replacing any old one once complete
+    with open(csv_filename, newline='') as f:
+        reader = csv.reader(f)
+        header_str = tuple(next(reader))
+        header = parse_sanitizer_header(header_str)
+
+        nkeys = sum(isinstance(c, UnsanitizedColumnId) for c in header)
+        nvalues = len(header) - nkeys
+
+        fd, tmp_name = tempfile.mkstemp(dir=store_filename.parent, prefix=store_filename.name, suffix=".tmp")
+        os.close(fd)
+        try:
+            conn = sqlite3.connect(tmp_name)
+            try:
+                conn.execute("CREATE TABLE meta (checksum TEXT NOT NULL, header TEXT NOT NULL)")
+                conn.execute("INSERT INTO meta VALUES (?, ?)", (checksum, json.dumps(header_str)))
+                conn.execute("CREATE TABLE entries ({}, PRIMARY KEY ({})) WITHOUT ROWID".format(
+                    ", ".join(["k{} TEXT NOT NULL".format(i) for i in range(nkeys)] + ["v{} TEXT".format(i) for i in range(nvalues)]),
+                    ", ".join("k{}".format(i) for i in range(nkeys)),
+                ))
+
+                def encoded_rows():
+                    for row in reader:
+                        # Short rows leave their last cells empty
+                        key, value = parse_sanitizer_row(header, row + [""] * (len(header) - len(row)))
+                        yield (
+                            *t.cast(t.Tuple[str, ...], encode_key(key)),
+                            *(v.value if isinstance(v, Some) else None for _, v in value),
+                        )
+
+                # Later rows win, as with the in-memory dict
+                insert = "INSERT OR REPLACE INTO entries VALUES ({})".format(", ".join("?" * (nkeys + nvalues)))
+                rows = encoded_rows()
+                while batch := tuple(islice(rows, STORE_BATCH_SIZE)):
+                    conn.executemany(insert, batch)
+                conn.commit()
+            finally:
+                conn.close()
+            os.replace(tmp_name, store_filename)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+
+def load_sanitizer_store(csv_filename: Path) -> LookupSanitizer:
+    # A LookupSanitizer probing the csv's store, built (or rebuilt) as needed
+    store_filename = sanitizer_store_filename(csv_filename)
+
+    checksum = sanitizer_csv_checksum(csv_filename)
+
+    meta = read_store_meta(store_filename)
+    if meta is None or meta[0] != checksum:
+        build_sanitizer_store(csv_filename, store_filename, checksum)
+        meta = read_store_meta(store_filename)
+        assert meta is not None
+
+    header = parse_sanitizer_header(meta[1])
+
+    return LookupSanitizer(
+        name=csv_filename.stem,
+        map=SanitizerStoreMap(store_filename, header),
+        header=header,
+        checksum=checksum,
+    )
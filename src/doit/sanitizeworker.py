@@ -0,0 +1,74 @@
+import typing as t
+from pathlib import Path
+
+# Runs in the worker processes of app.sanitize_sources. The pool's
+# initializer hands each worker its settings; the source a worker is on is
+# kept between tasks, so a worker handed several chunks of one source loads
+# its table and sanitizer, and compiles its plan, only once
+
+from .common.table import capture_error_stacks
+
+from .sanitizer.model import TableSanitizer
+
+from .unsanitizedtable.model import UnsanitizedTable
+
+from .sanitizedtable.model import SanitizedTable
+
+from .service.sanitize import (
+    SanitizationPlan,
+    compile_sanitization_plan,
+    sanitize_table,
+)
+
+class WorkerSettings(t.NamedTuple):
+    blob_from_instrument_name: t.Callable[[str], Path]
+    sanitizer_dir_from_instrument_name: t.Callable[[str], Path]
+    sanitizer_store_min_bytes: int | None
+
+class WorkerSource(t.NamedTuple):
+    name: str
+    table: UnsanitizedTable
+    sanitizer: TableSanitizer
+    plan: SanitizationPlan
+
+_settings: WorkerSettings | None = None
+_source: WorkerSource | None = None
+
+def init_worker(settings: WorkerSettings, debug: bool):
+    global _settings, _source
+    capture_error_stacks(debug)
+    _settings = settings
+    _source = None
+
+def load_source(instrument_name: str) -> WorkerSource:
+    from .app import load_unsanitizedtable, load_table_sanitizer
+
+    global _source
+
+    if _settings is None:
+        raise Exception("Error: sanitize worker was not initialized")
+
+    if _source is None or _source.name != instrument_name:
+        # Let go of the last source before loading the next
+        _source = None
+        table = load_unsanitizedtable(instrument_name, _settings.blob_from_instrument_name)
+        sanitizer = load_table_sanitizer(
+            instrument_name,
+            _settings.sanitizer_dir_from_instrument_name,
+            _settings.sanitizer_store_min_bytes,
+        )
+        _source = WorkerSource(
+            name=instrument_name,
+            table=table,
+            sanitizer=sanitizer,
+            plan=compile_sanitization_plan(table.schema, sanitizer),
+        )
+
+    return _source
+
+def sanitize_chunk(instrument_name: str, start: int, stop: int) -> t.Tuple[SanitizedTable, int]:
+    # Sanitizes rows [start, stop) of a source. Returns them along with the
+    # source's total row count
+    source = load_source(instrument_name)
+    chunk = source.table._replace(data=source.table.data.slice_rows(start, stop))
+    return sanitize_table(chunk, source.sanitizer, source.plan), source.table.data.nrows
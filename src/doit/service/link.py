@@ -110,25 +110,23 @@ def to_dst(
     source_value: TableValue[t.Any],
     dst: DstLink,
 ):
-    single = source_value.assert_type(str)
-    seq = source_value.assert_type_seq(str)
-
+    # Only assert the shape we need; the other one would build an error on every cell
     match dst:
         case CodedDstLink():
             match dst.value_type:
                 case 'multiselect':
-                    result = seq.bind(lookup_fn_seq(dst.value_from_tag))
+                    result = source_value.assert_type_seq(str).bind(lookup_fn_seq(dst.value_from_tag))
                 case 'ordinal' | 'categorical' | 'index':
-                    result = single.bind(lookup_fn(dst.value_from_tag))
+                    result = source_value.assert_type(str).bind(lookup_fn(dst.value_from_tag))
 
         case SimpleDstLink():
             match dst.value_type:
                 case 'text':
-                    result = single.bind(cast_fn(str))
+                    result = source_value.assert_type(str).bind(cast_fn(str))
                 case 'real':
-                    result = single.bind(cast_fn(float))
+                    result = source_value.assert_type(str).bind(cast_fn(float))
                 case 'integer':
-                    result = single.bind(cast_fn(int))
+                    result = source_value.assert_type(str).bind(cast_fn(int))
 
     return (LinkedColumnId(dst.linked_name), result)
 
@@ -232,28 +230,28 @@ def link_table(table: SanitizedTableData, instrument_linker: InstrumentLinker) -
         )
     ))
 
-    rows = tuple(
-        LinkedTableRowView(
-            linker.link_fn(row) for linker in instrument_linker.linkers
-        ) for row in table.rows 
-            if not any(exclude_fn(row) for exclude_fn in instrument_linker.exclude_filters) and
-                not any(i == Some("__EXCLUDE__") for i in row.values())
+    linked_data = LinkedTableData.from_cells(
+        tuple(row_linker.dst_col_id for row_linker in instrument_linker.linkers),
+        (
+            tuple(v for _, v in (linker.link_fn(row) for linker in instrument_linker.linkers))
+                for row in table.rows 
+                    if not any(exclude_fn(row) for exclude_fn in instrument_linker.exclude_filters) and
+                        not any(i == Some("__EXCLUDE__") for i in row.values())
+        ),
     )
 
-    aggregated_rows = tuple(
-        LinkedTableRowView((
-            *row.items(),
-            *(agg.aggregate_fn(row) for agg in instrument_linker.aggregators)
-        )) for row in rows
+    aggregated_data = LinkedTableData.from_cells(
+        tuple(row_agg.linked_id for row_agg in instrument_linker.aggregators),
+        (
+            tuple(v for _, v in (agg.aggregate_fn(row) for agg in instrument_linker.aggregators))
+                for row in linked_data.rows
+        ),
     )
 
     return LinkedTable(
         instrument_name=instrument_linker.instrument_name,
         columns=dst_column_info,
-        data=LinkedTableData(
-            column_ids=tuple(c.id for c in dst_column_info),
-            rows=aggregated_rows,
-        )
+        data=LinkedTableData.combine_tables(linked_data, aggregated_data),
     )
 
 def stub_columnspec(column: SanitizedColumnInfo):
@@ -1,12 +1,19 @@
 import typing as t
+from array import array
 
 from ..common.table import (
     LookupSanitizerMiss,
     Omitted,
     ErrorValue,
+    TableColumn,
+    CELL_ERROR,
+    pack_column_values,
+    to_raw,
 )
 
 from ..sanitizer.model import (
+    LookupKey,
+    BatchLookupMap,
     RowSanitizer,
     LookupSanitizer,
     IdentitySanitizer,
@@ -19,7 +26,9 @@ from ..unsanitizedtable.model import (
     UnsanitizedColumnInfo,
     UnsanitizedCodedColumnInfo,
     UnsanitizedTable,
+    UnsanitizedTableData,
     UnsanitizedTableRowView,
+    UnsanitizedTableStream,
     UnsanitizedSimpleColumnInfo,
 )
 
@@ -29,11 +38,44 @@ from ..sanitizedtable.model import (
     SanitizedTableInfo,
     SanitizedColumnInfo,
     SanitizedTableData,
-    SanitizedTableRowView,
+    SanitizedTableStream,
     SanitizedSimpleColumnInfo,
     SanitizedCodedColumnInfo,
 )
 
+def lookup_key(row: UnsanitizedTableRowView, key_col_ids: t.Sequence[UnsanitizedColumnId]) -> LookupKey:
+    return tuple(to_raw(row.get(c)) for c in key_col_ids)
+
+def contained_keys(existing: t.Container[LookupKey], keys: t.Collection[LookupKey]) -> t.AbstractSet[LookupKey]:
+    # Stores are probed for all the keys at once, rather than one at a time
+    if isinstance(existing, BatchLookupMap):
+        return frozenset(existing.get_many(keys))
+    return frozenset(k for k in keys if k in existing)
+
+def missing_lookup_rows(
+    data: UnsanitizedTableData,
+    key_col_ids: t.Tuple[UnsanitizedColumnId, ...],
+    existing: t.Container[LookupKey],
+) -> t.Tuple[UnsanitizedTableRowView, ...]:
+    # One row per distinct key that has at least one value and isn't in `existing`
+    first_rows: t.Dict[LookupKey, UnsanitizedTableRowView] = {}
+    for row in data.rows:
+        first_rows.setdefault(lookup_key(row, key_col_ids), row)
+
+    present = contained_keys(existing, first_rows.keys())
+
+    result: t.List[UnsanitizedTableRowView] = []
+    for key, row in first_rows.items():
+        if key in present:
+            continue
+        row_subset = row.subset(key_col_ids)
+        error = next((v for v in row_subset.values() if isinstance(v, ErrorValue)), None)
+        if error:
+            raise Exception("Unexpected error value: {}".format(error))
+        if row_subset.has_some():
+            result.append(row_subset)
+    return tuple(result)
+
 def update_tablesanitizer(table: UnsanitizedTable, table_sanitizer: TableSanitizer):
     unsafe_columns = frozenset(c.id for c in table.schema if not c.is_safe)
     sanitized_columns = frozenset(
@@ -49,7 +91,7 @@ def update_tablesanitizer(table: UnsanitizedTable, table_sanitizer: TableSanitiz
             name=c.unsafe_name,
             new=True,
             header=(c, SanitizedColumnId(c.unsafe_name)),
-            rows=tuple({ row for row in table.data.subset([c]).rows if row.has_some() }),
+            rows=missing_lookup_rows(table.data, (c,), ()),
         ) for c in missing_columns
     )
 
@@ -58,10 +100,7 @@ def update_tablesanitizer(table: UnsanitizedTable, table_sanitizer: TableSanitiz
             name=sanitizer.name,
             new=False,
             header=sanitizer.header,
-            rows=tuple(
-                row for row in frozenset(table.data.subset(sanitizer.key_col_ids).rows)
-                    if row not in sanitizer.map and row.has_some()
-            )
+            rows=missing_lookup_rows(table.data, sanitizer.key_col_ids, sanitizer.map),
         ) for sanitizer in table_sanitizer.sanitizers
     )
 
@@ -69,28 +108,43 @@ def update_tablesanitizer(table: UnsanitizedTable, table_sanitizer: TableSanitiz
 
 
 def sanitize_row(row: UnsanitizedTableRowView, sanitizer: RowSanitizer):
-    row_subset = row.subset(sanitizer.key_col_ids) # TODO: Only subset in the case of LookupSanitizer
+    key_values = tuple(row.get(c) for c in sanitizer.key_col_ids)
 
     # If any row keys are Error, return that Error for all new vals
-    error = next((v for v in row_subset.values() if isinstance(v, ErrorValue)), None)
+    error = next((v for v in key_values if isinstance(v, ErrorValue)), None)
     if error:
         return tuple((k, error) for k in sanitizer.new_col_ids)
 
     match sanitizer:
         case LookupSanitizer():
             # If all row keys are Missing, return Missing for all new vals
-            if (all(isinstance(v, Omitted) for v in row_subset.values())):
+            if (all(isinstance(v, Omitted) for v in key_values)):
                 return tuple((k, Omitted()) for k in sanitizer.new_col_ids)
 
             # Lookup the new sanitized columns using the key columns
-            return sanitizer.map.get(row_subset) or tuple(
-                (k,ErrorValue(LookupSanitizerMiss(row_subset, sanitizer.map)))
+            return sanitizer.map.get(tuple(to_raw(v) for v in key_values)) or tuple(
+                (k,ErrorValue(LookupSanitizerMiss(UnsanitizedTableRowView(row.subset(sanitizer.key_col_ids).items()), sanitizer.map)))
                     for k in sanitizer.new_col_ids
             )
         case IdentitySanitizer():
-            return tuple(
-                (new, row_subset.get(old))
-                    for old, new in zip(sanitizer.key_col_ids, sanitizer.new_col_ids)
+            return tuple(zip(sanitizer.new_col_ids, key_values))
+
+def sanitize_tabledata(data: UnsanitizedTableData, sanitizer: RowSanitizer) -> SanitizedTableData:
+    match sanitizer:
+        case IdentitySanitizer() if all(c in data.columns for c in sanitizer.key_col_ids):
+            # Safe columns are shared with the unsanitized table, not copied
+            return SanitizedTableData(
+                column_ids=sanitizer.new_col_ids,
+                columns={ new: data.columns[old] for old, new in zip(sanitizer.key_col_ids, sanitizer.new_col_ids) },
+                nrows=data.nrows,
+            )
+        case _:
+            return SanitizedTableData.from_cells(
+                sanitizer.new_col_ids,
+                (
+                    tuple(v for _, v in sanitize_row(row, sanitizer))
+                        for row in data.rows
+                ),
             )
 
 def bless_column_info(column_info: UnsanitizedColumnInfo) -> SanitizedColumnInfo:
@@ -127,10 +181,9 @@ def sanitize_columns(column_lookup: t.Mapping[UnsanitizedColumnId, UnsanitizedCo
         case IdentitySanitizer():
             return tuple(bless_column_info(column_lookup[id]) for id in sanitizer.key_col_ids)
 
-def sanitize_table(table: UnsanitizedTable, table_sanitizer: TableSanitizer) -> SanitizedTable:
+def all_row_sanitizers(schema: t.Sequence[UnsanitizedColumnInfo], table_sanitizer: TableSanitizer) -> t.Tuple[RowSanitizer, ...]:
+    # Creates an identity sanitizer for safe columns
 
-    # Step 1: Create identity sanitizer for safe columns
-    
     # TODO: Guard against users making new columns with duplicate names
 
     table_sanitizer_new_id_names = frozenset(
@@ -140,16 +193,18 @@ def sanitize_table(table: UnsanitizedTable, table_sanitizer: TableSanitizer) ->
     )
 
     safe_column_sanitizer = IdentitySanitizer(
-        key_col_ids=tuple(c.id for c in table.schema 
+        key_col_ids=tuple(c.id for c in schema 
             if c.is_safe and c.id.unsafe_name not in table_sanitizer_new_id_names
         )
     )
     
-    all_sanitizers = (safe_column_sanitizer, *table_sanitizer.sanitizers)
-    
-    # Step 2: Sanitize columns and rows
+    return (safe_column_sanitizer, *table_sanitizer.sanitizers)
 
-    column_info_lookup = { c.id: c for c in table.schema }
+def sanitized_columns(
+    schema: t.Sequence[UnsanitizedColumnInfo],
+    all_sanitizers: t.Sequence[RowSanitizer],
+) -> t.Tuple[SanitizedColumnInfo, ...]:
+    column_info_lookup = { c.id: c for c in schema }
 
     sanitized_columns_unsorted = tuple(
         c
@@ -157,30 +212,190 @@ def sanitize_table(table: UnsanitizedTable, table_sanitizer: TableSanitizer) ->
                 for c in sanitize_columns(column_info_lookup, sanitizer)
     )
 
-    sanitized_columns = sorted(sanitized_columns_unsorted, key=lambda x: x.sortkey)
+    return tuple(sorted(sanitized_columns_unsorted, key=lambda x: x.sortkey))
 
-    sanitized_rows = tuple(
-        SanitizedTableRowView(
-            v
-                for sanitizer in all_sanitizers
-                    for v in sanitize_row(row, sanitizer) 
-        )
-            for row in table.data.rows
+def sanitize_tableinfo(
+    table: UnsanitizedTable | UnsanitizedTableStream,
+    table_name: str,
+    columns: t.Tuple[SanitizedColumnInfo, ...],
+) -> SanitizedTableInfo:
+    return SanitizedTableInfo(
+        name=table_name,
+        title=table.source_title,
+        data_checksum=table.data_checksum,
+        schema_checksum=table.schema_checksum,
+        source=table.source_name,
+        columns=columns,
     )
-    
-    # Step 3: And then you're done!
 
-    return SanitizedTable(
-        info=SanitizedTableInfo(
-            name=table_sanitizer.table_name,
-            title=table.source_title,
-            data_checksum=table.data_checksum,
-            schema_checksum=table.schema_checksum,
-            source=table.source_name,
-            columns=tuple(sanitized_columns),
+def is_sanitizedtable_current(
+    info: SanitizedTableInfo,
+    data_checksum: str,
+    schema_checksum: str,
+    table_sanitizer: TableSanitizer,
+) -> bool:
+    # Current when sanitized from the same source data and schema, by the
+    # same sanitizers (each lookup column records its sanitizer's checksum)
+    column_sanitizer_checksums = frozenset(
+        c.sanitizer_checksum
+            for c in info.columns
+                if isinstance(c, SanitizedSimpleColumnInfo) and c.sanitizer_checksum is not None
+    )
+    return (
+        (info.data_checksum, info.schema_checksum) == (data_checksum, schema_checksum) and
+        column_sanitizer_checksums == frozenset(s.checksum for s in table_sanitizer.sanitizers)
+    )
+
+### Compiled sanitization plans
+
+class CompiledLookup(t.NamedTuple):
+    sanitizer: LookupSanitizer
+    # Position of each key's output in `outputs`; keys that sanitize_row
+    # would never look up (all Omitted, or holding an error) are left out
+    key_index: t.Mapping[LookupKey, int]
+    # One column per new column id, holding the distinct map outputs.
+    # Position 0 is Omitted, for rows whose keys are all Omitted
+    outputs: t.Tuple[TableColumn[t.Any], ...]
+
+class SanitizationPlan(t.NamedTuple):
+    columns: t.Tuple[SanitizedColumnInfo, ...]
+    steps: t.Tuple[IdentitySanitizer | CompiledLookup, ...]
+
+def compile_lookup(sanitizer: LookupSanitizer, keys: t.Collection[LookupKey] | None = None) -> CompiledLookup:
+    # Compiles the whole map, or only the entries for `keys` if given
+    new_col_ids = sanitizer.new_col_ids
+
+    key_index: t.Dict[LookupKey, int] = {}
+    outputs: t.Dict[t.Tuple[t.Tuple[SanitizedColumnId, t.Any], ...], int] = {}
+
+    entries = sanitizer.map.items() if keys is None else get_many(sanitizer.map, keys).items()
+
+    for key, output in entries:
+        if not output or all(isinstance(k, Omitted) for k in key) or any(isinstance(k, ErrorValue) for k in key):
+            continue
+        key_index[key] = outputs.setdefault(output, len(outputs) + 1)
+
+    return CompiledLookup(
+        sanitizer=sanitizer,
+        key_index=key_index,
+        outputs=tuple(
+            TableColumn.from_values((Omitted(), *(output[i][1] for output in outputs)))
+                for i in range(len(new_col_ids))
         ),
-        data=SanitizedTableData(
-            column_ids=tuple(c.id for c in sanitized_columns),
-            rows=sanitized_rows,
+    )
+
+def get_many(map: t.Mapping[LookupKey, t.Any], keys: t.Collection[LookupKey]) -> t.Mapping[LookupKey, t.Any]:
+    if isinstance(map, BatchLookupMap):
+        return map.get_many(keys)
+    return { k: map[k] for k in keys if k in map }
+
+def compile_step(sanitizer: RowSanitizer) -> IdentitySanitizer | CompiledLookup:
+    match sanitizer:
+        case LookupSanitizer(map=BatchLookupMap()):
+            # Stores are too large to compile whole; their entries are
+            # compiled per chunk of data, for the keys it holds
+            return compile_lookup(sanitizer, ())
+        case LookupSanitizer():
+            return compile_lookup(sanitizer)
+        case IdentitySanitizer():
+            return sanitizer
+
+def compile_sanitization_plan(schema: t.Sequence[UnsanitizedColumnInfo], table_sanitizer: TableSanitizer) -> SanitizationPlan:
+    all_sanitizers = all_row_sanitizers(schema, table_sanitizer)
+    return SanitizationPlan(
+        columns=sanitized_columns(schema, all_sanitizers),
+        steps=tuple(
+            compile_step(s)
+                for s in all_sanitizers
         ),
-    )
\ No newline at end of file
+    )
+
+def gather_lookup(data: UnsanitizedTableData, lookup: CompiledLookup) -> SanitizedTableData:
+    # Finds each row's output by its key, then gathers every new column from
+    # the distinct outputs. Rows that miss the index take the slow path
+    sanitizer = lookup.sanitizer
+    key_col_ids = sanitizer.key_col_ids
+    new_col_ids = sanitizer.new_col_ids
+
+    key_values = tuple(data.columns[c].raw_values() for c in key_col_ids)
+
+    if isinstance(sanitizer.map, BatchLookupMap):
+        lookup = compile_lookup(sanitizer, frozenset(zip(*key_values)))
+
+    key_index = lookup.key_index
+    positions = array('q', bytes(8*data.nrows))
+    errors: t.Dict[int, t.Tuple[ErrorValue, ...]] = {}
+
+    for i, key in enumerate(zip(*key_values)):
+        position = key_index.get(key)
+        if position is not None:
+            positions[i] = position
+        elif not all(isinstance(v, Omitted) for v in key):
+            errors[i] = tuple(v for _, v in sanitize_row(data.rows[i], sanitizer))
+
+    def gather(j: int, output: TableColumn[t.Any]) -> TableColumn[t.Any]:
+        output_values, output_states = output.values, output.states
+        values = [output_values[p] for p in positions]
+        states = array('B', (output_states[p] for p in positions))
+        column_errors = { i: output.errors[p] for i, p in enumerate(positions) if p in output.errors }
+        for i, row_errors in errors.items():
+            values[i] = None
+            states[i] = CELL_ERROR
+            column_errors[i] = row_errors[j]
+        return TableColumn(pack_column_values(values, states), states, column_errors)
+
+    return SanitizedTableData(
+        column_ids=new_col_ids,
+        columns={ c: gather(j, output) for j, (c, output) in enumerate(zip(new_col_ids, lookup.outputs)) },
+        nrows=data.nrows,
+    )
+
+def run_plan_step(data: UnsanitizedTableData, step: IdentitySanitizer | CompiledLookup) -> SanitizedTableData:
+    match step:
+        case CompiledLookup() if all(c in data.columns for c in step.sanitizer.key_col_ids):
+            return gather_lookup(data, step)
+        case CompiledLookup():
+            return sanitize_tabledata(data, step.sanitizer)
+        case IdentitySanitizer():
+            return sanitize_tabledata(data, step)
+
+def sanitize_data(
+    data: UnsanitizedTableData,
+    plan: SanitizationPlan,
+) -> SanitizedTableData:
+    sanitized_data = SanitizedTableData.combine_tables(
+        *(run_plan_step(data, step) for step in plan.steps)
+    )
+
+    return SanitizedTableData(
+        column_ids=tuple(c.id for c in plan.columns),
+        columns={ c.id: sanitized_data.columns[c.id] for c in plan.columns },
+        nrows=sanitized_data.nrows,
+    )
+
+def sanitize_table(
+    table: UnsanitizedTable,
+    table_sanitizer: TableSanitizer,
+    plan: SanitizationPlan | None = None,
+) -> SanitizedTable:
+    # Callers sanitizing many chunks of a table compile its plan once (see
+    # compile_sanitization_plan) and pass it in
+    if plan is None:
+        plan = compile_sanitization_plan(table.schema, table_sanitizer)
+
+    info = sanitize_tableinfo(table, table_sanitizer.table_name, plan.columns)
+
+    return SanitizedTable(
+        info=info,
+        data=sanitize_data(table.data, plan),
+    )
+
+def sanitize_tablestream(stream: UnsanitizedTableStream, table_sanitizer: TableSanitizer) -> SanitizedTableStream:
+    plan = compile_sanitization_plan(stream.schema, table_sanitizer)
+
+    info = sanitize_tableinfo(stream, table_sanitizer.table_name, plan.columns)
+
+    return SanitizedTableStream(
+        info=info,
+        chunks=(sanitize_data(chunk, plan) for chunk in stream.chunks),
+    )
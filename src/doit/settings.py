@@ -1,5 +1,6 @@
 from __future__ import annotations
 import typing as t
+import re
 import yaml
 from pydantic import BaseSettings
 from pathlib import Path
@@ -20,22 +21,53 @@ class AppSettings(BaseSettings):
     ### Sources
     source_dir = Path("./build/unsafe/sources")
 
+    @property
+    def source_catalog_path(self) -> Path:
+        return self.source_dir / "catalog.db"
+
+    @property
+    def blob_store_dir(self) -> Path:
+        return self.source_dir / ".objects"
+
     def source_table_workdir(self, instrument_id: str) -> Path:
         return self.source_dir / instrument_id
 
     def blob_from_instrument_name(self, instrument_name: str) -> Path:
+        # Falls back to a legacy .tar.gz blob until it has been migrated
+        blob = self.blob_container_from_instrument_name(instrument_name)
+        legacy_blob = self.legacy_blob_from_instrument_name(instrument_name)
+        return legacy_blob if not blob.exists() and legacy_blob.exists() else blob
+
+    def blob_container_from_instrument_name(self, instrument_name: str) -> Path:
+        return (self.source_table_workdir(instrument_name) / instrument_name).with_suffix(".blob")
+
+    def legacy_blob_from_instrument_name(self, instrument_name: str) -> Path:
         return (self.source_table_workdir(instrument_name) / instrument_name).with_suffix(".tar.gz")
 
     def blob_bkup_filename(self, instrument_name: str, old_date: datetime) -> Path:
         old_filename = self.blob_from_instrument_name(instrument_name)
         tail = "".join(old_filename.suffixes)
-        new_tail = ".{}.tar.gz".format(int(old_date.timestamp()))
+        new_tail = ".{}{}".format(int(old_date.timestamp()), tail)
         return old_filename.with_name(old_filename.name.replace(tail, new_tail))
 
+    def blob_versions_from_instrument_name(self, instrument_name: str) -> t.Tuple[Path, ...]:
+        # Older versions of a source, as renamed by blob_bkup_filename, oldest first
+        pattern = re.compile(re.escape(instrument_name) + r"\.(\d+)(\.blob|\.tar\.gz)")
+        versions = (
+            (int(m.group(1)), i)
+                for i in self.source_table_workdir(instrument_name).glob(instrument_name + ".*")
+                    if (m := pattern.fullmatch(i.name))
+        )
+        return tuple(i for _, i in sorted(versions))
+
     ### Sanitizers
 
     sanitizer_repo_dir = Path("./build/unsafe/sanitizers")
 
+    # Sanitizer csvs of at least this many bytes are looked up through an
+    # indexed store kept next to them, instead of being loaded into memory
+    sanitizer_store_min_bytes: t.Optional[int] = None
+
     def sanitizer_dir_from_instrument_name(self, instrument_name: str) -> Path:
         return self.sanitizer_repo_dir / instrument_name
 
@@ -132,11 +132,14 @@ def render_tabledata(linked_table: LinkedTable):
         else:
             return filtered_value
 
-    rendered_values = tuple(
-        { c.id.linked_name: filter_error(c, row.get(c.id)) for c in linked_table.columns }
-            for row in linked_table.data.rows
+    names = tuple(c.id.linked_name for c in linked_table.columns)
+    rendered_columns = tuple(
+        tuple(filter_error(c, v) for v in linked_table.data.column(c.id))
+            for c in linked_table.columns
     )
 
+    rendered_values = tuple(dict(zip(names, values)) for values in zip(*rendered_columns))
+
     index_names = tuple(i.id.linked_name for i in linked_table.columns if i.value_type == 'index')
 
     def is_valid_row(row: t.Mapping[str, t.Any]):
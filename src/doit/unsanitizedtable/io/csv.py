@@ -3,7 +3,6 @@ import re
 import hashlib
 
 from ...common.table import (
-    Some,
     Omitted,
     DuplicateHeaderError,
     EmptyHeaderError,
@@ -13,7 +12,6 @@ from ..model import (
     UnsanitizedColumnId,
     UnsanitizedSimpleColumnInfo,
     UnsanitizedTableData,
-    UnsanitizedTableRowView,
     UnsanitizedTable,
 )
 
@@ -47,18 +45,20 @@ def load_unsanitizedtable_csv(csv_text: str, title: str) -> UnsanitizedTable:
 
     column_ids = tuple(c.id for c in schema)
 
-    rows = tuple(
-        UnsanitizedTableRowView(
-            (cid, Some(v) if v else Omitted()) for cid, v in zip(column_ids, row)
-        ) for row in reader
+    omitted = Omitted()
+
+    # Non-empty strings go in raw (as Some values)
+    data = UnsanitizedTableData.from_cells(
+        column_ids,
+        (
+            tuple(v if v else omitted for v in row)
+                for row in reader
+        ),
     )
 
     return UnsanitizedTable(
         schema=schema,
-        data=UnsanitizedTableData(
-            column_ids=column_ids,
-            rows=rows,
-        ),
+        data=data,
         data_checksum=hashlib.sha256(csv_text.encode()).hexdigest(),
         schema_checksum=hashlib.sha256(csv_lines[0].encode()).hexdigest(),
         source_name="csv",
@@ -1,19 +1,20 @@
 import typing as t
 import re
+import io
+import json
 import hashlib
 
 from ...common import ImmutableBaseModel
 
 from pydantic import Field
 
-from collections import abc
 
 from ...common.table import (
     Omitted,
-    TableRowView,
+    ErrorValue,
+    IncorrectType,
     cast_fn_seq,
-    cast_fn,
-    Some,
+    iter_chunks,
 )
 
 from ..model import (
@@ -22,6 +23,7 @@ from ..model import (
     UnsanitizedCodedColumnInfo,
     UnsanitizedTable,
     UnsanitizedTableData,
+    UnsanitizedTableStream,
     UnsanitizedSimpleColumnInfo,
 )
 
@@ -177,44 +179,91 @@ def parse_qualtrics_schema(qs: QualtricsSchema, column_sort_order: t.Mapping[str
         tuple(c for _, c in qmapping)
     )
 
-def from_qualtrics_value(column: UnsanitizedColumnInfo, value: str | t.Sequence[str] | None):
-    # TODO: encode missing values for unasked questions (due to branching, etc) as NotAsked() or something
-    match value:
-        case None | "":
-            return Omitted()
+QualtricsValueDecoder = t.Callable[[t.Any], t.Any]
 
-        case str():
-            match column.value_type:
-                case 'text':
-                    return Some(value)
-                case 'ordinal':
-                    return Some(value).bind(cast_fn(int))
-                case 'multiselect':
-                    raise Exception("Error: expected multiselect value, instead got {}".format(value))
-
-        case abc.Sequence():
-            if column.value_type != 'multiselect':
-                raise Exception("Error: expected multiselect column type, instead got {}".format(column))
+def qualtrics_value_decoder(column: UnsanitizedColumnInfo) -> QualtricsValueDecoder:
+    # Decoders return raw values (standing for Some) or TableValues, for TableData.from_cells
+    # TODO: encode missing values for unasked questions (due to branching, etc) as NotAsked() or something
+    omitted = Omitted()
+
+    def decode_text(value: t.Any):
+        if value is None or value == "":
+            return omitted
+        if isinstance(value, str):
+            return value
+        raise Exception("Error: expected multiselect column type, instead got {}".format(column))
+
+    def decode_ordinal(value: t.Any):
+        if value is None or value == "":
+            return omitted
+        if isinstance(value, str):
+            try:
+                return int(value)
+            except ValueError:
+                return ErrorValue(IncorrectType(value))
+        raise Exception("Error: expected multiselect column type, instead got {}".format(column))
+
+    cast_seq = cast_fn_seq(int)
+
+    def decode_multiselect(value: t.Any):
+        if value is None or value == "":
+            return omitted
+        if isinstance(value, str):
+            raise Exception("Error: expected multiselect value, instead got {}".format(value))
+        return cast_seq(value)
+
+    match column.value_type:
+        case 'text':
+            return decode_text
+        case 'ordinal':
+            return decode_ordinal
+        case 'multiselect':
+            return decode_multiselect
+
+class QualtricsDecoders(t.NamedTuple):
+    value_ids: t.Tuple[str, ...]
+    decoders: t.Tuple[QualtricsValueDecoder, ...]
+
+def compile_qualtrics_decoders(schema_mapping: QualtricsSchemaMapping) -> QualtricsDecoders:
+    qualtrics_ids, columns = schema_mapping
+
+    if qualtrics_ids[0] != 'responseId':
+        raise Exception("Error: expected responseId as the first column of the qualtrics schema")
+
+    return QualtricsDecoders(
+        value_ids=qualtrics_ids[1:],
+        decoders=tuple(qualtrics_value_decoder(c) for c in columns[1:]),
+    )
 
-            return Some(value).bind(cast_fn_seq(int))
+# Compiled decoders, keyed by schema checksum
+_qualtrics_decoders_cache: t.Dict[str, QualtricsDecoders] = {}
 
+def qualtrics_decoders(schema_mapping: QualtricsSchemaMapping, schema_checksum: str) -> QualtricsDecoders:
+    decoders = _qualtrics_decoders_cache.get(schema_checksum)
+    if decoders is None:
+        decoders = _qualtrics_decoders_cache[schema_checksum] = compile_qualtrics_decoders(schema_mapping)
+    return decoders
 
 def parse_qualtrics_data(
     schema_mapping: QualtricsSchemaMapping,
     qd: QualtricsData
 ) -> UnsanitizedTableData:
+    return parse_qualtrics_rows(schema_mapping, compile_qualtrics_decoders(schema_mapping), qd.responses)
 
-
-    rows = tuple(
-        TableRowView(
-            (column.id, (Some(row.responseId)) if name == 'responseId' else from_qualtrics_value(column, row.values.get(name)))
-                for name, column in zip(*schema_mapping)
-        ) for row in qd.responses
-    )
-
-    return UnsanitizedTableData(
-        column_ids=tuple(c.id for c in schema_mapping.columns),
-        rows=rows,
+def parse_qualtrics_rows(
+    schema_mapping: QualtricsSchemaMapping,
+    decoders: QualtricsDecoders,
+    responses: t.Iterable[QualtricsDataRow],
+) -> UnsanitizedTableData:
+    value_ids, value_decoders = decoders
+    return UnsanitizedTableData.from_cells(
+        tuple(c.id for c in schema_mapping.columns),
+        (
+            (
+                row.responseId,
+                *(decode(v) for decode, v in zip(value_decoders, map(row.values.get, value_ids))),
+            ) for row in responses
+        ),
     )
 
 class QualtricsQuestion(ImmutableBaseModel):
@@ -235,9 +284,170 @@ class QualtricsBlock(ImmutableBaseModel):
 class QualtricsSurvey(ImmutableBaseModel):
     blocks: t.Mapping[str, QualtricsBlock]
 
-def load_unsanitizedtable_qualtrics(schema_json: str, data_json: str, survey_json: str) -> UnsanitizedTable:
+class JsonStreamReader:
+    # Decodes a JSON document from a text stream one value at a time, so the
+    # elements of a large array can be consumed without building the whole tree
+    decoder: json.JSONDecoder = json.JSONDecoder()
+
+    def __init__(self, f: t.TextIO, read_size: int = 1 << 16):
+        self.f = f
+        self.read_size = read_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        data = self.f.read(self.read_size)
+        if not data:
+            self.eof = True
+        # Drop consumed input so the buffer stays about one value long
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                raise Exception("Error: unexpected end of JSON input")
+            self.fill()
+
+    def expect(self, c: str):
+        if self.peek() != c:
+            raise Exception("Error: expected '{}' in JSON input, found '{}'".format(c, self.buf[self.pos]))
+        self.pos += 1
+
+    def value(self) -> t.Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # A number at the end of the buffer may be cut short
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            self.fill()
+
+    def items(self) -> t.Iterator[t.Any]:
+        # Yields the elements of the array at the current position
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ']':
+                self.pos += 1
+                return
+            self.expect(',')
+
+    def member_items(self, key: str) -> t.Iterator[t.Any]:
+        # Yields the elements of the array stored under `key` in the top-level object,
+        # skipping over any other members
+        self.expect('{')
+        while self.peek() != '}':
+            name = self.value()
+            self.expect(':')
+            if name == key:
+                yield from self.items()
+            else:
+                self.value()
+            if self.peek() == ',':
+                self.pos += 1
+        self.pos += 1
+        self.end()
+
+    def end(self):
+        # Nothing but whitespace may follow the top-level value
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                raise Exception("Error: unexpected data after end of JSON input")
+            if self.eof:
+                return
+            self.fill()
+
+def merge_qualtrics_responses(base_json: t.TextIO, delta_json: t.TextIO, out: t.TextIO) -> t.Tuple[int, int]:
+    # Writes the responses of base_json with those of delta_json merged in by
+    # responseId: changed responses are replaced in place, new ones appended.
+    # Only the delta is held in memory. Returns (# replaced, # added)
+    delta = { i['responseId']: i for i in JsonStreamReader(delta_json).member_items('responses') }
+
+    replaced = 0
+    first = True
+
+    out.write('{"responses": [')
+
+    def write_item(item: t.Any):
+        nonlocal first
+        if not first:
+            out.write(',')
+        out.write(json.dumps(item))
+        first = False
+
+    for item in JsonStreamReader(base_json).member_items('responses'):
+        update = delta.pop(item['responseId'], None)
+        if update is not None:
+            replaced += 1
+        write_item(item if update is None else update)
+
+    for item in delta.values():
+        write_item(item)
+
+    out.write(']}')
+
+    return replaced, len(delta)
+
+# In trusted mode, the first TRUSTED_SAMPLE_HEAD rows and every
+# TRUSTED_SAMPLE_STRIDE-th row after that are still fully validated
+TRUSTED_SAMPLE_HEAD = 100
+TRUSTED_SAMPLE_STRIDE = 1000
+
+# Sentinel for values the trusted path leaves to pydantic
+_UNTRUSTED = object()
+
+def trusted_qualtrics_value(value: t.Any) -> t.Any:
+    # Only the coercions pydantic makes for Union[str, List[str]] that are
+    # known to match it exactly: strings, lists of strings, and numbers
+    # (which it formats with str()). Anything else (nulls, objects, lists
+    # of non-strings) is left for pydantic to coerce or reject
+    match value:
+        case str():
+            return value
+        case bool() | int() | float():
+            return str(value)
+        case list() if all(isinstance(i, str) for i in value):
+            return value
+        case _:
+            return _UNTRUSTED
+
+def trusted_qualtrics_response(idx: int, item: t.Any) -> QualtricsDataRow:
+    if idx >= TRUSTED_SAMPLE_HEAD and idx % TRUSTED_SAMPLE_STRIDE != 0:
+        match item:
+            case { 'responseId': str(response_id), 'values': dict(values) }:
+                trusted_values = { k: trusted_qualtrics_value(v) for k, v in values.items() }
+                if not any(v is _UNTRUSTED for v in trusted_values.values()):
+                    return QualtricsDataRow.construct(responseId=response_id, values=trusted_values)
+    return QualtricsDataRow.parse_obj(item)
+
+def iter_qualtrics_responses(data_json: t.TextIO, trusted: bool = False) -> t.Iterator[QualtricsDataRow]:
+    # Trusted mode is for data.json files whose checksum matches one we recorded
+    # ourselves; only a sample of rows goes through pydantic
+    items = JsonStreamReader(data_json).member_items('responses')
+    if trusted:
+        return (trusted_qualtrics_response(idx, i) for idx, i in enumerate(items))
+    else:
+        return (QualtricsDataRow.parse_obj(i) for i in items)
+
+def parse_qualtrics_layout(schema_json: str, survey_json: str) -> t.Tuple[QualtricsSchema, QualtricsSchemaMapping]:
     qs = QualtricsSchema.parse_raw(schema_json)
-    qd = QualtricsData.parse_raw(data_json)
     qsurvey = QualtricsSurvey.parse_raw(survey_json)
 
     ordered_question_list = tuple(
@@ -249,14 +459,69 @@ def load_unsanitizedtable_qualtrics(schema_json: str, data_json: str, survey_jso
 
     column_sort_order = { qid.questionId: str(i).zfill(6) for i, qid in enumerate(ordered_question_list)}
 
-    schema_map = parse_qualtrics_schema(qs, column_sort_order)
+    return qs, parse_qualtrics_schema(qs, column_sort_order)
+
+def load_unsanitizedtable_qualtrics(
+    schema_json: str,
+    data_json: str,
+    survey_json: str,
+    trusted_checksum: str | None = None,
+) -> UnsanitizedTable:
+    data_checksum = hashlib.sha256(data_json.encode()).hexdigest()
+
+    return load_unsanitizedtable_qualtrics_file(
+        schema_json,
+        io.StringIO(data_json),
+        survey_json,
+        data_checksum,
+        trusted=data_checksum == trusted_checksum,
+    )
+
+def load_unsanitizedtable_qualtrics_file(
+    schema_json: str,
+    data_json: t.TextIO,
+    survey_json: str,
+    data_checksum: str,
+    trusted: bool = False,
+) -> UnsanitizedTable:
+    # Responses are parsed as data_json is read, so it is never held whole.
+    # Checking it against data_checksum is up to the caller
+    qs, schema_map = parse_qualtrics_layout(schema_json, survey_json)
+
+    schema_checksum = hashlib.sha256(schema_json.encode()).hexdigest()
 
     return UnsanitizedTable(
         schema=schema_map.columns,
-        data=parse_qualtrics_data(schema_map, qd),
-        schema_checksum=hashlib.sha256(schema_json.encode()).hexdigest(),
-        data_checksum=hashlib.sha256(data_json.encode()).hexdigest(),
+        data=parse_qualtrics_rows(
+            schema_map,
+            qualtrics_decoders(schema_map, schema_checksum),
+            iter_qualtrics_responses(data_json, trusted),
+        ),
+        schema_checksum=schema_checksum,
+        data_checksum=data_checksum,
         source_name='qualtrics',
         source_title=qs.title,
     )
 
+def load_unsanitizedtable_qualtrics_stream(
+    schema_json: str,
+    data_json: t.TextIO,
+    survey_json: str,
+    data_checksum: str,
+    chunk_size: int,
+    trusted: bool = False,
+) -> UnsanitizedTableStream:
+    qs, schema_map = parse_qualtrics_layout(schema_json, survey_json)
+
+    schema_checksum = hashlib.sha256(schema_json.encode()).hexdigest()
+    decoders = qualtrics_decoders(schema_map, schema_checksum)
+    responses = iter_qualtrics_responses(data_json, trusted)
+
+    return UnsanitizedTableStream(
+        schema=schema_map.columns,
+        chunks=(parse_qualtrics_rows(schema_map, decoders, chunk) for chunk in iter_chunks(responses, chunk_size)),
+        schema_checksum=schema_checksum,
+        data_checksum=data_checksum,
+        source_name='qualtrics',
+        source_title=qs.title,
+    )
@@ -3,15 +3,16 @@ import typing as t
 import hashlib
 import csv
 import io
+from itertools import chain
 from ...common import ImmutableBaseModel
 from ...common.table import (
     Omitted,
-    Some,
-    cast_fn,
+    ErrorValue,
+    IncorrectType,
     cast_fn_seq,
-    value_if_none_fn,
+    iter_chunks,
 )
-from ..model import UnsanitizedCodedColumnInfo, UnsanitizedColumnId, UnsanitizedColumnInfo, UnsanitizedSimpleColumnInfo, UnsanitizedTable, UnsanitizedTableData, UnsanitizedTableRowView
+from ..model import UnsanitizedCodedColumnInfo, UnsanitizedColumnId, UnsanitizedColumnInfo, UnsanitizedSimpleColumnInfo, UnsanitizedTable, UnsanitizedTableData, UnsanitizedTableStream
 
 class SurveyBlock(ImmutableBaseModel):
     type: t.Literal['block']
@@ -197,27 +198,47 @@ def parse_column(
                 sortkey=column_sort_order[item_str],
             )
 
-def parse_value(column: UnsanitizedColumnInfo | MultiWearitColumnHelper, value: str):
+WearitValueDecoder = t.Callable[[str], t.Tuple[t.Any, ...]]
+
+def wearit_value_decoder(column: UnsanitizedColumnInfo | MultiWearitColumnHelper | None) -> WearitValueDecoder:
+    # Each decoder returns the cells a csv value expands to: raw values (standing
+    # for Some) or TableValues, for TableData.from_cells
+    omitted = Omitted()
+
+    if column is None:
+        return lambda _: ()
+
     if isinstance(column, MultiWearitColumnHelper):
-        pairs = dict(tuple(pair.split(":")) for pair in value.split(",") if pair != "N/A")
-        omitted_if_none_fn = value_if_none_fn(Omitted())
-        return tuple(
-            (c.id, Some(pairs.get(str(k))).bind(omitted_if_none_fn))
-                for k, c in column.info_map.items()
-        )
+        keys = tuple(str(k) for k in column.info_map)
+        all_omitted = tuple(omitted for _ in keys)
+
+        def decode_multislider(value: str):
+            if value == "N/A":
+                return all_omitted
+            pairs = dict(tuple(pair.split(":")) for pair in value.split(",") if pair != "N/A")
+            return tuple(pairs.get(k, omitted) for k in keys)
+
+        return decode_multislider
 
-    if value == "N/A":
-        return ((column.id, Omitted()),)
+    omitted_cell = (omitted,)
 
     match column:
         case UnsanitizedSimpleColumnInfo():
-            return ((column.id, Some(value)),)
+            return lambda value: omitted_cell if value == "N/A" else (value,)
         case UnsanitizedCodedColumnInfo():
             match column.value_type:
                 case 'ordinal':
-                    return ((column.id, Some(value).bind(cast_fn(int))),)
+                    def decode_ordinal(value: str):
+                        if value == "N/A":
+                            return omitted_cell
+                        try:
+                            return (int(value),)
+                        except ValueError:
+                            return (ErrorValue(IncorrectType(value)),)
+                    return decode_ordinal
                 case 'multiselect':
-                    return ((column.id, Some(value.split(",")).bind(cast_fn_seq(int))),)
+                    cast_seq = cast_fn_seq(int)
+                    return lambda value: omitted_cell if value == "N/A" else (cast_seq(value.split(",")),)
 
 def remove_helper(column: UnsanitizedColumnInfo | MultiWearitColumnHelper) -> t.Tuple[UnsanitizedColumnInfo, ...]:
     if isinstance(column, MultiWearitColumnHelper):
@@ -227,30 +248,36 @@ def remove_helper(column: UnsanitizedColumnInfo | MultiWearitColumnHelper) -> t.
 
 FIRST_THREE_COLS = ("submit_date", "complete_date", "pid")
 
-def load_unsanitizedtable_wearit(schema_json: str, data_csv: str) -> UnsanitizedTable:
-
-    wearit_schema = WearitSchema.parse_raw(schema_json)
-
-    item_lookup = dict(flatten_schema_items(wearit_schema.survey.surveyDataItems))
-    column_sort_order = { wearit_id: str(i).zfill(6) for i, wearit_id in enumerate(FIRST_THREE_COLS + tuple(item_lookup)) }
+class WearitDataLayout(t.NamedTuple):
+    columns: t.Tuple[UnsanitizedColumnInfo | MultiWearitColumnHelper | None, ...]
+    decoders: t.Tuple[WearitValueDecoder, ...]
+    schema: t.Tuple[UnsanitizedColumnInfo, ...]
+    title: str
 
-    reader = csv.reader(io.StringIO(data_csv, newline=''))
+# Compiled layouts, keyed by schema checksum and csv header
+_wearit_layout_cache: t.Dict[t.Tuple[str, t.Tuple[str, ...]], WearitDataLayout] = {}
 
+def parse_wearit_layout(schema_json: str, reader: t.Iterator[t.List[str]]) -> WearitDataLayout:
+    # Consumes the header and prompt lines of the data csv
     header = FIRST_THREE_COLS + tuple(next(reader))[3:]
 
     next(reader) # Throw out prompts
 
-    columns = tuple(parse_column(i, item_lookup, column_sort_order) for i in header)
+    cache_key = (hashlib.sha256(schema_json.encode()).hexdigest(), header)
 
-    rows = tuple(
-        UnsanitizedTableRowView(
-            i 
-                for c, v in zip(columns, row)
-                    if c is not None
-                        for i in parse_value(c, v)
-        ) for row in reader
-    )
+    layout = _wearit_layout_cache.get(cache_key)
+    if layout is None:
+        layout = _wearit_layout_cache[cache_key] = compile_wearit_layout(schema_json, header)
 
+    return layout
+
+def compile_wearit_layout(schema_json: str, header: t.Tuple[str, ...]) -> WearitDataLayout:
+    wearit_schema = WearitSchema.parse_raw(schema_json)
+
+    item_lookup = dict(flatten_schema_items(wearit_schema.survey.surveyDataItems))
+    column_sort_order = { wearit_id: str(i).zfill(6) for i, wearit_id in enumerate(FIRST_THREE_COLS + tuple(item_lookup)) }
+
+    columns = tuple(parse_column(i, item_lookup, column_sort_order) for i in header)
 
     columns_nonempty = tuple(c for c in columns if c is not None)
 
@@ -260,14 +287,69 @@ def load_unsanitizedtable_wearit(schema_json: str, data_csv: str) -> Unsanitized
                 for c in remove_helper(i)
     )
 
-    return UnsanitizedTable(
+    return WearitDataLayout(
+        columns=columns,
+        decoders=tuple(wearit_value_decoder(c) for c in columns),
         schema=columns_flat,
+        title=wearit_schema.survey.surveyTitle,
+    )
+
+def parse_wearit_rows(layout: WearitDataLayout, rows: t.Iterable[t.List[str]]) -> UnsanitizedTableData:
+    # Cells are parsed in csv order, then reordered to match the sorted schema
+    data_csv_order = UnsanitizedTableData.from_cells(
+        tuple(i.id for c in layout.columns if c is not None for i in remove_helper(c)),
+        (
+            tuple(chain.from_iterable(decode(v) for decode, v in zip(layout.decoders, row)))
+                for row in rows
+        ),
+    )
+
+    column_ids = tuple(c.id for c in layout.schema)
+
+    return UnsanitizedTableData(
+        column_ids=column_ids,
+        columns={ cid: data_csv_order.columns[cid] for cid in column_ids },
+        nrows=data_csv_order.nrows,
+    )
+
+def load_unsanitizedtable_wearit(schema_json: str, data_csv: str) -> UnsanitizedTable:
+    return load_unsanitizedtable_wearit_file(
+        schema_json,
+        io.StringIO(data_csv, newline=''),
+        hashlib.sha256(data_csv.encode()).hexdigest(),
+    )
+
+def load_unsanitizedtable_wearit_file(schema_json: str, data_csv: t.TextIO, data_checksum: str) -> UnsanitizedTable:
+    # Rows are parsed as data_csv is read. Checking it against data_checksum
+    # is up to the caller
+    reader = csv.reader(data_csv)
+
+    layout = parse_wearit_layout(schema_json, reader)
+
+    return UnsanitizedTable(
+        schema=layout.schema,
         schema_checksum=hashlib.sha256(schema_json.encode()).hexdigest(),
-        data_checksum=hashlib.sha256(data_csv.encode()).hexdigest(),
+        data_checksum=data_checksum,
         source_name="wearit",
-        source_title=wearit_schema.survey.surveyTitle,
-        data=UnsanitizedTableData(
-            column_ids=tuple(c.id for c in columns_flat),
-            rows=rows
-        )
-    )
\ No newline at end of file
+        source_title=layout.title,
+        data=parse_wearit_rows(layout, reader),
+    )
+
+def load_unsanitizedtable_wearit_stream(
+    schema_json: str,
+    data_csv: t.TextIO,
+    data_checksum: str,
+    chunk_size: int,
+) -> UnsanitizedTableStream:
+    reader = csv.reader(data_csv)
+
+    layout = parse_wearit_layout(schema_json, reader)
+
+    return UnsanitizedTableStream(
+        schema=layout.schema,
+        schema_checksum=hashlib.sha256(schema_json.encode()).hexdigest(),
+        data_checksum=data_checksum,
+        source_name="wearit",
+        source_title=layout.title,
+        chunks=(parse_wearit_rows(layout, chunk) for chunk in iter_chunks(reader, chunk_size)),
+    )
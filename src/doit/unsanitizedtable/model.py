@@ -39,3 +39,11 @@ class UnsanitizedTable(t.NamedTuple):
     # Constraint: Column Meta == columns
     # Constraint: All columns are same size
 
+class UnsanitizedTableStream(t.NamedTuple):
+    schema: t.Tuple[UnsanitizedColumnInfo, ...]
+    schema_checksum: str
+    chunks: t.Iterable[UnsanitizedTableData]
+    data_checksum: str
+    source_name: str
+    source_title: str
+
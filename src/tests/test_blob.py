@@ -0,0 +1,276 @@
+import io
+import os
+import json
+import tarfile
+import pytest
+from pydantic import ValidationError
+import gzip
+import hashlib
+import typing as t
+from pathlib import Path
+from datetime import datetime, timezone
+
+from doit.remote.model import (
+    Blob,
+    BlobInfo,
+    BlobManifest,
+    BlobManifestMember,
+    QualtricsSourceInfo,
+)
+
+from doit.remote.blob import (
+    BLOB_HEADER,
+    BLOB_MAGIC,
+    BLOB_VERSION,
+    blob_object_filename,
+    is_blob_container,
+    is_blob_ref,
+    load_blob,
+    migrate_blob,
+    open_from_blob,
+    open_blob,
+    open_blob_stream,
+    read_blob,
+    read_blob_info,
+    read_blob_cached,
+    read_table_cache,
+    table_cache_filename,
+    write_blob_ref,
+)
+
+from .test_qualtrics import SCHEMA_JSON, DATA_JSON
+
+SURVEY_JSON = json.dumps({
+    "blocks": {
+        "BL_1": { "elements": [{ "type": "Question", "questionId": "QID{}".format(i) } for i in range(1, 7)] },
+    },
+})
+
+def sample_blob(data_checksum: str | None = None, data_json: str = DATA_JSON):
+    # The checksum defaults to that of data_json
+    data_checksum = data_checksum or hashlib.sha256(data_json.encode()).hexdigest()
+    return Blob(
+        info=BlobInfo(
+            fetch_date_utc=datetime.now(timezone.utc),
+            title="Test Survey",
+            source_info=QualtricsSourceInfo(
+                type='qualtrics',
+                remote_id="SV_0ojG9qk3wyQw1ro",
+                data_checksum=data_checksum,
+                schema_checksum=hashlib.sha256(SCHEMA_JSON.encode()).hexdigest(),
+            ),
+            columns=(),
+        ),
+        lazydata={
+            "schema.json": lambda: SCHEMA_JSON.encode('utf-8'),
+            "data.json": lambda: data_json.encode('utf-8'),
+            "survey.json": lambda: SURVEY_JSON.encode('utf-8'),
+        },
+    )
+
+def make_blob(filename: Path, data_checksum: str | None = None, data_json: str = DATA_JSON, store_dir: Path | None = None):
+    # Written the way fetches write them, into a store next to the blob by default
+    write_blob_ref(sample_blob(data_checksum, data_json), filename, store_dir or filename.parent / ".objects")
+
+def make_legacy_container(filename: Path):
+    # Blob containers are no longer written, but may still need migrating
+    members: t.Dict[str, BlobManifestMember] = {}
+    data = b""
+    for name, lazycontent in sample_blob().lazydata.items():
+        content = lazycontent()
+        compressed = gzip.compress(content, mtime=0)
+        members[name] = BlobManifestMember(offset=len(data), size=len(content), compressed_size=len(compressed))
+        data += compressed
+    manifest = BlobManifest(info=sample_blob().info, members=members).json().encode('utf-8')
+    filename.write_bytes(BLOB_HEADER.pack(BLOB_MAGIC, BLOB_VERSION, len(manifest)) + manifest + data)
+
+def test_blob_stream(tmp_path: Path):
+    filename = tmp_path / "test.blob"
+    make_blob(filename)
+
+    table = read_blob(filename)
+
+    with open_blob_stream(filename, 3) as stream:
+        chunks = tuple(stream.chunks)
+
+    assert stream.schema == table.schema
+    assert tuple(c.nrows for c in chunks) == (3, 3, 1)
+    assert tuple(row for c in chunks for row in c.rows) == tuple(table.data.rows)
+
+def test_blob_stream_checksum(tmp_path: Path):
+    filename = tmp_path / "test.blob"
+    make_blob(filename, data_checksum="bad")
+
+    with open_blob_stream(filename, 3) as stream:
+        with pytest.raises(Exception, match="checksum"):
+            tuple(stream.chunks)
+
+class RecordingReader(io.RawIOBase):
+    # Records the size of every read
+    def __init__(self, f: t.BinaryIO):
+        self.f = f
+        self.sizes: t.List[int] = []
+
+    def readable(self):
+        return True
+
+    def readinto(self, b: t.Any):
+        data = self.f.read(len(b))
+        b[:len(data)] = data
+        self.sizes.append(len(data))
+        return len(data)
+
+def test_load_blob_validate():
+    # Fetched data is validated as it is read, never held whole
+    data_json = json.dumps({ "responses": json.loads(DATA_JSON)["responses"] * 1000 })
+    blob = open_from_blob(sample_blob(data_json=data_json))
+    data = RecordingReader(blob.open_member('data.json'))
+
+    def open_member(name: str) -> t.BinaryIO:
+        return t.cast(t.BinaryIO, data) if name == 'data.json' else blob.open_member(name)
+
+    table = load_blob(blob._replace(open_member=open_member), validate=True)
+
+    assert table.data.nrows == 7000
+    assert sum(data.sizes) == len(data_json)
+    assert max(data.sizes) < len(data_json) // 10
+
+    with pytest.raises(Exception, match="checksum"):
+        load_blob(open_from_blob(sample_blob("bad")), validate=True)
+
+    with pytest.raises(ValidationError):
+        load_blob(open_from_blob(sample_blob(data_json=json.dumps({ "responses": [{ "responseId": "R_1" }] }))), validate=True)
+
+def test_table_cache(tmp_path: Path):
+    filename = tmp_path / "test.blob"
+    make_blob(filename)
+
+    assert read_table_cache(filename) is None
+
+    table = read_blob_cached(filename)
+
+    cached = read_table_cache(filename)
+
+    assert cached is not None
+    assert cached[1].schema == table.schema
+    assert tuple(cached[1].data.rows) == tuple(read_blob(filename).data.rows)
+
+    # A new blob with different content invalidates the cache
+    other_json = json.dumps(json.loads(DATA_JSON))
+    filename.unlink()
+    make_blob(filename, data_json=other_json)
+
+    read_blob_cached(filename)
+
+    new_cached = read_table_cache(filename)
+
+    assert new_cached is not None
+    assert new_cached[0].data_checksum == hashlib.sha256(other_json.encode()).hexdigest()
+    assert table_cache_filename(filename).exists()
+
+    # A cache referring to a module that no longer exists is rebuilt
+    table_cache_filename(filename).write_bytes(b"cdoit.no_such_module\nTableCacheKey\n.")
+
+    assert read_table_cache(filename) is None
+    assert tuple(read_blob_cached(filename).data.rows) == tuple(read_blob(filename).data.rows)
+    assert read_table_cache(filename) is not None
+
+    # Writers don't share a temp file, and leave none behind
+    other_tmp = tmp_path / (table_cache_filename(filename).name + ".tmp")
+    other_tmp.write_bytes(b"another writer's")
+    files = set(tmp_path.iterdir())
+    os.utime(filename, ns=(0, 0))
+
+    read_blob_cached(filename)
+
+    assert other_tmp.read_bytes() == b"another writer's"
+    assert set(tmp_path.iterdir()) == files
+
+def test_migrate_blob(tmp_path: Path):
+    legacy_filename = tmp_path / "test.tar.gz"
+    filename = tmp_path / "test.blob"
+
+    make_blob(tmp_path / "source.blob")
+
+    # Build a legacy blob with the same members, info.json last
+    with open_blob(tmp_path / "source.blob") as blob:
+        with tarfile.open(legacy_filename, 'w:gz') as tf:
+            entries = (*((n, blob.open_member(n).read()) for n in blob.member_names), ("info.json", blob.info.json().encode('utf-8')))
+            for name, content in entries:
+                ifo = tarfile.TarInfo(name)
+                ifo.size = len(content)
+                tf.addfile(ifo, io.BytesIO(content))
+
+    table = read_blob(legacy_filename)
+
+    migrate_blob(legacy_filename, filename, tmp_path / ".objects")
+
+    assert not legacy_filename.exists()
+    assert is_blob_ref(filename)
+    assert read_blob_info(filename) == read_blob_info(tmp_path / "source.blob")
+    assert tuple(read_blob(filename).data.rows) == tuple(table.data.rows)
+
+    # Blob containers are migrated in place
+    container_filename = tmp_path / "container.blob"
+    make_legacy_container(container_filename)
+
+    assert is_blob_container(container_filename)
+    assert tuple(read_blob(container_filename).data.rows) == tuple(table.data.rows)
+
+    migrate_blob(container_filename, container_filename, tmp_path / ".objects")
+
+    assert is_blob_ref(container_filename)
+    assert tuple(read_blob(container_filename).data.rows) == tuple(table.data.rows)
+
+def test_source_catalog(tmp_path: Path):
+    from contextlib import closing
+    from doit.remote.catalog import open_catalog, read_catalog_names, sync_catalog
+
+    blob_from_instrument_name = lambda name: tmp_path / name / "{}.blob".format(name)
+
+    for name in ("survey_a", "survey_b", "other"):
+        blob_from_instrument_name(name).parent.mkdir()
+        make_blob(blob_from_instrument_name(name))
+
+    with closing(open_catalog(tmp_path / "catalog.db")) as conn:
+        entries = sync_catalog(conn, ("survey_a", "survey_b", "other"), blob_from_instrument_name)
+        assert tuple(e.name for e in entries) == ("other", "survey_a", "survey_b")
+        assert all(e.title == "Test Survey" for e in entries)
+
+        assert read_catalog_names(conn, "survey") == ("survey_a", "survey_b")
+        assert read_catalog_names(conn, "survey%") == ()
+
+        # A rewritten blob is re-read; a missing one is dropped
+        blob_from_instrument_name("survey_a").unlink()
+        make_blob(blob_from_instrument_name("survey_a"), data_checksum="other")
+
+        entries = sync_catalog(conn, ("survey_a", "other"), blob_from_instrument_name)
+        assert tuple(e.name for e in entries) == ("other", "survey_a")
+        assert entries[1].data_checksum == "other"
+
+def test_blob_store(tmp_path: Path):
+    store_dir = tmp_path / ".objects"
+
+    write_blob_ref(sample_blob(), tmp_path / "a" / "a.blob", store_dir)
+    write_blob_ref(sample_blob(), tmp_path / "a" / "a.1.blob", store_dir)
+
+    # Members are stored once, named by the checksums recorded in the info
+    info = read_blob_info(tmp_path / "a" / "a.blob")
+    assert blob_object_filename(store_dir, info.source_info.data_checksum).exists()
+    assert blob_object_filename(store_dir, info.source_info.schema_checksum).exists()
+    assert len(tuple(store_dir.glob("*/*.gz"))) == 3
+
+    table = read_blob(tmp_path / "a" / "a.blob")
+    assert tuple(table.data.rows) == tuple(read_blob(tmp_path / "a" / "a.1.blob").data.rows)
+
+    with open_blob_stream(tmp_path / "a" / "a.blob", 3) as stream:
+        assert tuple(row for c in stream.chunks for row in c.rows) == tuple(table.data.rows)
+
+    # Refs resolve the store relative to themselves
+    (tmp_path / "a").rename(tmp_path / "b")
+    assert tuple(read_blob(tmp_path / "b" / "a.blob").data.rows) == tuple(table.data.rows)
+
+    for i in store_dir.glob("*/*.gz"):
+        i.unlink()
+    with pytest.raises(Exception, match="missing from blob store"):
+        read_blob(tmp_path / "b" / "a.blob")
@@ -1,11 +1,19 @@
+import io
+import json
 import pytest
+from pydantic import ValidationError
 
 from doit.common.table import (
     Some,
     Omitted,
 )
 
+from doit.unsanitizedtable.io import qualtrics
+
 from doit.unsanitizedtable.io.qualtrics import (
+    JsonStreamReader,
+    QualtricsData,
+    iter_qualtrics_responses,
     load_unsanitizedtable_qualtrics,
 )
 
@@ -46,6 +54,31 @@ def test_qualtrics_load2(qualtrics_table: UnsanitizedTable):
 
     assert test_column == expected_column
 
+def test_qualtrics_stream_responses():
+    expected = QualtricsData.parse_raw(DATA_JSON).responses
+
+    assert list(iter_qualtrics_responses(io.StringIO(DATA_JSON))) == expected
+
+    # Values split across buffer refills, other members skipped
+    doc = '{"a": 12345, "responses": [ {"x": [1, 2.5e3]} , "s\\"]" ], "b": {"c": [1]} }'
+
+    for read_size in (1, 2, 3, 7, 64):
+        assert list(JsonStreamReader(io.StringIO(doc), read_size).member_items('responses')) == json.loads(doc)['responses']
+
+def test_qualtrics_trusted_responses(monkeypatch: pytest.MonkeyPatch):
+    # Only the first row goes through pydantic
+    monkeypatch.setattr(qualtrics, 'TRUSTED_SAMPLE_HEAD', 1)
+
+    expected = list(iter_qualtrics_responses(io.StringIO(DATA_JSON)))
+
+    assert list(iter_qualtrics_responses(io.StringIO(DATA_JSON), trusted=True)) == expected
+
+    # Values pydantic would reject are still rejected past the sample
+    for value in ('null', '{"a": "1"}', '[null]'):
+        doc = '{{"responses": [{{"responseId": "R_1", "values": {{}}}}, {{"responseId": "R_2", "values": {{"QID1": {}}}}}]}}'.format(value)
+        with pytest.raises(ValidationError):
+            list(iter_qualtrics_responses(io.StringIO(doc), trusted=True))
+
 @pytest.fixture
 def qualtrics_table():
     return load_unsanitizedtable_qualtrics(SCHEMA_JSON, DATA_JSON)
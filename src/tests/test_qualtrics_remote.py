@@ -0,0 +1,332 @@
+import io
+import asyncio
+import json
+import time
+import hashlib
+import threading
+import typing as t
+import pytest
+from pathlib import Path
+
+from doit.remote.model import BlobInfo, FetchTimings, FetchDecision, OpenBlob
+from doit.remote.qualtrics.impl import (
+    RateLimiter,
+    fetch_qualtrics_blobs,
+    gather_or_cancel,
+    next_poll_interval,
+)
+
+from .test_qualtrics import SCHEMA_JSON, DATA_JSON
+from .test_blob import SURVEY_JSON
+
+from benchmarks.qualtrics_server import MockQualtrics, mock_survey_from_export
+
+def stand_in_settings(server: MockQualtrics, **kwargs: t.Any):
+    # Polled quickly, and without rate limiting
+    return server.settings(poll_min_interval=0.01, max_requests_per_second=1000, **kwargs)
+
+@pytest.fixture
+def stand_in():
+    # Serves the test survey under any id. Exports complete on their third
+    # status check
+    server = MockQualtrics(
+        {},
+        latency=0.01,
+        export_duration=0,
+        polls=3,
+        default_survey=mock_survey_from_export("survey", SCHEMA_JSON, DATA_JSON, SURVEY_JSON),
+    ).start()
+    yield server
+    server.stop()
+
+def test_fetch_qualtrics_blobs(stand_in: MockQualtrics):
+    remote_ids = { "survey_{}".format(i): "SV_{}".format(i) for i in range(6) }
+    remote_ids["broken"] = "SV_fail"
+    stand_in.failing.add("SV_fail")
+
+    blobs: t.Dict[str, t.Tuple[BlobInfo, bytes]] = {}
+    progress: t.Dict[str, t.List[int]] = {}
+    downloaded: t.Dict[str, t.List[int]] = {}
+    timings: t.Dict[str, FetchTimings] = {}
+
+    def progress_callback_fn(name: str):
+        return progress.setdefault(name, []).append
+
+    def download_callback_fn(name: str):
+        return downloaded.setdefault(name, []).append
+
+    # Fetched data only lives until the callback returns
+    def blob_callback(name: str, blob: OpenBlob):
+        with blob.open_member('data.json') as f:
+            blobs[name] = (blob.info, f.read())
+
+    errors = fetch_qualtrics_blobs(
+        remote_ids,
+        progress_callback_fn,
+        blob_callback,
+        max_concurrency=3,
+        settings=stand_in_settings(stand_in),
+        timings_callback=timings.__setitem__,
+        download_callback_fn=download_callback_fn,
+    )
+
+    assert set(errors) == {"broken"}
+    assert str(errors["broken"]) == "export failed"
+    assert set(blobs) == set(remote_ids) - {"broken"}
+
+    for name, (info, data) in blobs.items():
+        assert info.source_info.uri == "qualtrics://" + remote_ids[name]
+        assert data == DATA_JSON.encode('utf-8')
+        assert info.source_info.data_checksum == hashlib.sha256(data).hexdigest()
+        assert progress[name][-1] == 100
+        assert downloaded[name][-1] == timings[name].download_bytes
+        assert timings[name].polls == stand_in.polls
+
+    # Exports overlap, but never beyond the limit
+    assert 1 < stand_in.max_active_exports <= 3
+
+    # Connections are kept alive and reused between requests
+    assert len(stand_in.client_ports) < stand_in.requests
+
+def test_blob_callback_off_loop(stand_in: MockQualtrics):
+    # While one blob's callback is busy, the next survey is still exported
+    stand_in.polls = 1
+
+    threads: t.Set[threading.Thread] = set()
+    running: t.List[str] = []
+    overlapped: t.List[str] = []
+
+    def blob_callback(name: str, blob: OpenBlob):
+        threads.add(threading.current_thread())
+        if running:
+            overlapped.append(name)
+        running.append(name)
+        if name == "first":
+            deadline = time.monotonic() + 5
+            while (stand_in.exports < 2 or stand_in.active_exports) and time.monotonic() < deadline:
+                time.sleep(0.01)
+        running.remove(name)
+
+    errors = fetch_qualtrics_blobs(
+        { "first": "SV_1", "second": "SV_2" },
+        lambda _: lambda _: None,
+        blob_callback,
+        max_concurrency=1,
+        settings=stand_in_settings(stand_in),
+    )
+
+    assert errors == {}
+    # The second export finished before the first callback returned
+    assert stand_in.exports == 2 and stand_in.active_exports == 0
+    assert threading.main_thread() not in threads
+    assert not overlapped
+
+def test_export_timeout(stand_in: MockQualtrics):
+    stand_in.polls = 1000
+
+    errors = fetch_qualtrics_blobs(
+        { "slow": "SV_slow" },
+        lambda _: lambda _: None,
+        lambda *_: None,
+        max_concurrency=1,
+        settings=stand_in_settings(stand_in, export_timeout=0.2),
+    )
+
+    assert "did not complete" in str(errors["slow"])
+    assert stand_in.status_checks["SV_slow"] < 50
+
+def test_next_poll_interval():
+    # 10% in 1s leaves about 8s at that rate; poll after half of it
+    assert next_poll_interval(1, 10, 20, 1, 0.5, 15) == pytest.approx(4)
+    # No progress: back off
+    assert next_poll_interval(1, 20, 20, 1, 0.5, 15) == 2
+    assert next_poll_interval(10, 20, 20, 1, 0.5, 15) == 15
+    # Nearly done
+    assert next_poll_interval(4, 90, 99, 1, 0.5, 15) == 0.5
+
+def test_gather_or_cancel():
+    async def value(v: t.Any):
+        return v
+
+    async def fail(message: str):
+        raise Exception(message)
+
+    cancelled: t.List[bool] = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    assert asyncio.run(gather_or_cancel(value(1), None, value(2))) == (1, None, 2)
+
+    # The rest are cancelled once one fails
+    with pytest.raises(Exception, match="^a$"):
+        asyncio.run(gather_or_cancel(fail("a"), slow()))
+    assert cancelled == [True]
+
+    # Every failure is reported
+    with pytest.raises(Exception, match="a; b"):
+        asyncio.run(gather_or_cancel(fail("a"), fail("b")))
+
+def test_rate_limiter():
+    limiter = RateLimiter(rate=100, burst=5)
+    start = time.monotonic()
+    for _ in range(15):
+        limiter.acquire()
+    # The burst is free; the other 10 are spaced at the rate
+    assert time.monotonic() - start == pytest.approx(0.1, abs=0.05)
+
+def test_incremental_fetch(stand_in: MockQualtrics, tmp_path: Path):
+    from doit.remote.blob import open_blob, write_blob_ref
+    from doit.unsanitizedtable.io.qualtrics import iter_qualtrics_responses
+
+    stand_in.polls = 1
+    settings = stand_in_settings(stand_in)
+
+    filename = tmp_path / "survey.blob"
+
+    def fetch(previous_blobs: t.Mapping[str, Path]):
+        fetched: t.Dict[str, t.Tuple[BlobInfo, str]] = {}
+        def blob_callback(name: str, blob: OpenBlob):
+            with blob.open_member('data.json') as f:
+                fetched[name] = (blob.info, f.read().decode('utf-8'))
+            write_blob_ref(blob, filename, tmp_path / ".objects", overwrite=True)
+        errors = fetch_qualtrics_blobs(
+            { "survey": "SV_1" },
+            lambda _: lambda _: None,
+            blob_callback,
+            max_concurrency=1,
+            settings=settings,
+            previous_blobs=previous_blobs,
+        )
+        assert not errors
+        return fetched["survey"]
+
+    info, data = fetch({})
+    assert info.source_info.continuation_token == "CT_SV_1"
+    assert stand_in.continued_exports == 0
+
+    # Nothing new: the data (and its checksum) are kept as they were
+    info, data = fetch({ "survey": filename })
+    assert stand_in.continued_exports == 1
+    assert data == DATA_JSON
+    assert info.source_info.data_checksum == hashlib.sha256(DATA_JSON.encode()).hexdigest()
+
+    # One changed response and one new one
+    responses = json.loads(DATA_JSON)["responses"]
+    changed = { **responses[1], "values": { **responses[1]["values"], "QID4_TEXT": "Changed" } }
+    added = { **responses[0], "responseId": "R_new" }
+    stand_in.delta_json = json.dumps({ "responses": [changed, added] })
+
+    info, data = fetch({ "survey": filename })
+    merged = tuple(iter_qualtrics_responses(io.StringIO(data)))
+    assert tuple(r.responseId for r in merged) == (*(r["responseId"] for r in responses), "R_new")
+    assert merged[1].values["QID4_TEXT"] == "Changed"
+    assert info.source_info.data_checksum == hashlib.sha256(data.encode()).hexdigest()
+
+    with open_blob(filename) as blob:
+        assert blob.info == info
+
+    # An unknown token falls back to a full export
+    stand_in.continued_exports = 0
+    with open_blob(filename) as blob:
+        write_blob_ref(
+            blob._replace(info=blob.info.copy(update={ "source_info": blob.info.source_info.copy(update={ "continuation_token": "bad" }) })),
+            tmp_path / "stale.blob",
+            tmp_path / ".objects",
+        )
+    info, data = fetch({ "survey": tmp_path / "stale.blob" })
+    assert data == DATA_JSON
+    assert stand_in.continued_exports == 0
+
+    # Other failures are not mistaken for a rejected token
+    stand_in.continue_error = 503
+    exports = stand_in.exports
+    errors = fetch_qualtrics_blobs(
+        { "survey": "SV_1" },
+        lambda _: lambda _: None,
+        lambda *_: None,
+        max_concurrency=1,
+        settings=settings,
+        previous_blobs={ "survey": filename },
+    )
+    assert "503" in str(errors["survey"])
+    assert stand_in.exports == exports
+
+def test_skip_unchanged(stand_in: MockQualtrics, tmp_path: Path):
+    from doit.remote.blob import open_blob, write_blob_ref
+
+    stand_in.polls = 1
+    stand_in.survey_activity = {
+        "lastModifiedDate": "2026-01-01T00:00:00Z",
+        "responseCounts": { "auditable": 2, "generated": 0, "deleted": 0 },
+    }
+    settings = stand_in_settings(stand_in)
+
+    filename = tmp_path / "survey.blob"
+
+    def fetch(previous_blobs: t.Mapping[str, Path], skip_unchanged: bool = False):
+        decisions: t.Dict[str, FetchDecision] = {}
+        def blob_callback(_: str, blob: OpenBlob):
+            # Written without its continuation token, as by older versions
+            source_info = blob.info.source_info.copy(update={ "continuation_token": None })
+            write_blob_ref(blob._replace(info=blob.info.copy(update={ "source_info": source_info })), filename, tmp_path / ".objects", overwrite=True)
+        errors = fetch_qualtrics_blobs(
+            { "survey": "SV_1" },
+            lambda _: lambda _: None,
+            blob_callback,
+            max_concurrency=1,
+            settings=settings,
+            previous_blobs=previous_blobs,
+            decision_callback=decisions.__setitem__,
+            skip_unchanged=skip_unchanged,
+        )
+        assert not errors
+        return decisions["survey"]
+
+    assert fetch({}) == FetchDecision(True, "no previous fetch")
+    assert stand_in.exports == 1
+
+    # Nothing changed: no export is started, and the blob is left alone
+    mtime = filename.stat().st_mtime_ns
+    decision = fetch({ "survey": filename })
+    assert not decision.fetch
+    assert "unchanged since" in decision.reason
+    assert "--full" in decision.reason
+    assert stand_in.exports == 1
+    assert filename.stat().st_mtime_ns == mtime
+
+    # New responses
+    stand_in.survey_activity["responseCounts"] = { "auditable": 3, "generated": 0, "deleted": 0 }
+    decision = fetch({ "survey": filename })
+    assert decision == FetchDecision(True, "responses 2 -> 3, deleted 0 -> 0")
+    assert stand_in.exports == 2
+
+    # An edited survey
+    stand_in.survey_activity["lastModifiedDate"] = "2026-02-01T00:00:00Z"
+    assert fetch({ "survey": filename }).fetch
+    assert stand_in.exports == 3
+
+    # With a continuation token, an unchanged survey is still exported from
+    # it, which picks up edits to existing responses
+    with open_blob(filename) as blob:
+        source_info = blob.info.source_info.copy(update={ "continuation_token": "CT_SV_1" })
+        write_blob_ref(blob._replace(info=blob.info.copy(update={ "source_info": source_info })), tmp_path / "token.blob", tmp_path / ".objects")
+
+    assert fetch({ "survey": tmp_path / "token.blob" }) == FetchDecision(True, "responses since last fetch")
+    assert stand_in.exports == 4
+    assert stand_in.continued_exports == 1
+
+    # Unless asked to skip unchanged surveys regardless
+    decision = fetch({ "survey": tmp_path / "token.blob" }, skip_unchanged=True)
+    assert not decision.fetch
+    assert stand_in.exports == 4
+
+    # A changed survey is then still exported from its token
+    stand_in.survey_activity["responseCounts"] = { "auditable": 4, "generated": 0, "deleted": 0 }
+    assert fetch({ "survey": tmp_path / "token.blob" }, skip_unchanged=True) == FetchDecision(True, "responses 3 -> 4, deleted 0 -> 0")
+    assert stand_in.exports == 5
+    assert stand_in.continued_exports == 2
@@ -1,5 +1,9 @@
 from textwrap import dedent
-from doit.sanitizedtable.model import SanitizedColumnId
+from pathlib import Path
+from functools import partial
+import typing as t
+import pytest
+from doit.sanitizedtable.model import SanitizedColumnId, SanitizedTableData, SanitizedTableStream
 
 from doit.common.table import (
     Redacted,
@@ -9,6 +13,11 @@ from doit.sanitizer.io import (
     load_sanitizer_csv,
 )
 
+from doit.unsanitizedtable.model import (
+    UnsanitizedTableData,
+    UnsanitizedTableStream,
+)
+
 from doit.unsanitizedtable.io.csv import (
     load_unsanitizedtable_csv,
 )
@@ -19,6 +28,7 @@ from doit.sanitizedtable.io import (
 
 from doit.service.sanitize import (
     sanitize_table,
+    sanitize_tablestream,
 )
 
 from doit.sanitizer.model import (
@@ -60,8 +70,181 @@ def test_sanitize():
 
     expected_table = load_sanitizedtable_csv(expected_raw, "test_table")
 
-    # Monkeypatch to put in the redacted value
-    expected_table.data.rows[1]._map[SanitizedColumnId('c')] = Redacted() # type: ignore
+    # Put in the redacted value
+    expected_data = expected_table.data
+    expected_data = SanitizedTableData.from_cells(
+        expected_data.column_ids,
+        (
+            tuple(Redacted() if (i, c) == (1, SanitizedColumnId('c')) else row.get(c) for c in expected_data.column_ids)
+                for i, row in enumerate(expected_data.rows)
+        ),
+    )
+
+    assert sanitizedtable.data == expected_data
+
+
+def test_sanitize_stream():
+    unsanitizedtable_raw = dedent("""\
+        (b),d,z,t
+        1,2,a,b
+        4,5,,c
+        7,,d,e
+    """)
+
+    sanitizer_raw = dedent("""\
+        (b),(d),c,a
+        1,2,3,10
+        4,5,,11
+        7,,9,12
+    """)
+
+    sanitizer = TableSanitizer(
+        table_name="test_table",
+        sanitizers=(
+            load_sanitizer_csv(sanitizer_raw, "test_sanitizer"),
+        ),
+    )
+
+    unsanitizedtable = load_unsanitizedtable_csv(unsanitizedtable_raw, "CSV Import")
+
+    column_ids = unsanitizedtable.data.column_ids
+    rows = unsanitizedtable.data.rows
+
+    stream = UnsanitizedTableStream(
+        schema=unsanitizedtable.schema,
+        schema_checksum=unsanitizedtable.schema_checksum,
+        data_checksum=unsanitizedtable.data_checksum,
+        source_name=unsanitizedtable.source_name,
+        source_title=unsanitizedtable.source_title,
+        chunks=(
+            UnsanitizedTableData.from_rows(column_ids, rows[:1]),
+            UnsanitizedTableData.from_rows(column_ids, rows[1:]),
+        ),
+    )
 
-    assert sanitizedtable.data == expected_table.data
+    sanitizedtable = sanitize_table(unsanitizedtable, sanitizer)
+    sanitizedstream = sanitize_tablestream(stream, sanitizer)
+
+    assert sanitizedstream.info == sanitizedtable.info
+    assert tuple(row for c in sanitizedstream.chunks for row in c.rows) == tuple(sanitizedtable.data.rows)
+
+# Module level, so worker processes can be handed them
+def blob_filename(root: Path, name: str):
+    return root / "{}.blob".format(name)
+
+def sanitizer_dir(root: Path, name: str):
+    return root / name
+
+class Sources(t.NamedTuple):
+    names: t.Tuple[str, ...]
+    blob_from_instrument_name: t.Callable[[str], Path]
+    sanitizer_dir_from_instrument_name: t.Callable[[str], Path]
+
+@pytest.fixture
+def sources(tmp_path: Path):
+    # Two sources, each with a blob and the sanitizers generated for it
+    from doit import app
+    from doit.service.sanitize import update_tablesanitizer
+    from .test_blob import make_blob
+
+    result = Sources(
+        names=("survey_a", "survey_b"),
+        blob_from_instrument_name=partial(blob_filename, tmp_path),
+        sanitizer_dir_from_instrument_name=partial(sanitizer_dir, tmp_path),
+    )
 
+    for name in result.names:
+        make_blob(result.blob_from_instrument_name(name))
+        table = app.load_unsanitizedtable(name, result.blob_from_instrument_name)
+        empty = TableSanitizer(table_name=name, sanitizers=())
+        app.update_sanitizer(name, update_tablesanitizer(table, empty), result.sanitizer_dir_from_instrument_name)
+
+    return result
+
+def test_sanitize_sources(sources: Sources):
+    from doit import app
+
+    names, blob_from_instrument_name, sanitizer_dir_from_instrument_name = sources
+
+    expected = {
+        name: sanitize_table(
+            app.load_unsanitizedtable(name, blob_from_instrument_name),
+            app.load_table_sanitizer(name, sanitizer_dir_from_instrument_name),
+        ) for name in names
+    }
+
+    # Tables of 7 rows, in chunks of 3 spread over the workers
+    streams = app.sanitize_sources(names, blob_from_instrument_name, sanitizer_dir_from_instrument_name, jobs=2, chunk_size=3)
+
+    results = { stream.info.name: (stream.info, tuple(stream.chunks)) for stream in streams }
+
+    assert set(results) == set(names)
+    for name, (info, chunks) in results.items():
+        assert info == expected[name].info
+        assert tuple(c.nrows for c in chunks) == (3, 3, 1)
+        assert tuple(row for c in chunks for row in c.rows) == tuple(expected[name].data.rows)
+
+def test_update_sanitizedtable_repo(tmp_path: Path, sources: Sources):
+    from datetime import datetime
+    from doit import app
+
+    names, blob_from_instrument_name, sanitizer_dir_from_instrument_name = sources
+
+    repo_path = tmp_path / "sanitized.db"
+    snapshots: t.List[Path] = []
+
+    def bkup_path(date: datetime):
+        snapshots.append(tmp_path / "sanitized.{}.db".format(len(snapshots)))
+        return snapshots[-1]
+
+    def update(names: t.Sequence[str]):
+        repo, stale = app.update_sanitizedtable_repo(names, repo_path, bkup_path, blob_from_instrument_name, sanitizer_dir_from_instrument_name)
+        for name in stale:
+            repo.write_table(sanitize_table(
+                app.load_unsanitizedtable(name, blob_from_instrument_name),
+                app.load_table_sanitizer(name, sanitizer_dir_from_instrument_name),
+            ))
+        return stale
+
+    assert update(names) == names
+    assert update(names) == ()
+    assert not snapshots
+
+    # A changed sanitizer re-sanitizes its table, keeping the old one in a snapshot
+    sanitizer_csv = next(sanitizer_dir_from_instrument_name("survey_a").glob("*.csv"))
+    old_info = app.open_sanitizedtable_repo(repo_path).read_tableinfo("survey_a")
+    header = sanitizer_csv.read_text().splitlines()[0]
+    with open(sanitizer_csv, "a") as f:
+        f.write(",".join("unused" for _ in header.split(",")) + "\n")
+
+    assert update(names) == ("survey_a",)
+    assert app.open_sanitizedtable_repo(snapshots[-1]).read_tableinfo("survey_a") == old_info
+    assert update(names) == ()
+
+    # Tables without a source are dropped
+    assert update(("survey_a",)) == ()
+    assert app.open_sanitizedtable_repo(repo_path).read_tablenames() == ("survey_a",)
+    assert app.open_sanitizedtable_repo(snapshots[-1]).read_tablenames() == ("survey_b",)
+
+    # A table that fails partway through writing leaves the old one in place
+    repo = app.open_sanitizedtable_repo(repo_path)
+    table = repo.read_table("survey_a")
+
+    def failing_chunks():
+        yield table.data
+        raise Exception("Error: interrupted")
+
+    with pytest.raises(Exception, match="interrupted"):
+        repo.write_tablestream(SanitizedTableStream(table.info, failing_chunks()))
+
+    repo = app.open_sanitizedtable_repo(repo_path)
+    assert repo.read_tablenames() == ("survey_a",)
+    assert repo.read_table("survey_a") == table
+
+    # ...as does a leftover data table without an entry
+    import sqlite3
+    with sqlite3.connect(repo_path) as conn:
+        conn.execute('CREATE TABLE "survey_b" (x INTEGER)')
+
+    assert update(names) == ("survey_b",)
+    assert app.open_sanitizedtable_repo(repo_path).read_tablenames() == ("survey_a", "survey_b")
@@ -4,6 +4,11 @@ from doit.sanitizedtable.io import (
     load_sanitizedtable_csv,
 )
 
+from doit.sanitizedtable.model import (
+    SanitizedTableData,
+    SanitizedTableStream,
+)
+
 from doit.sanitizedtable.sqlalchemy.impl import (
     SqlAlchemyRepo,
 )
@@ -29,3 +34,39 @@ def test_invariance():
     assert result == sanitizedtable
 
 
+
+def test_stream_invariance():
+    sanitizedtable_raw = dedent("""\
+        c,a,d,z,t
+        3,10,2,a,b
+        ,11,5,,c
+        9,12,,d,e
+    """)
+
+    sanitizedtable = load_sanitizedtable_csv(sanitizedtable_raw, "test_table")
+
+    column_ids = sanitizedtable.data.column_ids
+    rows = sanitizedtable.data.rows
+
+    repo = SqlAlchemyRepo.new()
+
+    assert isinstance(repo, SqlAlchemyRepo)
+
+    repo.write_tablestream(
+        SanitizedTableStream(
+            info=sanitizedtable.info,
+            chunks=(
+                SanitizedTableData.from_rows(column_ids, rows[:2]),
+                SanitizedTableData.from_rows(column_ids, rows[2:]),
+            ),
+        )
+    )
+
+    result = repo.read_tablestream("test_table", 2)
+
+    assert result.info == sanitizedtable.info
+
+    chunks = tuple(result.chunks)
+
+    assert tuple(c.nrows for c in chunks) == (2, 1)
+    assert tuple(row for c in chunks for row in c.rows) == tuple(rows)
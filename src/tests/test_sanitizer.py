@@ -1,4 +1,6 @@
+import os
 import pytest
+import pickle
 from textwrap import dedent
 from itertools import repeat
 
@@ -10,11 +12,13 @@ from doit.common.table import (
     ColumnNotFoundInRow,
     DuplicateHeaderError,
     EmptyHeaderError,
-    ErrorValue
+    ErrorValue,
+    IncorrectType,
 )
 
 from doit.unsanitizedtable.model import (
     UnsanitizedColumnId,
+    UnsanitizedTableData,
     UnsanitizedTableRowView,
 )
 
@@ -22,8 +26,32 @@ from doit.sanitizer.io import (
     load_sanitizer_csv,
 )
 
+from doit.sanitizer.model import (
+    TableSanitizer,
+)
+
+from doit.sanitizer.bundle import (
+    BundledLookupMap,
+    load_table_sanitizer_bundled,
+    sanitizer_bundle_filename,
+)
+
+from doit.sanitizer.store import (
+    SanitizerStoreMap,
+    load_sanitizer_store,
+    sanitizer_store_filename,
+)
+
+from doit.unsanitizedtable.io.csv import (
+    load_unsanitizedtable_csv,
+)
+
 from doit.service.sanitize import (
+    compile_lookup,
+    compile_step,
+    gather_lookup,
     sanitize_row,
+    update_tablesanitizer,
 )
 
 def test_basic_load():
@@ -137,4 +165,161 @@ def test_duplicate_header_error():
     """)
 
     with pytest.raises(DuplicateHeaderError):
-        load_sanitizer_csv(raw, "test_sanitizer")
\ No newline at end of file
+        load_sanitizer_csv(raw, "test_sanitizer")
+
+def test_update_tablesanitizer():
+    table_raw = dedent("""\
+        (b),(d),(e)
+        5,11,x
+        8,,y
+        5,11,x
+        9,13,
+        ,,
+    """)
+
+    sanitizer_raw = dedent("""\
+        a,(b),c,(d)
+        4,5,6,11
+    """)
+
+    table = load_unsanitizedtable_csv(table_raw, "CSV Import")
+    sanitizer = TableSanitizer(
+        table_name="test_table",
+        sanitizers=(load_sanitizer_csv(sanitizer_raw, "test_sanitizer"),),
+    )
+
+    new_update, existing_update = update_tablesanitizer(table, sanitizer)
+
+    assert new_update.new and new_update.name == "e"
+    assert [row.get(UnsanitizedColumnId("e")) for row in new_update.rows] == [Some("x"), Some("y")]
+
+    assert not existing_update.new and existing_update.name == "test_sanitizer"
+    assert [tuple(row.values()) for row in existing_update.rows] == [
+        (Some("8"), Omitted()),
+        (Some("9"), Some("13")),
+    ]
+
+def test_compiled_lookup():
+    raw = dedent("""\
+        a,(b),c,(d)
+        1,2,3,10
+        4,5,,11
+        7,8,9,
+    """)
+
+    sanitizer = load_sanitizer_csv(raw, "test_sanitizer")
+
+    b, d = UnsanitizedColumnId("b"), UnsanitizedColumnId("d")
+    data = UnsanitizedTableData.from_cells((b, d), (
+        (Some("5"), Some("11")),
+        (Some("8"), Omitted()),
+        (Omitted(), Omitted()),
+        (Some("5"), Some("12")),
+        (ErrorValue(IncorrectType("x")), Some("10")),
+        (Some("2"), Some("10")),
+    ))
+
+    # Same cells as sanitizing row by row
+    gathered = gather_lookup(data, compile_lookup(sanitizer))
+    expected = tuple(tuple(v for _, v in sanitize_row(row, sanitizer)) for row in data.rows)
+
+    assert gathered.column_ids == sanitizer.new_col_ids
+    assert tuple(tuple(row.values()) for row in gathered.rows) == expected
+    assert expected[2] == (Omitted(), Omitted())
+    assert expected[1] == (Some("7"), Some("9"))
+
+def test_sanitizer_store(tmp_path):
+    raw = dedent("""\
+        a,(b),c,(d)
+        1,2,3,10
+        4,5,,11
+        7,8,9,
+    """)
+
+    csv_filename = tmp_path / "test_sanitizer.csv"
+    csv_filename.write_text(raw)
+
+    sanitizer = load_sanitizer_csv(raw, "test_sanitizer")
+    stored = load_sanitizer_store(csv_filename)
+
+    assert sanitizer_store_filename(csv_filename).exists()
+    assert stored.header == sanitizer.header
+    assert stored.checksum == sanitizer.checksum
+    assert dict(stored.map.items()) == dict(sanitizer.map.items())
+
+    b, d = UnsanitizedColumnId("b"), UnsanitizedColumnId("d")
+    data = UnsanitizedTableData.from_cells((b, d), (
+        (Some("5"), Some("11")),
+        (Some("8"), Omitted()),
+        (Omitted(), Omitted()),
+        (Some("5"), Some("12")),
+        (Some("2"), Some("10")),
+    ))
+
+    # Probed per chunk, with the same cells as sanitizing row by row
+    step = compile_step(stored)
+    assert not step.key_index
+    gathered = gather_lookup(data, step)
+    expected = tuple(tuple(v for _, v in sanitize_row(row, stored)) for row in data.rows)
+    assert tuple(tuple(row.values()) for row in gathered.rows) == expected
+    assert expected[:3] == tuple(tuple(v for _, v in sanitize_row(row, sanitizer)) for row in data.rows)[:3]
+
+    # Rebuilt when the csv changes
+    csv_filename.write_text(raw + "10,5,11,12\n")
+    updated = load_sanitizer_store(csv_filename)
+    assert tuple(v for _, v in updated.map[("5", "12")]) == (Some("10"), Some("11"))
+
+    # Opens its own connection once unpickled
+    assert dict(pickle.loads(pickle.dumps(updated.map)).items()) == dict(updated.map.items())
+
+def test_sanitizer_bundle(tmp_path):
+    raw_a = dedent("""\
+        a,(b)
+        1,2
+        3,4
+    """)
+
+    raw_c = dedent("""\
+        c,(d)
+        5,6
+    """)
+
+    (tmp_path / "test_a.csv").write_text(raw_a)
+    (tmp_path / "test_c.csv").write_text(raw_c)
+
+    def load():
+        return { s.name: s for s in load_table_sanitizer_bundled("test_table", tmp_path).sanitizers }
+
+    expected = {
+        "test_a": load_sanitizer_csv(raw_a, "test_a"),
+        "test_c": load_sanitizer_csv(raw_c, "test_c"),
+    }
+
+    assert load() == expected
+    assert sanitizer_bundle_filename(tmp_path).exists()
+
+    # Unchanged sanitizers come from the bundle, their maps unread until used
+    bundled = load()
+    assert all(isinstance(s.map, BundledLookupMap) and s.map._map is None for s in bundled.values())
+    assert bundled == expected
+    assert pickle.loads(pickle.dumps(bundled["test_a"].map)) == expected["test_a"].map
+
+    # Touched, but with the same content
+    os.utime(tmp_path / "test_a.csv", ns=(0, 0))
+    assert isinstance(load()["test_a"].map, BundledLookupMap)
+
+    # Changed, and removed
+    (tmp_path / "test_a.csv").write_text(raw_a + "7,8\n")
+    (tmp_path / "test_c.csv").unlink()
+
+    updated = load()
+    assert updated == { "test_a": load_sanitizer_csv(raw_a + "7,8\n", "test_a") }
+    assert not isinstance(updated["test_a"].map, BundledLookupMap)
+    assert isinstance(load()["test_a"].map, BundledLookupMap)
+
+    # Sanitizers moved to a store are bundled as handles to it
+    stored, = load_table_sanitizer_bundled("test_table", tmp_path, 0).sanitizers
+    assert isinstance(stored.map, SanitizerStoreMap)
+    bundled_store, = load_table_sanitizer_bundled("test_table", tmp_path, 0).sanitizers
+    assert isinstance(bundled_store.map, SanitizerStoreMap)
+    assert dict(bundled_store.map.items()) == dict(updated["test_a"].map.items())
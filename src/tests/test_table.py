@@ -0,0 +1,122 @@
+from array import array
+
+from doit.common.table import (
+    Some,
+    Omitted,
+    Redacted,
+    ErrorValue,
+    IncorrectType,
+    MissingCode,
+    TableColumn,
+    TableData,
+    TableRowView,
+    capture_error_stacks,
+    lookup_fn,
+    lookup_fn_seq,
+)
+
+def test_column_roundtrip():
+    values = [Some("a"), Omitted(), Redacted(), ErrorValue(IncorrectType("x")), Some("b")]
+
+    column = TableColumn.from_values(values)
+
+    assert len(column) == 5
+    assert list(column) == values
+
+def test_column_typed_storage():
+    ints = TableColumn.from_values([Some(1), Omitted(), Some(3)])
+    floats = TableColumn.from_values([Some(1.5), Omitted()])
+    mixed = TableColumn.from_values([Some(1), Some("2")])
+
+    assert isinstance(ints.values, array) and ints.values.typecode == 'q'
+    assert isinstance(floats.values, array) and floats.values.typecode == 'd'
+    assert isinstance(mixed.values, tuple)
+
+    assert list(ints) == [Some(1), Omitted(), Some(3)]
+
+def test_rows_adapter():
+    data = TableData.from_cells(
+        ("a", "b"),
+        (
+            (Some("1"), Omitted()),
+            (Some("2"), Some("3")),
+        ),
+    )
+
+    assert data.nrows == 2
+    assert len(data.rows) == 2
+
+    row = data.rows[1]
+    expected = TableRowView((("a", Some("2")), ("b", Some("3"))))
+
+    assert list(row.column_ids()) == ["a", "b"]
+    assert row == expected
+    assert hash(row) == hash(expected)
+    assert isinstance(row.get("c"), ErrorValue)
+
+def test_from_rows():
+    rows = (
+        TableRowView((("a", Some("1")), ("b", Omitted()))),
+        TableRowView((("b", Some("3")), ("a", Some("2")))),
+    )
+
+    data = TableData.from_rows(("a", "b"), rows)
+
+    assert tuple(data.rows) == rows
+    assert list(data.column("a")) == [Some("1"), Some("2")]
+
+def test_lookup_fn():
+    codes = { 1: "a", 2: "b" }
+
+    assert lookup_fn(codes)(1) == Some("a")
+    assert lookup_fn(codes)(3) == ErrorValue(MissingCode(3, codes))
+    assert lookup_fn_seq(codes)((1, 2)) == Some(("a", "b"))
+    assert lookup_fn_seq(codes)((1, 3)) == ErrorValue(MissingCode((1, 3), codes))
+
+def test_error_stack_capture():
+    assert ErrorValue(IncorrectType("x")).traceback == ""
+
+    capture_error_stacks(True)
+    try:
+        assert "test_error_stack_capture" in ErrorValue(IncorrectType("x")).traceback
+    finally:
+        capture_error_stacks(False)
+
+def test_singletons():
+    assert Omitted() is Omitted()
+    assert Redacted() is Redacted()
+    assert Omitted() != Redacted()
+
+def test_raw_cells():
+    data = TableData.from_cells(
+        ("a", "b"),
+        (
+            ("1", Omitted()),
+            (Some("2"), 3),
+        ),
+    )
+
+    assert list(data.column("a")) == [Some("1"), Some("2")]
+    assert list(data.column("b")) == [Omitted(), Some(3)]
+
+def test_subset():
+    data = TableData.from_cells(
+        ("a", "b", "c"),
+        (
+            ("1", "2", "3"),
+            ("4", Omitted(), "6"),
+        ),
+    )
+
+    subset = data.subset(("c", "a"))
+
+    assert subset.column_ids == ("c", "a")
+    assert subset.column("a") is data.column("a")
+    assert list(subset.rows[1].items()) == [("c", Some("6")), ("a", Some("4"))]
+
+    row_subset = data.rows[1].subset(("b", "z"))
+
+    assert list(row_subset.column_ids()) == ["b", "z"]
+    assert row_subset.get("b") == Omitted()
+    assert isinstance(row_subset.get("z"), ErrorValue)
+    assert row_subset == TableRowView((("b", Omitted()), ("z", row_subset.get("z"))))
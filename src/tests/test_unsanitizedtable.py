@@ -1,9 +1,12 @@
+import json
 import pytest
 from textwrap import dedent
 
 from doit.common.table import (
     Some,
     Omitted,
+    ErrorValue,
+    IncorrectType,
     DuplicateHeaderError,
     EmptyHeaderError,
 )
@@ -12,6 +15,10 @@ from doit.unsanitizedtable.io.csv import (
     load_unsanitizedtable_csv,
 )
 
+from doit.unsanitizedtable.io.wearit import (
+    load_unsanitizedtable_wearit,
+)
+
 def test_basic_load():
     raw = dedent("""\
         a,(b),c
@@ -43,6 +50,20 @@ def test_missing_load():
     assert [c.unsafe_name for c in table.data.rows[1].column_ids()] == ["a", "b", "c"]
     assert [c for c in table.data.rows[1].values()] == [Some("4"), Some("5"), Omitted()]
 
+def test_short_row_load():
+    raw = dedent("""\
+        a,b,c
+        1,2,3
+        4,5
+        7,8,9
+    """)
+
+    table = load_unsanitizedtable_csv(raw, "CSV Import")
+
+    assert table.data.nrows == 3
+    assert [c for c in table.data.rows[1].values()] == [Some("4"), Some("5"), Omitted()]
+    assert [c for c in table.data.rows[2].values()] == [Some("7"), Some("8"), Some("9")]
+
 def test_missing_header_error():
     raw = dedent("""\
         a,b,,c
@@ -63,4 +84,47 @@ def test_duplicate_header_error():
     """)
 
     with pytest.raises(DuplicateHeaderError):
-        load_unsanitizedtable_csv(raw, "CSV Import")
\ No newline at end of file
+        load_unsanitizedtable_csv(raw, "CSV Import")
+
+def test_wearit_load(tmp_path):
+    schema_json = json.dumps({
+        "days_on": 1,
+        "days_off": 1,
+        "survey": {
+            "surveyTitle": "Test Survey",
+            "surveyDescription": "",
+            "surveyDataItems": [
+                { "sQuId": 1, "type": "question", "qTy": 0, "qTx": "Choice", "responses": [{ "rTx": "a", "rDVal": 1 }] },
+                { "sQuId": 2, "type": "question", "qTy": 7, "qTx": "Multi", "responses": [{ "rTx": "a", "rDVal": 1 }] },
+                { "sQuId": 3, "type": "question", "qTy": 17, "qTx": "Sliders", "responses": [{ "assRId": 10, "msd": "x" }, { "assRId": 11, "msd": "y" }] },
+            ],
+        },
+    })
+
+    data_csv = dedent("""\
+        a,b,c,Q_3,Q_1,ignored,Q_2
+        p,p,p,p,p,p,p
+        d1,d2,p1,"10:5,11:7",1,z,"1,2"
+        d1,d2,p2,11:3,x,z,N/A
+    """)
+
+    table = load_unsanitizedtable_wearit(schema_json, data_csv)
+
+    assert [c.id.unsafe_name for c in table.schema] == ["submit_date", "complete_date", "pid", "Q_1", "Q_2", "Q_3_10", "Q_3_11"]
+    assert list(table.data.rows[0].values()) == [Some("d1"), Some("d2"), Some("p1"), Some(1), Some((1, 2)), Some("5"), Some("7")]
+    assert list(table.data.rows[1].values()) == [Some("d1"), Some("d2"), Some("p2"), ErrorValue(IncorrectType("x")), Omitted(), Omitted(), Some("3")]
+
+    # Fetching reads only the header; the blob loads to the same table
+    from doit.remote.wearit.impl import fetch_wearit_blob
+    from doit.remote.blob import load_blob, open_from_blob
+
+    (tmp_path / "survey.json").write_text(schema_json)
+    (tmp_path / "survey.csv").write_text(data_csv)
+
+    blob = fetch_wearit_blob(tmp_path / "survey.csv")
+
+    assert blob.info.title == table.source_title
+    assert blob.info.source_info.data_checksum == table.data_checksum
+    assert blob.info.source_info.schema_checksum == table.schema_checksum
+    assert tuple(c.name for c in blob.info.columns) == tuple(c.id.unsafe_name for c in table.schema)
+    assert load_blob(open_from_blob(blob), validate=True) == table